@@ -0,0 +1,95 @@
+"""generate sales tables of any size with a fixed seed.
+
+usage (from the mini-db folder):
+    python3 -m benchmarks.generate --rows 1000000 [--skew 0.5] [--seed 0] [--out data/generated]
+
+Writes `sales1` (saleid|itemid|customerid|storeid|time|qty|pricerange) and
+`sales2` (saleid|I|C|S|T|Q|P) with `rows` rows each, in the format of the files in
+`data/`. Item and customer ids are drawn from a Zipf distribution with exponent
+`skew` (0 for uniform keys). The frequent ids are the same in both tables, so joins
+on customerid = C grow quickly with the skew (above ~0.8 at a million rows).
+The same arguments always produce the same files.
+"""
+import argparse
+import os
+import numpy as np
+
+SALES1 = ["saleid", "itemid", "customerid", "storeid", "time", "qty", "pricerange"]
+SALES2 = ["saleid", "I", "C", "S", "T", "Q", "P"]
+PRICERANGES = np.array(["supercheap", "cheap", "moderate", "expensive", "outrageous"])
+# rows written at once
+CHUNK = 1 << 20
+
+
+def keys(rng, rows, ids, skew):
+    """ draw `rows` values from `ids`, uniformly or Zipf distributed with exponent `skew`
+    (ids[0] is the most frequent one)
+    :return: 1-D int64 np array
+    """
+    if skew == 0:
+        return ids[rng.integers(0, len(ids), rows)]
+    weights = 1.0 / np.arange(1, len(ids) + 1) ** skew
+    return ids[rng.choice(len(ids), rows, p=weights / weights.sum())]
+
+
+def sales(rows, seed=0, skew=0.0, table=0):
+    """ columns of a sales table
+    :param rows: number of rows
+    :param seed: seed of the random generator
+    :param skew: Zipf exponent of the item and customer ids, 0 for uniform ids
+    :param table: number of the table, tables with the same seed share their frequent ids
+    :return: list of 1-D np arrays in the order of SALES1 / SALES2
+    """
+    # about as many items and customers per sale as in data/sales2
+    domain = max(rows // 5, 10)
+    # ids by decreasing frequency, shuffled so that the most frequent id is not always 1
+    ids = np.random.default_rng(seed).permutation(domain) + 1
+    rng = np.random.default_rng([seed, table])
+    return [rng.permutation(rows) + 1,
+            keys(rng, rows, ids, skew),
+            keys(rng, rows, ids, skew),
+            rng.integers(1, 101, rows),
+            rng.integers(1, 101, rows),
+            rng.integers(1, 51, rows),
+            PRICERANGES[rng.integers(0, len(PRICERANGES), rows)]]
+
+
+def write(path, header, columns):
+    """ write columns as a vertical bar delimited file with a header line
+    :return: None
+    """
+    with open(path, "w") as f:
+        f.write("|".join(header) + "\n")
+        for start in range(0, len(columns[0]), CHUNK):
+            lines = columns[0][start:start + CHUNK].astype(str)
+            for col in columns[1:]:
+                lines = np.char.add(np.char.add(lines, "|"), col[start:start + CHUNK].astype(str))
+            f.write("\n".join(lines.tolist()) + "\n")
+
+
+def generate(out_dir, rows, seed=0, skew=0.0):
+    """ write `sales1` and `sales2` with `rows` rows each into `out_dir`
+    :return: paths of sales1 and sales2
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i, header in enumerate((SALES1, SALES2)):
+        path = os.path.join(out_dir, "sales%d" % (i + 1))
+        write(path, header, sales(rows, seed, skew, i))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generate sales tables")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--skew", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="data/generated")
+    args = parser.parse_args()
+    for path in generate(args.out, args.rows, args.seed, args.skew):
+        print("wrote %s" % path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""compare the bulk loader with the original line-by-line loader.
+
+usage (from the mini-db folder):
+    python3 -m benchmarks.loader [--scales 10 100] [--source data/sales2]
+
+`data/sales2` is replicated `scale` times into a temporary file which is then
+loaded by both loaders. Note that the line-by-line loader needs several GB
+of memory at scale 100.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from minidb.loader import Loader
+
+
+def legacy_load(file):
+    """ the original `Database.input_from_file` parsing loop
+    :param file: path to the input file
+    :return: list of column names, 2-D np array of strings
+    """
+    first = True
+    header = None
+    rows = []
+    with open(file, "r") as f:
+        for line in f:
+            split = line.split("|")
+            split = [s.strip() for s in split]
+            if first:
+                first = False
+                header = split
+                continue
+            rows.append(split)
+    return header, np.array(rows)
+
+
+def bulk_load(file):
+    return Loader(file).load()
+
+
+def scale_file(source, scale, out_dir):
+    """ write `source` with its data rows repeated `scale` times
+    :return: path to the scaled file
+    """
+    with open(source, "r") as f:
+        header = f.readline()
+        body = f.read()
+    if not body.endswith("\n"):
+        body += "\n"
+    path = os.path.join(out_dir, "%s_x%d" % (os.path.basename(source), scale))
+    with open(path, "w") as f:
+        f.write(header)
+        for _ in range(scale):
+            f.write(body)
+    return path
+
+
+def measure(load, file):
+    """ run `load` on `file` twice: once timed, once with allocation tracing
+    (tracing slows the run down, so it is kept out of the timing)
+    :return: wall time in seconds, peak traced memory in bytes
+    """
+    start = time.perf_counter()
+    load(file)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    load(file)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark table loading")
+    parser.add_argument("--source", default="data/sales2")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100])
+    args = parser.parse_args()
+
+    print("%-8s %-10s %-12s %-12s %-12s %-12s %-8s" %
+          ("SCALE", "ROWS", "LEGACY (s)", "BULK (s)", "LEGACY (MB)", "BULK (MB)", "SPEEDUP"))
+    with tempfile.TemporaryDirectory() as out_dir:
+        for scale in args.scales:
+            path = scale_file(args.source, scale, out_dir)
+            _, columns = bulk_load(path)
+            legacy_time, legacy_mem = measure(legacy_load, path)
+            bulk_time, bulk_mem = measure(bulk_load, path)
+            print("%-8d %-10d %-12.3f %-12.3f %-12.1f %-12.1f %-8.1f" %
+                  (scale, len(columns[0]), legacy_time, bulk_time, legacy_mem / 2**20,
+                   bulk_mem / 2**20, legacy_time / bulk_time))
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""run minidb commands and their SQL equivalent on SQLite and compare results and times.
+
+usage (from the mini-db folder):
+    python3 -m benchmarks.oracle --rows 100000 [--skew 0.5] [--seed 0] [--repeat 3] [--out oracle.json]
+
+The generated `sales1` / `sales2` tables (see benchmarks.generate) are loaded into
+minidb and into an in-memory SQLite database (with the column types minidb inferred).
+Every case of CASES runs on both, the results are compared as multisets of rows
+(averages up to 1e-3, sort results also by the order of their sort keys) and the best
+wall time of minidb is reported relative to SQLite's. Both sides produce all rows of
+the result: SQLite fetches them and minidb gathers every column.
+The exit status is 1 if a result differs.
+"""
+import argparse
+import json
+import math
+import sqlite3
+import sys
+import tempfile
+import time
+from benchmarks.generate import generate
+from benchmarks.suite import commit
+from minidb.argparser import ArgParser
+from minidb.database import Database
+from minidb.utils import Utils as utils
+
+# (name, minidb statement, SQL query, number of leading sort key columns of an ordered result)
+CASES = [
+    ("select", "R1 := select(R, (time > 50) or (qty < 30))",
+     "SELECT * FROM R WHERE time > 50 OR qty < 30", 0),
+    ("select_arithmetic", "X := select(R, (qty/7 > 3.5) and (pricerange != cheap))",
+     "SELECT * FROM R WHERE qty * 1.0 / 7 > 3.5 AND pricerange != 'cheap'", 0),
+    ("select_float_constant", "X := select(R, (qty > 30.5) or (time*2 = 101))",
+     "SELECT * FROM R WHERE qty > 30.5 OR time * 2 = 101", 0),
+    ("select_text", "X := select(R, pricerange < moderate)",
+     "SELECT * FROM R WHERE pricerange < 'moderate'", 0),
+    ("project", "X := project(R1, saleid, qty, pricerange)",
+     "SELECT saleid, qty, pricerange FROM R WHERE time > 50 OR qty < 30", 0),
+    ("join_equi", "X := join(R, S, R.customerid = S.C)",
+     "SELECT R.*, S.* FROM R JOIN S ON R.customerid = S.C", 0),
+    ("join_equi_band", "X := join(R1, S, (R1.qty > S.Q) and (R1.saleid = S.saleid))",
+     "SELECT R1.*, S.* FROM (SELECT * FROM R WHERE time > 50 OR qty < 30) R1 "
+     "JOIN S ON R1.qty > S.Q AND R1.saleid = S.saleid", 0),
+    ("join_arithmetic", "X := join(R, S, R.saleid*2 = S.saleid)",
+     "SELECT R.*, S.* FROM R JOIN S ON R.saleid * 2 = S.saleid", 0),
+    ("sumgroup", "X := sumgroup(R, qty, time, pricerange)",
+     "SELECT SUM(qty), time, pricerange FROM R GROUP BY time, pricerange", 0),
+    ("avggroup", "X := avggroup(R, qty, pricerange)",
+     "SELECT AVG(qty), pricerange FROM R GROUP BY pricerange", 0),
+    ("countgroup", "X := countgroup(R, qty, storeid)",
+     "SELECT COUNT(qty), storeid FROM R GROUP BY storeid", 0),
+    ("aggregate", "X := aggregate(R, sum(qty), avg(time), min(qty), max(time), count(*) group by pricerange)",
+     "SELECT SUM(qty), AVG(time), MIN(qty), MAX(time), COUNT(*), pricerange FROM R GROUP BY pricerange", 0),
+    ("avg", "X := avg(R, qty)", "SELECT AVG(qty) FROM R", 0),
+    ("sort", "X := sort(R, qty, time)", "SELECT * FROM R ORDER BY qty, time", 2),
+    ("sort_selection", "X := sort(R1, pricerange, storeid)",
+     "SELECT * FROM R WHERE time > 50 OR qty < 30 ORDER BY pricerange, storeid", 2),
+]
+
+
+def load_sqlite(connection, name, table):
+    """ create table `name` in SQLite with the columns and rows of a minidb table
+    :return: None
+    """
+    types = ["TEXT" if not table.is_col_numeric(idx) else
+             "INTEGER" if table.get_column(idx).dtype.kind in "iu" else "REAL" for idx in range(table.num_columns)]
+    columns = ", ".join('"%s" %s' % (col, types[idx]) for col, idx in table.col_names.items())
+    connection.execute("CREATE TABLE %s (%s)" % (name, columns))
+    rows = zip(*[col.tolist() for col in table.columns])
+    connection.executemany("INSERT INTO %s VALUES (%s)" % (name, ", ".join("?" * table.num_columns)), rows)
+
+
+def run_minidb(db, txt):
+    """ run a statement and gather every column of its result
+    :return: resulting Table
+    """
+    table_name, cmd, args = utils.parse(txt)
+    in_table, columns, criteria = ArgParser(cmd, args).get_args()
+    table = db.run(table_name, cmd, in_table, columns, criteria)
+    if table is not None:
+        table.columns
+    return table
+
+
+def rows_of(table):
+    """ :return: list of row tuples of python values
+    """
+    return list(zip(*[col.tolist() for col in table.columns]))
+
+
+def same_rows(rows, expected, num_keys=0):
+    """ compare two results as multisets of rows, floats up to 1e-3. With `num_keys` the
+    first `num_keys` values of the rows must also come in the same order
+    :return: True / False
+    """
+    if len(rows) != len(expected):
+        return False
+    if num_keys > 0 and [row[:num_keys] for row in rows] != [row[:num_keys] for row in expected]:
+        return False
+
+    def key(row):
+        return tuple((0, round(v, 2)) if isinstance(v, (int, float)) else (1, v) for v in row)
+
+    for row, other in zip(sorted(rows, key=key), sorted(expected, key=key)):
+        for a, b in zip(row, other):
+            if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+                if not math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-3):
+                    return False
+            elif a != b:
+                return False
+    return True
+
+
+def run_cases(data_dir, repeat):
+    """ load the generated tables into minidb and SQLite and run every case on both
+    :return: list of result dicts
+    """
+    db = Database()
+    connection = sqlite3.connect(":memory:")
+    for name, file in (("R", "sales1"), ("S", "sales2")):
+        db.input_from_file(name, "%s/%s" % (data_dir, file))
+        load_sqlite(connection, name, db.tables[name])
+    results = []
+    print("%-22s %10s %12s %12s %8s %6s" % ("CASE", "ROWS", "MINIDB (s)", "SQLITE (s)", "RATIO", "MATCH"))
+    for name, txt, sql, num_keys in CASES:
+        minidb_times, sqlite_times = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            table = run_minidb(db, txt)
+            minidb_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            expected = connection.execute(sql).fetchall()
+            sqlite_times.append(time.perf_counter() - start)
+        match = table is not None and same_rows(rows_of(table), expected, num_keys)
+        result = {"name": name, "statement": txt, "sql": sql, "rows": len(expected), "match": match,
+                  "minidb": min(minidb_times), "sqlite": min(sqlite_times)}
+        result["ratio"] = result["minidb"] / result["sqlite"] if result["sqlite"] > 0 else float("inf")
+        results.append(result)
+        print("%-22s %10d %12.4f %12.4f %8.2f %6s" % (name, result["rows"], result["minidb"], result["sqlite"],
+                                                     result["ratio"], "yes" if match else "NO"))
+    connection.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compare minidb with SQLite")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--skew", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", default=None, help="JSON file for the results")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate(data_dir, args.rows, args.seed, args.skew)
+        results = run_cases(data_dir, args.repeat)
+    if args.out is not None:
+        report = {"meta": {"commit": commit(), "rows": args.rows, "skew": args.skew, "seed": args.seed,
+                           "repeat": args.repeat, "sqlite": sqlite3.sqlite_version}, "results": results}
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(0 if all(result["match"] for result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
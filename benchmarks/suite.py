@@ -0,0 +1,169 @@
+"""time every command of docs/usage.md on generated data and store the results as JSON.
+
+usage (from the mini-db folder):
+    python3 -m benchmarks.suite --rows 1000000 [--skew 0.5] [--seed 0] [--repeat 3] [--out results.json]
+    python3 -m benchmarks.suite --compare before.json after.json [--threshold 1.25]
+
+A run generates `sales1` / `sales2` with `rows` rows each (see benchmarks.generate),
+then runs the statements in CASES in order, `repeat` times each, and records the best
+and median wall time and the number of result rows. Results are not printed, so the
+timings cover the operators only.
+--compare reports the change of the best time of every case between two result files
+and exits with status 1 if a case got slower by more than `threshold`.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from benchmarks.generate import generate
+from minidb.argparser import ArgParser
+from minidb.database import Database
+from minidb.parallel import Parallel
+from minidb.utils import Utils as utils
+
+# (name, statement) in the order of docs/usage.md, later statements read earlier results
+CASES = [
+    ("load_sales1", "R := inputfromfile(sales1)"),
+    ("load_sales2", "S := inputfromfile(sales2)"),
+    ("select", "R1 := select(R, (time > 50) or (qty < 30))"),
+    ("select_nested", "R1b := select(R, (qty*2 > itemid+10) and ((pricerange = cheap) or itemid = 7))"),
+    ("project", "R2 := project(R1, saleid, qty, pricerange)"),
+    ("avg", "R3 := avg(R1, qty)"),
+    ("sumgroup", "R4 := sumgroup(R1, time, qty)"),
+    ("sumgroup_two_keys", "R5 := sumgroup(R1, qty, time, pricerange)"),
+    ("avggroup", "R6 := avggroup(R1, qty, pricerange)"),
+    ("countgroup", "R7 := countgroup(R1, qty, pricerange)"),
+    ("aggregate", "R8 := aggregate(R1, sum(qty), avg(time), count(*) group by pricerange)"),
+    ("join_equi", "T := join(R, S, R.customerid = S.C)"),
+    ("join_equi_band", "T1 := join(R1, S, (R1.qty > S.Q) and (R1.saleid = S.saleid))"),
+    ("sort", "T2 := sort(T1, S_C)"),
+    ("sort_two_keys", "T2prime := sort(T1, R1_time, S_C)"),
+    ("movavg", "T3 := movavg(T2prime, R1_qty, 3)"),
+    ("movsum", "T4 := movsum(T2prime, R1_qty, 5)"),
+    ("select_scan", "Q1 := select(R, qty = 5)"),
+    ("btree_build", "Btree(R, qty)"),
+    ("select_btree", "Q2 := select(R, qty = 5)"),
+    ("select_scan_itemid", "Q3 := select(R, itemid = 7)"),
+    ("hash_build", "Hash(R, itemid)"),
+    ("select_hash", "Q4 := select(R, itemid = 7)"),
+    ("concat", "Q5 := concat(Q4, Q2)"),
+    ("outputtofile", "outputtofile(Q5, Q5)"),
+    ("append", "append(R, Q4)"),
+]
+
+
+def run_statement(db, txt, data_dir, out_dir):
+    """ run one statement of CASES
+    :return: number of rows of the result (None for commands without a result table)
+    """
+    table_name, cmd, args = utils.parse(txt)
+    in_table, columns, criteria = ArgParser(cmd, args).get_args()
+    if cmd == "inputfromfile":
+        db.tables.pop(table_name, None)
+        db.input_from_file(table_name, os.path.join(data_dir, in_table))
+        return db.tables[table_name].num_rows
+    if cmd in ("Btree", "Hash"):
+        getattr(db, cmd)(in_table[0], columns[0])
+        return None
+    if cmd == "outputtofile":
+        path = os.path.join(out_dir, columns[0])
+        if os.path.exists(path):
+            os.remove(path)
+        db.output_to_file(in_table[0], path)
+        return None
+    if cmd == "append":
+        db.tables[in_table[0]].append(db.tables[in_table[1]])
+        return db.tables[in_table[0]].num_rows
+    table = db.run(table_name, cmd, in_table, columns, criteria)
+    return None if table is None else table.num_rows
+
+
+def run_cases(data_dir, repeat):
+    """ run every case `repeat` times
+    :return: list of result dicts
+    """
+    db = Database()
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for name, txt in CASES:
+            times = []
+            rows = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                rows = run_statement(db, txt, data_dir, out_dir)
+                times.append(time.perf_counter() - start)
+            results.append({"name": name, "statement": txt, "rows": rows, "times": times,
+                            "best": min(times), "median": statistics.median(times)})
+            print("%-20s %12s %10.4f s" % (name, "-" if rows is None else rows, min(times)))
+    return results
+
+
+def commit():
+    """ :return: hash of the checked out commit, None outside a git repository
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_file, after_file, threshold):
+    """ print the change of the best time of every case
+    :return: True if no case got slower by more than `threshold`
+    """
+    with open(before_file) as f:
+        before = {r["name"]: r for r in json.load(f)["results"]}
+    with open(after_file) as f:
+        after = json.load(f)["results"]
+    ok = True
+    print("%-20s %12s %12s %8s" % ("CASE", "BEFORE (s)", "AFTER (s)", "RATIO"))
+    for result in after:
+        if result["name"] not in before:
+            continue
+        old = before[result["name"]]["best"]
+        ratio = result["best"] / old if old > 0 else float("inf")
+        flag = ""
+        if ratio > threshold:
+            flag = "  slower"
+            ok = False
+        print("%-20s %12.4f %12.4f %8.2f%s" % (result["name"], old, result["best"], ratio, flag))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the commands of docs/usage.md")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--skew", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", default="benchmark.json")
+    parser.add_argument("--data", default=None, help="directory for the generated files (kept)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(0 if compare(args.compare[0], args.compare[1], args.threshold) else 1)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data or tmp_dir
+        generate(data_dir, args.rows, args.seed, args.skew)
+        results = run_cases(data_dir, args.repeat)
+    report = {"meta": {"commit": commit(), "rows": args.rows, "skew": args.skew, "seed": args.seed,
+                       "repeat": args.repeat, "workers": Parallel.workers, "python": platform.python_version(),
+                       "numpy": np.__version__, "date": time.strftime("%Y-%m-%dT%H:%M:%S")},
+              "results": results}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print("results written to %s" % args.out)
+
+
+if __name__ == "__main__":
+    main()
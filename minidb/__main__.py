@@ -1,3 +1,4 @@
+import os
 import sys
 import time
 from minidb.argparser import ArgParser
@@ -6,8 +7,11 @@ from minidb.utils import Utils as utils
 data_path = "data/"
 
 
-def start():
-    db = mdb()
+def start(catalog=None):
+    """ read and run statements until exit
+    :param catalog: directory keeping the tables across sessions, None to keep them in memory only
+    """
+    db = mdb(catalog)
 
     with open("output.txt", "w"):
         print()
@@ -19,17 +23,25 @@ def start():
             start_time = time.time()
 
             # handle special commands which don't require further parsing
-            if txt == "exit":
+            special = txt.split("//")[0].strip()  # remove comments
+            if special == "exit":
                 break
 
-            elif txt == "show_tables":
+            elif special == "show_tables":
                 db.show_tables()
                 continue
 
-            elif txt == "show_index":
+            elif special == "show_index":
                 db.show_index()
                 continue
+
+            elif special == "checkpoint":
+                db.checkpoint()
+                continue
         
+            # explain [analyze] <statement>
+            explain, txt = utils.parse_explain(txt)
+
             # handle other commands after parsing
             table_name, cmd, args = utils.parse(txt)
 
@@ -39,16 +51,50 @@ def start():
 
             in_table, columns, criteria = ArgParser(cmd, args).get_args()
 
-            if cmd == "count":
+            # paths are resolved once, replaying the log reads the same files
+            if cmd == "inputfromfile":
+                in_table = os.path.abspath(data_path + in_table)
+                args = "(%s)" % in_table
+            elif cmd == "open":
+                columns = [os.path.abspath(columns[0])]
+                args = "(%s,%s)" % (in_table[0], columns[0])
+
+            # statements that change the tables are logged before they run
+            if explain != "explain":
+                db.log(table_name, cmd, args)
+
+            if explain is not None:
+                db.explain(table_name, cmd, in_table, columns, criteria, analyze=explain == "analyze")
+                continue
+
+            # in lazy mode the statement is only recorded, it runs when its result is needed
+            if db.defer(table_name, cmd, in_table, columns, criteria):
+                continue
+
+            if cmd == "set":
+                db.set(in_table[0], columns[0])
+                continue
+
+            elif cmd == "force":
+                db.force(in_table)
+                db.output_to_file(in_table, "output.txt")
+
+            elif cmd == "count":
                 db.count(table_name, in_table)
                 db.output_to_file(table_name, "output.txt")
 
             elif cmd == "inputfromfile":
-                db.input_from_file(table_name, data_path + in_table)
+                db.input_from_file(table_name, in_table)
 
             elif cmd == "outputtofile":
                 db.output_to_file(in_table[0], columns[0])
 
+            elif cmd == "save":
+                db.save(in_table[0], columns[0])
+
+            elif cmd == "open":
+                db.open(in_table[0], columns[0])
+
             elif cmd == "select":
                 db.select(table_name, in_table, criteria)
                 db.output_to_file(table_name, "output.txt")
@@ -61,12 +107,16 @@ def start():
                 db.concat(table_name, in_table)
                 db.output_to_file(table_name, "output.txt")
 
+            elif cmd == "append":
+                db.append(in_table[0], in_table[1])
+
             elif cmd == "sort":
                 db.sort(table_name, in_table[0], columns)
                 db.output_to_file(table_name, "output.txt")
 
             elif cmd == "join":
-                db.join(table_name, in_table, criteria)
+                if not db.join(table_name, in_table, criteria):
+                    continue
                 db.output_to_file(table_name, "output.txt")
                 end_time = time.time()
                 db.tables[table_name].print()
@@ -87,6 +137,10 @@ def start():
                 db.countgroup(table_name, in_table[0], columns[0], columns[1:])
                 db.output_to_file(table_name, "output.txt")
 
+            elif cmd == "aggregate":
+                db.aggregate(table_name, in_table[0], columns, criteria)
+                db.output_to_file(table_name, "output.txt")
+
             elif cmd == "movavg":
                 n = int(criteria)
                 db.movavg(table_name, in_table[0], columns, n)
@@ -122,12 +176,15 @@ def start():
 
 
         except ValueError as e:
+            print(e)
             continue
 
         except EOFError as e:
             print(e)
             break
-        
+
+    db.close()
+
 
 if __name__ == "__main__":
-    start()
+    start(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -1,5 +1,6 @@
 import re
 from enum import Enum
+from minidb.predicate import Predicate
 from minidb.utils import Utils as utils
 
 
@@ -11,6 +12,7 @@ class ArgParser:
         THREE_ARGS = 2
         MULTI_WITHOUT_CRITERIA = 3
         WITH_CRITERIA = 4
+        AGGREGATE = 5
 
     class Criteria:
         """inner class to store criteria for joins and selects
@@ -31,10 +33,17 @@ class ArgParser:
             self.arithops = []
             self.constants = []
             
+            # for selects only: AST of the whole criteria
+            self.predicate = None
+
             # for joins only
             # constants
             self.eq_constants = []
             self.ne_constants = []
+            # whether each constant is the left operand of its arithop (e.g. 36-A.saleid)
+            self.eq_constant_first = []
+            self.ne_constant_first = []
+            self.constant_first = []
             # arithops
             self.eq_arithops = []
             self.ne_arithops = []
@@ -70,6 +79,7 @@ class ArgParser:
                 self.arithops = self.eq_arithops + self.ne_arithops
                 self.comparators = self.eq_comparators + self.ne_comparators
                 self.constants = self.eq_constants + self.ne_constants
+                self.constant_first = self.eq_constant_first + self.ne_constant_first
 
         def parse_expression(self, arithop, condition, i):
             condition = utils.remove_parentheses(condition)
@@ -110,9 +120,11 @@ class ArgParser:
                 t1 = utils.remove_parentheses(left.split(".")[0]).strip()
                 t1_field = left.split(".")[1].strip()
                 t1_constant = None
+                t1_constant_first = False
             else:
                 left1, right1 = left.split(t1_arithop)
-                if utils.is_numeric(left1):
+                t1_constant_first = utils.is_numeric(left1)
+                if t1_constant_first:
                     t1_constant = utils.remove_parentheses(left1).strip()
                     t1_ = utils.remove_parentheses(right1).strip()
                     t1 = t1_.split(".")[0]
@@ -129,9 +141,11 @@ class ArgParser:
                 t2 = right.split(".")[0].strip()
                 t2_field = utils.remove_parentheses(right.split(".")[1]).strip()
                 t2_constant = None
+                t2_constant_first = False
             else:
                 left2, right2 = right.split(t2_arithop)
-                if utils.is_numeric(left2):
+                t2_constant_first = utils.is_numeric(left2)
+                if t2_constant_first:
                     t2_constant = utils.remove_parentheses(left2).strip()
                     t2_ = utils.remove_parentheses(right2).strip()
                     t2 = t2_.split(".")[0]
@@ -148,21 +162,24 @@ class ArgParser:
                 self.eq_comparators.append("=")
                 self.eq_arithops.append([t1_arithop, t2_arithop])
                 self.eq_constants.append([t1_constant, t2_constant])
+                self.eq_constant_first.append([t1_constant_first, t2_constant_first])
             else:
                 self.ne_conditions.append(tokenized_expr)
                 self.ne_comparators.append(re.findall(self.comparator_pattern, condition)[0])
                 self.ne_arithops.append([t1_arithop, t2_arithop])
                 self.ne_constants.append([t1_constant, t2_constant])
+                self.ne_constant_first.append([t1_constant_first, t2_constant_first])
 
     def __init__(self, cmd, args):
         self.command = cmd
         self.args = args
         self.types = {
-            self.Types.ONE_ARGS: ["inputfromfile", "count"],
-            self.Types.TWO_ARGS: ["avg", "sum", "concat", "outputtofile", "Btree", "Hash"],
+            self.Types.ONE_ARGS: ["inputfromfile", "count", "force"],
+            self.Types.TWO_ARGS: ["avg", "sum", "concat", "append", "set", "outputtofile", "save", "open", "Btree", "Hash"],
             self.Types.THREE_ARGS: ["movsum", "movavg"],
             self.Types.MULTI_WITHOUT_CRITERIA: ["project", "sumgroup", "avggroup", "countgroup", "sort"],
-            self.Types.WITH_CRITERIA: ["select", "join"]
+            self.Types.WITH_CRITERIA: ["select", "join"],
+            self.Types.AGGREGATE: ["aggregate"]
         }
         self.criteria = None
 
@@ -171,9 +188,34 @@ class ArgParser:
         """
         criteria = self.Criteria(str(self.args.split(",")[num_tables]), self.command)
         criteria.set_logic_operators()
+        if self.command == "select":
+            criteria.predicate = Predicate(self.args.strip()[1:-1].split(",", num_tables)[num_tables])
+            # the flat condition lists only describe simple and/or chains
+            try:
+                criteria.set_conditions()
+            except (ValueError, IndexError):
+                criteria.conditions, criteria.comparators, criteria.arithops = [], [], []
+            return criteria
         criteria.set_conditions()
         return criteria
 
+    def get_aggregates(self):
+        """parses aggregate(T, f1(c1), f2(c2), ... group by g1, g2, ...)
+        (whitespace has already been removed, so "group by" reads "groupby")
+        :return: [table], list of (function, column) pairs, list of group by columns
+        """
+        params = self.args.strip()[1:-1]
+        groupby_columns = []
+        if "groupby" in params:
+            params, groupby = params.rsplit("groupby", 1)
+            groupby_columns = [c.strip() for c in groupby.split(",") if c.strip() != ""]
+        table = params.split(",")[0].strip()
+        aggregates = re.findall(r"(\w+)\((\*|\w+)\)", params)
+        for function, column in aggregates:
+            if function not in ("sum", "avg", "count", "min", "max"):
+                raise ValueError("Unknown aggregate %s" % function)
+        return [table], aggregates, groupby_columns
+
     def get_columns(self, params, num_tables):
         columns = []
         columns_ = params.split("(")[1]
@@ -200,7 +242,7 @@ class ArgParser:
 
         # has two arguments, no need to worry about criteria
         elif self.command in self.types[self.Types.TWO_ARGS]:
-            if self.command == "concat":
+            if self.command in ("concat", "append"):
                 num_tables = 2
                 in_table = self.get_tables(self.args, num_tables)
             else:
@@ -240,3 +282,7 @@ class ArgParser:
             criteria = self.get_criteria(num_tables)                
             return in_table, None, criteria
 
+        # has a list of aggregates and group by columns
+        if self.command in self.types[self.Types.AGGREGATE]:
+            return self.get_aggregates()
+
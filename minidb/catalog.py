@@ -0,0 +1,168 @@
+import json
+import os
+from minidb.storage import TableFile
+from minidb.stream import StreamTable
+
+
+class Catalog:
+    """durable state of a Database in a directory: CATALOG lists every named table with its
+    table file (see TableFile) and its indexes (stored next to it) as of the last checkpoint,
+    LOG is a write-ahead log of the statements run since then (one JSON record per line,
+    written and synced before the statement runs). On startup the tables are opened and the log is replayed.
+    A checkpoint writes the tables changed since the previous one and new indexes,
+    replaces CATALOG and empties the log. Streamed tables are kept as the description of
+    their pipeline (see StreamTable.describe), their file is not copied
+    """
+
+    CATALOG = "catalog.json"
+    LOG = "wal.log"
+    VERSION = 1
+    # statements logged before the next one triggers a checkpoint
+    CHECKPOINT_RECORDS = 64
+
+    def __init__(self, path):
+        """
+        :param path: directory of the catalog, created if needed
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # name -> {"file": table file name, "indexes": [[column, type], ...]}
+        # or {"stream": ..., "stages": ...} for a streamed table
+        self.tables = {}
+        # settings of the Database (see Database.set) as of the last checkpoint
+        self.settings = {}
+        # log sequence number of the last logged statement and of the last checkpointed one
+        self.lsn = 0
+        self.checkpoint_lsn = 0
+        # names of the tables changed since the last checkpoint
+        self.dirty = set()
+        self.records = []
+        catalog_file = os.path.join(path, self.CATALOG)
+        if os.path.exists(catalog_file):
+            with open(catalog_file) as f:
+                catalog = json.load(f)
+            if catalog["version"] != self.VERSION:
+                raise ValueError("Unsupported catalog version %s" % catalog["version"])
+            self.tables = catalog["tables"]
+            self.settings = catalog.get("settings", {})
+            self.lsn = self.checkpoint_lsn = catalog["lsn"]
+        self.__read_log()
+        self.log_file = open(os.path.join(path, self.LOG), "a")
+
+    def __read_log(self):
+        """ read the statements logged after the last checkpoint and mark the tables they
+        change dirty. A torn last record (the process stopped while writing it) is dropped
+        :return: None
+        """
+        log_file = os.path.join(self.path, self.LOG)
+        if not os.path.exists(log_file):
+            return
+        valid = 0
+        with open(log_file, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                valid += len(line)
+                if record["lsn"] > self.checkpoint_lsn:
+                    self.records.append(record)
+                    self.lsn = record["lsn"]
+                    # the replayed statement changes its table again, the next checkpoint writes it
+                    if record.get("changed") is not None:
+                        self.dirty.add(record["changed"])
+        with open(log_file, "ab") as f:
+            f.truncate(valid)
+
+    def file(self, name):
+        """ :return: path of the table file of table `name`
+        """
+        return os.path.join(self.path, self.tables[name]["file"])
+
+    def log(self, table_name, cmd, args, changed):
+        """ append a statement to the log and sync it to disk
+        :param table_name: name of the resulting table or None
+        :param cmd: command
+        :param args: unparsed arguments of the command (see Utils.parse)
+        :param changed: name of the table whose rows the statement creates or changes, None
+            if only its indexes change
+        :return: None
+        """
+        self.lsn += 1
+        record = {"lsn": self.lsn, "table": table_name, "cmd": cmd, "args": args, "changed": changed}
+        self.log_file.write(json.dumps(record) + "\n")
+        self.log_file.flush()
+        os.fsync(self.log_file.fileno())
+        self.records.append(record)
+        if changed is not None:
+            self.dirty.add(changed)
+
+    def checkpoint(self, tables, settings):
+        """ make `tables` the durable state: write the files of new and changed tables and
+        of new indexes, replace the catalog file and empty the log. Files that are no longer
+        part of the catalog are removed
+        :param tables: dict name -> Table / StreamTable
+        :param settings: dict of the Database settings
+        :return: None
+        """
+        entries = {}
+        for name, table in tables.items():
+            if isinstance(table, StreamTable):
+                entries[name] = table.describe()
+                continue
+            indexes = [[column, index.type] for column, index in table.indexes.items()]
+            if name in self.tables and name not in self.dirty:
+                entry = self.tables[name]
+                path = os.path.join(self.path, entry["file"])
+                for column, idx_type in indexes:
+                    if [column, idx_type] not in entry["indexes"]:
+                        TableFile.save_index(table, column, path)
+                entry = {"file": entry["file"], "indexes": indexes}
+            else:
+                entry = {"file": "%s.%d.mdb" % (name, self.lsn), "indexes": indexes}
+                TableFile.save(table, os.path.join(self.path, entry["file"]))
+            entries[name] = entry
+        tmp_file = os.path.join(self.path, self.CATALOG + ".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump({"version": self.VERSION, "lsn": self.lsn, "settings": settings, "tables": entries}, f,
+                      indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, os.path.join(self.path, self.CATALOG))
+        self.__sync_directory()
+
+        # the log records up to self.lsn are skipped from now on, the log can be emptied
+        self.log_file.truncate(0)
+        self.log_file.flush()
+        os.fsync(self.log_file.fileno())
+        # only the table and index files of the previous catalog are removed, other files
+        # in the directory are left alone
+        files = set()
+        for entry in entries.values():
+            if "file" in entry:
+                files.add(entry["file"])
+                files.update(TableFile.index_path(entry["file"], column) for column, _ in entry["indexes"])
+        old_files = [entry["file"] for entry in self.tables.values() if "file" in entry]
+        for file in os.listdir(self.path):
+            if file in files:
+                continue
+            if file in old_files or any(file.startswith(old + ".") and file.endswith(".idx") for old in old_files):
+                os.remove(os.path.join(self.path, file))
+        self.tables = entries
+        self.settings = dict(settings)
+        self.checkpoint_lsn = self.lsn
+        self.dirty = set()
+        self.records = []
+
+    def __sync_directory(self):
+        """ make renames in the catalog directory durable
+        :return: None
+        """
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        self.log_file.close()
@@ -1,13 +1,168 @@
-import copy
-import numpy as np
+import contextlib
+import io
+import os
+from minidb.argparser import ArgParser
+from minidb.catalog import Catalog
 from minidb.table import Table
 from minidb.join import Join
+from minidb.explain import Profiler
+from minidb.extsort import ExternalSort
+from minidb.loader import Loader
+from minidb.parallel import Parallel
+from minidb.plan import Node, Plan
+from minidb.storage import TableFile
+from minidb.stream import StreamTable
 
 
 class Database:
 
-    def __init__(self):
+    # options of the set command and their default values
+    SETTINGS = {"lazy": False, "workers": 1, "pool": "thread", "join": "auto", "stream": False,
+                "sort": "auto", "sort_memory": 1024}
+    CHOICES = {"pool": ("thread", "process"), "join": ("auto", "hash", "partitioned"),
+               "sort": ("auto", "memory", "external")}
+    # statements without an assignment that change the tables or settings and are written to the log
+    LOGGED = ("append", "open", "Btree", "Hash", "set")
+
+    def __init__(self, path=None):
+        """
+        :param path: catalog directory that keeps the tables across sessions (see Catalog),
+            None for a database that only lives in memory
+        """
+        # name -> Table, Node for statements deferred in lazy mode or StreamTable for files
+        # read chunk by chunk
         self.tables = {}
+        self.settings = dict(self.SETTINGS)
+        self.plan = Plan()
+        self.catalog = None
+        if path is not None:
+            self.catalog = Catalog(path)
+            self.__recover()
+
+    @property
+    def lazy(self):
+        return self.settings["lazy"]
+
+    def set(self, option, value):
+        """ change a setting, e.g. set(lazy, on), set(workers, 8), set(pool, process), set(join, partitioned),
+        set(stream, on), set(sort, external), set(sort_memory, 256). workers, pool and join configure
+        parallel execution for the whole process, with stream on inputfromfile registers the file as
+        a StreamTable instead of loading it. sort and sort_memory (in MB) configure ExternalSort
+        :param option: name of the setting
+        :param value: on/off for boolean settings, a positive number or one of the choices
+        :return: success True/False
+        """
+        if option not in self.SETTINGS:
+            print("Unknown setting %s" % option)
+            return False
+        default = self.SETTINGS[option]
+        if isinstance(default, bool):
+            if value not in ("on", "off"):
+                print("Invalid value %s for setting %s (use on/off)" % (value, option))
+                return False
+            value = value == "on"
+        elif isinstance(default, int):
+            if not str(value).isdigit() or int(value) < 1:
+                print("Invalid value %s for setting %s (use a positive number)" % (value, option))
+                return False
+            value = int(value)
+        elif value not in self.CHOICES[option]:
+            print("Invalid value %s for setting %s (use %s)" % (value, option, "/".join(self.CHOICES[option])))
+            return False
+        self.settings[option] = value
+        if option in ("workers", "pool", "join"):
+            Parallel.configure(self.settings["workers"], self.settings["pool"], join=self.settings["join"])
+        if option in ("sort", "sort_memory"):
+            ExternalSort.configure(self.settings["sort"], self.settings["sort_memory"] << 20)
+        return True
+
+    def __recover(self):
+        """ restore the settings and open the tables of the last checkpoint with their indexes, replay
+        the statements logged since then (without printing their output). Statements that raise
+        are reported and skipped
+        :return: None
+        """
+        self.settings.update(self.catalog.settings)
+        Parallel.configure(self.settings["workers"], self.settings["pool"], join=self.settings["join"])
+        ExternalSort.configure(self.settings["sort"], self.settings["sort_memory"] << 20)
+        for name, entry in self.catalog.tables.items():
+            if "stream" in entry:
+                self.tables[name] = StreamTable.restore(name, entry)
+            else:
+                self.tables[name] = TableFile.open(name, self.catalog.file(name), entry["indexes"])
+        skipped = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for record in self.catalog.records:
+                # a statement that failed when it was logged fails again, recovery goes on without it
+                try:
+                    self.__replay(record["table"], record["cmd"], record["args"])
+                except Exception as e:
+                    skipped.append((record, e))
+        for record, e in skipped:
+            print("Skipped log record %d (%s%s): %s" % (record["lsn"], record["cmd"], record["args"], e))
+
+    def __replay(self, table_name, cmd, args):
+        """ run a logged statement
+        :return: None
+        """
+        in_table, columns, criteria = ArgParser(cmd, args).get_args()
+        if cmd == "inputfromfile":
+            self.input_from_file(table_name, in_table)
+        elif cmd == "open":
+            self.open(in_table[0], columns[0])
+        elif cmd == "append":
+            self.append(in_table[0], in_table[1])
+        elif cmd in ("Btree", "Hash"):
+            getattr(self, cmd)(in_table[0], columns[0])
+        elif cmd == "set":
+            self.set(in_table[0], columns[0])
+        else:
+            self.run(table_name, cmd, in_table, columns, criteria)
+
+    def log(self, table_name, cmd, args):
+        """ write the statement `table_name` := `cmd``args` to the log of the catalog before it runs.
+        Only assignments and the statements in LOGGED change the tables, other statements are not
+        logged. After CHECKPOINT_RECORDS statements a checkpoint is taken first
+        :param table_name: name of the resulting table or None
+        :param cmd: command
+        :param args: unparsed arguments of the command (see Utils.parse)
+        :return: None
+        """
+        if self.catalog is None:
+            return
+        if cmd not in (("inputfromfile",) + Plan.OPERATORS if table_name is not None else self.LOGGED):
+            return
+        if len(self.catalog.records) >= Catalog.CHECKPOINT_RECORDS:
+            self.checkpoint()
+        changed = table_name
+        if cmd in ("append", "open"):
+            changed = ArgParser(cmd, args).get_args()[0][0]
+        self.catalog.log(table_name, cmd, args, changed)
+
+    def checkpoint(self):
+        """ write every table changed since the last checkpoint to the catalog directory
+        and empty the log (deferred tables are computed first)
+        :return: success True/False
+        """
+        if self.catalog is None:
+            print("No catalog directory, start minidb with one to keep the tables")
+            return False
+        tables = {}
+        for name in list(self.tables):
+            table = self.__get_table(name, stream=True)
+            if table is not None:
+                tables[name] = table
+        self.catalog.checkpoint(tables, self.settings)
+        return True
+
+    def close(self):
+        """ take a checkpoint and close the log, the next session starts without replaying
+        :return: None
+        """
+        if self.catalog is not None:
+            self.checkpoint()
+            self.catalog.close()
+            self.catalog = None
 
     def show_tables(self):
         """print out tables currently present in the database
@@ -17,16 +172,20 @@ class Database:
             print("No tables")
         else:
             for table in self.tables:
-                print(table)
+                if isinstance(self.tables[table], Node):
+                    print(table, "(deferred)")
+                else:
+                    print(table)
 
     def show_index(self):
         if len(self.tables) == 0:
             print("No tables")
         else:
             print("%-15s" % "INDEX LIST")
-            print("%-15s %-15s %-15s" % ("TABLE", "COLUMN", "TYPE"))
-            for table_name in self.tables:
-                self.__get_table(table_name).index_list()
+            print("%-15s %-15s %-15s %-15s %-15s" % ("TABLE", "COLUMN", "TYPE", "BUILD (ms)", "SIZE (KB)"))
+            for table in self.tables.values():
+                if not isinstance(table, Node):
+                    table.index_list()
 
     def __exists(self, table_name):
         """ check if table exists in database
@@ -47,17 +206,184 @@ class Database:
             print("Table already present. Overwriting...")
         self.tables[table_name] = table
 
-    def __get_table(self, table_name):
-        """ get Table object mapped with name table_name
+    def __get_table(self, table_name, stream=False):
+        """ get Table object mapped with name table_name.
+        A deferred table is computed (and kept) first
         :param table_name: name of the table
-        :return: Table / None
+        :param stream: return a StreamTable as it is (for the operators that read it chunk by chunk),
+            otherwise it is read into a Table (which is not kept)
+        :return: Table / StreamTable / None
         """
         if table_name not in self.tables:
             print("Table", table_name, "not present in database")
             return None
         table = self.tables[table_name]
+        if isinstance(table, Node):
+            table = self.plan.force(table)
+            if table is None:
+                return None
+            self.tables[table_name] = table
+        if isinstance(table, StreamTable) and not stream:
+            table = table.materialize()
         return table
 
+    def defer(self, out_table_name, cmd, in_tables, columns, criteria):
+        """ in lazy mode, record the statement `out_table_name` := `cmd`(...) instead of running it.
+        Results are computed when they are output or forced, chains of
+        select / project / sort and aggregates over them run without intermediate tables
+        :param out_table_name: name of the resulting table
+        :param cmd: command
+        :param in_tables: name or list of names of the input tables
+        :param columns: parsed column arguments of the command
+        :param criteria: parsed criteria (or extra argument) of the command
+        :return: True if the statement was deferred, False if it has to run now
+        """
+        if not self.lazy or cmd not in Plan.OPERATORS or out_table_name is None:
+            return False
+        inputs = []
+        for name in ([in_tables] if isinstance(in_tables, str) else in_tables):
+            if not self.__exists(name):
+                print("Table %s not found" % name)
+                return True
+            if isinstance(self.tables[name], StreamTable):
+                # streamed tables are read chunk by chunk by the operators themselves
+                return False
+            table = self.tables[name]
+            # a snapshot of a table input: appends before the statement is forced do not change it
+            inputs.append(table.copy(table.name) if isinstance(table, Table) else table)
+        self.__save_table(out_table_name, Node(out_table_name, cmd, inputs, columns, criteria))
+        return True
+
+    def force(self, table_name):
+        """ compute a deferred table and print it
+        :param table_name: name of the table
+        :return: success True/False
+        """
+        table = self.__get_table(table_name)
+        if table is None:
+            return False
+        table.print()
+        print("%d rows returned" % table.num_rows)
+        return True
+
+    def explain(self, out_table_name, cmd, in_tables, columns, criteria, analyze=False):
+        """ print the plan of the statement `out_table_name` := `cmd`(...): the access path of
+        every select condition (index or scan), the join algorithm and its build / probe sides.
+        With analyze the statement runs (its result is saved) and every operator reports its
+        wall time, rows in / out, bytes allocated and index hits
+        :param out_table_name: name of the resulting table
+        :param cmd: command, one of the operators that can be deferred (select, join, ...)
+        :param in_tables: name or list of names of the input tables
+        :param columns: parsed column arguments of the command
+        :param criteria: parsed criteria (or extra argument) of the command
+        :param analyze: run the statement and measure it
+        :return: dict {"table", "operator", "analyze", "operators": list of operator dicts} or
+            None if the statement cannot be explained. An operator dict has the keys operator,
+            table, details and children (and with analyze rows_in, rows_out, time_ms, bytes,
+            index_lookups, index_hits)
+        """
+        if cmd not in Plan.OPERATORS:
+            print("Cannot explain %s" % cmd)
+            return None
+        names = [in_tables] if isinstance(in_tables, str) else in_tables
+        for name in names:
+            if not self.__exists(name):
+                print("Table %s not found" % name)
+                return None
+        if analyze:
+            _, operators = Profiler.profile(self.run, out_table_name, cmd, names, columns, criteria)
+        else:
+            operators = [self.__describe(out_table_name, cmd, [self.tables[name] for name in names], columns, criteria)]
+        for line in Profiler.format(operators, analyze):
+            print(line)
+        return {"table": out_table_name, "operator": cmd, "analyze": analyze, "operators": operators}
+
+    def __describe(self, out_table_name, cmd, inputs, columns, criteria):
+        """ plan of a statement without running it, deferred inputs are described recursively
+        :param inputs: list of input Tables or Nodes
+        :return: operator dict
+        """
+        children = []
+        for table in inputs:
+            if isinstance(table, Node) and table.view is None:
+                children.append(self.__describe(table.name, table.op, table.inputs, table.columns, table.criteria))
+            else:
+                num_rows = table.view.num_rows if isinstance(table, Node) else table.num_rows
+                children.append(Profiler.record("table", table.name, {"rows": num_rows}))
+        if all(isinstance(table, Table) for table in inputs):
+            details = self.__details(cmd, inputs, criteria)
+        elif any(isinstance(table, StreamTable) for table in inputs):
+            details = {"streamed": cmd in StreamTable.OPERATORS}
+        elif cmd in Plan.FUSED:
+            details = {"fused": True}
+        else:
+            # sizes and statistics of deferred inputs are only known once they are computed
+            details = {"algorithm": "chosen at run time"} if cmd == "join" else {}
+        record = Profiler.record(cmd, out_table_name, details)
+        record["children"] = children
+        return record
+
+    @staticmethod
+    def __details(cmd, tables, criteria):
+        """ plan details of `cmd` over the input `tables`
+        :return: dict
+        """
+        if cmd == "select":
+            return tables[0].explain_select(criteria)
+        if cmd == "join":
+            return Join(tables[0], tables[1], criteria).explain()
+        if cmd == "sort":
+            external = ExternalSort.enabled(tables[0].num_rows, tables[0].col_dtypes.values())
+            return {"algorithm": "external merge" if external else "in memory"}
+        return {}
+
+    def run(self, out_table_name, cmd, in_tables, columns, criteria):
+        """ run the statement `out_table_name` := `cmd`(...) and save its result without printing it
+        (used by explain analyze and the benchmarks). The statement is one profiled operator
+        :param out_table_name: name of the resulting table, None to not save it
+        :param cmd: command, one of the operators that can be deferred (select, join, ...)
+        :param in_tables: name or list of names of the input tables
+        :param columns: parsed column arguments of the command
+        :param criteria: parsed criteria (or extra argument) of the command
+        :return: resulting Table or None
+        """
+        names = [in_tables] if isinstance(in_tables, str) else in_tables
+        with Profiler.operator(cmd, out_table_name) as op:
+            tables = [self.__get_table(name, stream=cmd in StreamTable.OPERATORS) for name in names]
+            if any(table is None for table in tables):
+                return None
+            # the number of rows of a streamed table is only known once it was read
+            op["rows_in"] = None if any(table.num_rows is None for table in tables) else \
+                sum(table.num_rows for table in tables)
+            table = tables[0]
+            if cmd == "select" and isinstance(table, Table):
+                # the join describes its plan in its own operator
+                op["details"] = table.explain_select(criteria)
+            if cmd == "select":
+                result = table.select(out_table_name, criteria)
+            elif cmd == "project":
+                result = table.projection(out_table_name, [s.strip() for s in columns])
+            elif cmd == "sort":
+                result = table.sort(out_table_name, columns)
+            elif cmd == "count":
+                result = table.count(out_table_name)
+            elif cmd in ("avg", "sum"):
+                result = getattr(table, cmd)(out_table_name, columns[0])
+            elif cmd == "aggregate":
+                result = table.aggregate(out_table_name, columns, criteria)
+            elif cmd in ("movavg", "movsum"):
+                result = getattr(table, cmd)(out_table_name, columns, int(criteria))
+            elif cmd == "concat":
+                result = table.concat(out_table_name, tables[1])
+            elif cmd == "join":
+                result = Join(table, tables[1], criteria).result(out_table_name)
+            else:  # sumgroup, avggroup, countgroup
+                result = getattr(table, cmd)(out_table_name, columns[0], columns[1:])
+            op["rows_out"] = None if result is None else result.num_rows
+        if result is not None and out_table_name is not None:
+            self.tables[out_table_name] = result
+        return result
+
     def input_from_file(self, table_name, file):
         """ Import data from given vertical bar delimited `file`
         into array-table. (1 or more columns)
@@ -68,36 +394,73 @@ class Database:
         :param file: path to the input file.
         :return: success True/False
         """
-        # TODO: Handle possible exceptions, return False
         # TODO: What to do if table already exists?
-        table = None
-        first = True
-        rows = []
         try:
-            with open(file, "r") as f:
-                for line in f:
-                    split = line.split("|")
-                    split = [s.strip() for s in split]
-                    if first:
-                        first = False
-                        table = Table(table_name, split)
-                        continue
-                    else:
-                        try:
-                            rows.append(split)
-                        except Exception as e:
-                            print(e)
-                            continue
-            table.rows = np.array(rows)
-            table.num_rows = len(rows)
-            if (table.num_rows>0):
-                table.set_dtypes()
+            if self.settings["stream"]:
+                return self.__stream_from_file(table_name, file)
+            col_names, columns = Loader(file).load()
+            if col_names is None:
+                print("File %s is empty" % file)
+                return False
+            table = Table(table_name, col_names)
+            table.set_columns(columns)
+            table.analyze()
             self.__save_table(table_name, table)
             return True
+        except ValueError as e:
+            print(e)
+            return False
         except OSError as e:
             print(e)
             return False
 
+    def __stream_from_file(self, table_name, file):
+        """ register `file` as a StreamTable, only its first chunk is read (for the schema)
+        :return: success True/False
+        """
+        if os.path.getsize(file) == 0:
+            print("File %s is empty" % file)
+            return False
+        table = StreamTable(table_name, file)
+        table.col_names
+        self.__save_table(table_name, table)
+        return True
+
+    def save(self, table_name, file):
+        """ write `table` to `file` in the binary columnar format of TableFile
+        (schema, dtypes and statistics, then the column data), see open
+        :param table_name: name of the table to save
+        :param file: path to the file
+        :return: success True/False
+        """
+        table = self.__get_table(table_name)
+        if table is None:
+            return False
+        try:
+            TableFile.save(table, file)
+            return True
+        except OSError as e:
+            print(e)
+            return False
+
+    def open(self, table_name, file):
+        """ open a table written by save. Only the header is read, the columns are
+        memory-mapped and paged in when a query reads them
+        :param table_name: name of the table to create
+        :param file: path to the file
+        :return: success True/False
+        """
+        try:
+            table = TableFile.open(table_name, file)
+        except (ValueError, KeyError) as e:
+            print(e)
+            return False
+        except OSError as e:
+            print(e)
+            return False
+        self.__save_table(table_name, table)
+        return True
+
     def join(self, out_table_name, tables, criteria):
         """ select all columns from each of the `tables'.
         Filter rows by ones that satisfy the `criteria`
@@ -111,17 +474,12 @@ class Database:
         if t1 is None or t2 is None:
             return False
 
-        # create new table with appropriate name and columns
-        t1_cols = [tables[0] + "_" + x for x in t1.col_names]
-        t2_cols = [tables[1] + "_" + x for x in t2.col_names]
-        table = Table(out_table_name, t1_cols + t2_cols)
-
-        join = Join(t1, t2, criteria)
-        data=join.do_join()
-        table.set_data(data)
+        table = Join(t1, t2, criteria).result(out_table_name)
+        if table is None:
+            return False
         self.__save_table(out_table_name, table)
         # table.print()
-        print("%d rows returned" % len(data))
+        print("%d rows returned" % table.num_rows)
         return True
 
     def output_to_file(self, table_name, file):
@@ -130,7 +488,7 @@ class Database:
         :param file: path to the output file where output must be written.
         :return: success True/False
         """
-        table = self.__get_table(table_name)
+        table = self.__get_table(table_name, stream=True)
         if table is None:
             return False
         with open(file, "a") as f:
@@ -149,14 +507,17 @@ class Database:
             print("Table %s does not exist" % in_table_name)
             return False
 
-        in_table = self.__get_table(in_table_name)
+        in_table = self.__get_table(in_table_name, stream=True)
 
-        out_table = Table(out_table_name, in_table.col_names.keys())
-        data = in_table.select(criteria)
-        out_table.rows = data
-        out_table.num_rows = len(data)
-        out_table.print_formatted()
-        print("%d rows returned" % len(data))
+        out_table = in_table.select(out_table_name, criteria)
+        if out_table is None:
+            return False
+        if isinstance(out_table, StreamTable):
+            # the rows are read (and counted) while they are printed
+            out_table.print()
+        else:
+            out_table.print_formatted()
+        print("%d rows returned" % out_table.num_rows)
         # create new table with appropriate name
         self.__save_table(out_table_name, out_table)
         return True
@@ -174,29 +535,51 @@ class Database:
 
         columns = [s.strip() for s in columns]
         print(columns)
-        projection = self.tables[in_table_name].projection(projected_table_name, columns)
+        projection = self.__get_table(in_table_name, stream=True).projection(projected_table_name, columns)
         if projection is None:
             return False
         self.__save_table(projected_table_name, projection)
         projection.print()
         return True
     
-    def concat(self, out_table_name, tables):  # TODO: ensure schemas are the same
+    def concat(self, out_table_name, tables):
         """ concatenate tables (with the same schema)
         :param out_table_name: name of the output table
         :param tables: list of tables to be concatenated
-        :return: None
+        :return: success True/False
         """
-        # create a copy of the first table
         table1 = self.__get_table(tables[0])
         table2 = self.__get_table(tables[1])
-        # table = copy.deepcopy(table1)
-        table = table1.copy(out_table_name)
-        for row in table2.rows[1:]:
-            table.insert_row([row])
+        if table1 is None or table2 is None:
+            return False
+        table = table1.concat(out_table_name, table2)
+        if table is None:
+            return False
         # save concatenated table in database with appropriate name
         self.__save_table(out_table_name, table)
         table.print()
+        return True
+
+    def append(self, table_name, other_name):
+        """ append the rows of `other_name` to `table_name` in place (same schema).
+        Indexes on `table_name` are updated incrementally
+        corresponds to:
+            INSERT INTO `table_name` SELECT * FROM `other_name`
+        :param table_name: name of the table to append to
+        :param other_name: name of the table whose rows are appended
+        :return: success True/False
+        """
+        if isinstance(self.tables.get(table_name), StreamTable):
+            print("Cannot append to streamed table %s" % table_name)
+            return False
+        table = self.__get_table(table_name)
+        other = self.__get_table(other_name)
+        if table is None or other is None:
+            return False
+        if not table.append(other):
+            return False
+        print("%d rows appended" % other.num_rows)
+        return True
 
     def sort(self, out_table_name, in_table_name, columns):
         """ sort `table` by each column in `columns` in the given order
@@ -210,8 +593,10 @@ class Database:
             return False
         in_table = self.__get_table(in_table_name)
         out_table = in_table.sort(out_table_name, columns)
+        if out_table is None:
+            return False
         out_table.print()
-        print("%d rows returned" % len(out_table.rows))
+        print("%d rows returned" % out_table.num_rows)
         self.__save_table(out_table_name, out_table)
         return True
 
@@ -226,9 +611,11 @@ class Database:
         if not self.__exists(in_table_name):
             print("Table %s not found" % in_table_name)
             return False
-        in_table = self.__get_table(in_table_name)
+        in_table = self.__get_table(in_table_name, stream=True)
         out_table = in_table.avggroup(out_table_name, avg_column, groupby_columns)
-        print("%d rows returned" % len(out_table.rows))
+        if out_table is None:
+            return False
+        print("%d rows returned" % out_table.num_rows)
         self.__save_table(out_table_name, out_table)
         out_table.print()
         return True
@@ -244,10 +631,12 @@ class Database:
         if not self.__exists(in_table_name):
             print("Table %s not found" % in_table_name)
             return False
-        in_table = self.__get_table(in_table_name)
+        in_table = self.__get_table(in_table_name, stream=True)
         out_table = in_table.sumgroup(out_table_name, sum_column, groupby_columns)
+        if out_table is None:
+            return False
         out_table.print()
-        print("%d rows returned" % len(out_table.rows))
+        print("%d rows returned" % out_table.num_rows)
         self.__save_table(out_table_name, out_table)
         return True
     
@@ -262,10 +651,33 @@ class Database:
         if not self.__exists(in_table_name):
             print("Table %s not found" % in_table_name)
             return False
-        in_table = self.__get_table(in_table_name)
+        in_table = self.__get_table(in_table_name, stream=True)
         out_table = in_table.countgroup(out_table_name, count_column, groupby_columns)
+        if out_table is None:
+            return False
         out_table.print()
-        print("%d rows returned" % len(out_table.rows))
+        print("%d rows returned" % out_table.num_rows)
+        self.__save_table(out_table_name, out_table)
+        return True
+
+    def aggregate(self, out_table_name, in_table_name, aggregates, groupby_columns):
+        """ select f1(c1), f2(c2), ..., `groupby_columns` from table group by `groupby_columns`
+        all aggregates are computed over the same grouping in one pass
+        :param out_table_name: name of the output table
+        :param in_table_name: name of the input table
+        :param aggregates: list of (function, column) pairs (sum, avg, count, min, max)
+        :param groupby_columns: names of columns to group by
+        :return: success True/False
+        """
+        if not self.__exists(in_table_name):
+            print("Table %s not found" % in_table_name)
+            return False
+        in_table = self.__get_table(in_table_name, stream=True)
+        out_table = in_table.aggregate(out_table_name, aggregates, groupby_columns)
+        if out_table is None:
+            return False
+        out_table.print()
+        print("%d rows returned" % out_table.num_rows)
         self.__save_table(out_table_name, out_table)
         return True
 
@@ -282,6 +694,8 @@ class Database:
             return False
         in_table = self.__get_table(in_table_name)
         out_table = in_table.movavg(out_table_name, column, n)
+        if out_table is None:
+            return False
         out_table.print()
         self.__save_table(out_table_name, out_table)
         return True
@@ -299,6 +713,8 @@ class Database:
             return False
         in_table = self.__get_table(in_table_name)
         out_table = in_table.movsum(out_table_name, column, n)
+        if out_table is None:
+            return False
         self.__save_table(out_table_name, out_table)
         out_table.print()
         return True
@@ -313,8 +729,10 @@ class Database:
             print("Table %s not found" % in_table_name)
             return False
 
-        in_table = self.__get_table(in_table_name)
+        in_table = self.__get_table(in_table_name, stream=True)
         out_table = in_table.count(out_table_name)
+        if out_table is None:
+            return False
         self.__save_table(out_table_name, out_table)
         out_table.print()
         return True
@@ -330,8 +748,10 @@ class Database:
             print("Table %s not found" % in_table_name)
             return False
 
-        in_table = self.__get_table(in_table_name)
+        in_table = self.__get_table(in_table_name, stream=True)
         out_table = in_table.avg(out_table_name, column)
+        if out_table is None:
+            return False
         self.__save_table(out_table_name, out_table)
         out_table.print()
         return True
@@ -347,8 +767,10 @@ class Database:
             print("Table %s not found" % in_table_name)
             return False
 
-        in_table = self.__get_table(in_table_name)
+        in_table = self.__get_table(in_table_name, stream=True)
         out_table = in_table.sum(out_table_name, column)
+        if out_table is None:
+            return False
         self.__save_table(out_table_name, out_table)
         out_table.print()
         return True
@@ -360,7 +782,12 @@ class Database:
         :param column: name of the column to index
         :return: None
         """
-        self.__get_table(table_name).btree_index(column)
+        if isinstance(self.tables.get(table_name), StreamTable):
+            print("Cannot index streamed table %s" % table_name)
+            return
+        table = self.__get_table(table_name)
+        if table is not None:
+            table.btree_index(column)
 
     def Hash(self, table_name, column):
         """ create a Hash index on `table` based on `column`
@@ -369,4 +796,9 @@ class Database:
         :param column: name of the column to index
         :return: None
         """
-        self.__get_table(table_name).hash_index(column)
+        if isinstance(self.tables.get(table_name), StreamTable):
+            print("Cannot index streamed table %s" % table_name)
+            return
+        table = self.__get_table(table_name)
+        if table is not None:
+            table.hash_index(column)
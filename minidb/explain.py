@@ -0,0 +1,133 @@
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Profiler:
+    """per-operator measurements of a statement run by `explain analyze`: wall time,
+    rows in / out, bytes allocated (peak traced by tracemalloc above the memory in use
+    when the operator started, NumPy arrays included) and index lookups / hits.
+    Operators nest, e.g. the phases of a join are children of the join operator.
+    The hooks do nothing unless a statement is being profiled
+    """
+
+    active = None
+
+    def __init__(self):
+        self.operators = []
+        self.stack = []
+
+    @staticmethod
+    def record(name, table=None, details=None):
+        """ :return: dict describing one operator, see Database.explain
+        """
+        return {"operator": name, "table": table, "details": details or {}, "children": []}
+
+    @classmethod
+    @contextmanager
+    def operator(cls, name, table=None, rows_in=None, describe=None):
+        """ measure the code run inside the `with` block as one operator.
+        The yielded dict takes the measurements, callers set its "rows_out" (and "rows_in")
+        :param name: name of the operator
+        :param table: name of the table the operator produces
+        :param rows_in: number of input rows
+        :param describe: function returning the details of the plan (only called when profiling)
+        """
+        profile = cls.active
+        if profile is None:
+            yield {}
+            return
+        record = cls.record(name, table, describe() if describe is not None else None)
+        record.update({"rows_in": rows_in, "rows_out": None, "index_lookups": 0, "index_hits": 0})
+        (profile.stack[-1]["children"] if profile.stack else profile.operators).append(record)
+        profile.__enter(record)
+        try:
+            yield record
+        finally:
+            profile.__exit(record)
+
+    def __enter(self, record):
+        current, peak = tracemalloc.get_traced_memory()
+        if self.stack:
+            self.stack[-1]["_peak"] = max(self.stack[-1]["_peak"], peak)
+        tracemalloc.reset_peak()
+        record["_start"] = (time.perf_counter(), current)
+        record["_peak"] = current
+        self.stack.append(record)
+
+    def __exit(self, record):
+        end = time.perf_counter()
+        current, peak = tracemalloc.get_traced_memory()
+        start, start_memory = record.pop("_start")
+        peak = max(record.pop("_peak"), peak)
+        record["time_ms"] = (end - start) * 1000
+        record["bytes"] = max(peak - start_memory, 0)
+        self.stack.pop()
+        if self.stack:
+            self.stack[-1]["_peak"] = max(self.stack[-1]["_peak"], peak)
+
+    @classmethod
+    def count(cls, key, n=1):
+        """ add `n` to the counter `key` (index_lookups, index_hits) of the running operator
+        """
+        profile = cls.active
+        if profile is not None and profile.stack:
+            profile.stack[-1][key] += n
+
+    @classmethod
+    def profile(cls, function, *args):
+        """ run function(*args) with profiling
+        :return: result of the function, list of the operator dicts it recorded
+        """
+        profile = cls()
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        cls.active = profile
+        try:
+            result = function(*args)
+        finally:
+            cls.active = None
+            if not tracing:
+                tracemalloc.stop()
+        return result, profile.operators
+
+    @classmethod
+    def format(cls, operators, analyze, depth=0):
+        """ render operator dicts as an indented tree, one line per operator
+        :return: list of strings
+        """
+        lines = []
+        if depth == 0:
+            header = "%-72s" % "OPERATOR"
+            if analyze:
+                header += " %10s %10s %10s %12s %8s" % ("ROWS IN", "ROWS OUT", "TIME (ms)", "BYTES", "INDEX")
+            lines.append(header.rstrip())
+        for record in operators:
+            text = "  " * depth + record["operator"]
+            if record["table"] is not None:
+                text += " " + record["table"]
+            details = ", ".join("%s: %s" % (key, cls.__format_value(value)) for key, value in record["details"].items()
+                                if key != "conditions")
+            if details:
+                text += " (%s)" % details
+            line = "%-72s" % text
+            if analyze:
+                line += " %10s %10s %10.3f %12d %8s" % (cls.__format_value(record["rows_in"]),
+                                                       cls.__format_value(record["rows_out"]), record["time_ms"],
+                                                       record["bytes"], "%d/%d" % (record["index_hits"],
+                                                                                   record["index_lookups"]))
+            lines.append(line.rstrip())
+            for condition in record["details"].get("conditions", []):
+                lines.append("  " * (depth + 1) + "%s: %s (selectivity %.3f)" % (
+                    condition["condition"], condition["access"], condition["selectivity"]))
+            lines += cls.format(record["children"], analyze, depth + 1)
+        return lines
+
+    @staticmethod
+    def __format_value(value):
+        if value is None:
+            return "-"
+        if isinstance(value, float):
+            return "%.3f" % value
+        return str(value)
@@ -0,0 +1,214 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+class Run:
+    """rows in a temporary file, the columns one after the other"""
+
+    def __init__(self, path, dtypes, num_rows):
+        """ create the file of a run of `num_rows` rows with columns of `dtypes`
+        """
+        self.path = path
+        self.dtypes = list(dtypes)
+        self.num_rows = num_rows
+        self.offsets = [0]
+        for dtype in self.dtypes:
+            self.offsets.append(self.offsets[-1] + dtype.itemsize * num_rows)
+        self.file = open(path, "w+b")
+        self.file.truncate(self.offsets[-1])
+
+    def write(self, idx, start, values):
+        """ write `values` to column `idx` from row `start` on
+        :return: None
+        """
+        self.file.seek(self.offsets[idx] + start * self.dtypes[idx].itemsize)
+        values.astype(self.dtypes[idx], copy=False).tofile(self.file)
+
+    def read(self, start, end):
+        """ :return: list of arrays, rows `start` to `end` of every column
+        """
+        columns = []
+        for idx, dtype in enumerate(self.dtypes):
+            self.file.seek(self.offsets[idx] + start * dtype.itemsize)
+            columns.append(np.fromfile(self.file, dtype=dtype, count=end - start))
+        return columns
+
+    def map(self):
+        """ close the file
+        :return: list of read-only memory-mapped columns
+        """
+        self.file.close()
+        return [np.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=(self.num_rows,))
+                for dtype, offset in zip(self.dtypes, self.offsets)]
+
+    def remove(self):
+        self.file.close()
+        os.remove(self.path)
+
+
+class ExternalSort:
+    """sort of a table within a memory budget, for tables that do not fit in memory.
+    The rows are read a slice at a time, every slice is sorted with np.lexsort and spilled
+    to a temporary file (a sorted run, see Run). The runs are merged k-way block
+    by block: every run contributes the next block of its rows, the rows that no later block
+    can precede are sorted and written to the output, and the runs advance past the rows
+    written. When there are too many runs for a block of each to fit in the budget, groups of
+    runs are merged into longer runs first. Ties keep the order of the input like the
+    in-memory sort, so the results are the same. The sorted columns are memory-mapped
+    """
+
+    # auto (external when the table is larger than the budget), memory or external
+    mode = "auto"
+    # memory budget of one sort in bytes
+    memory = 1 << 30
+    # directory of the temporary files, None for the default temporary directory
+    directory = None
+    # fewest rows read from a run at a time, more runs are merged in several passes
+    MIN_BLOCK = 1024
+    # most runs merged at once (each one keeps its file open)
+    MAX_FAN_IN = 64
+    # assumed size of a python object in a column that is not fixed-width
+    OBJECT_BYTES = 64
+
+    @classmethod
+    def configure(cls, mode=None, memory=None, directory=None):
+        """ change the mode (auto, memory or external), the memory budget in bytes or the
+        directory of the temporary files
+        :return: None
+        """
+        cls.mode = cls.mode if mode is None else mode
+        cls.memory = cls.memory if memory is None else memory
+        cls.directory = cls.directory if directory is None else directory
+
+    @classmethod
+    def row_bytes(cls, dtypes):
+        """ :param dtypes: dtypes of the columns
+        :return: size of one row in bytes
+        """
+        return sum(cls.OBJECT_BYTES if dtype == object else dtype.itemsize for dtype in dtypes)
+
+    @classmethod
+    def enabled(cls, num_rows, dtypes):
+        """ :return: True if a table of `num_rows` rows with columns of `dtypes` should be
+            sorted externally
+        """
+        if cls.mode == "auto":
+            return num_rows * cls.row_bytes(dtypes) > cls.memory
+        return cls.mode == "external" and num_rows > 0
+
+    @classmethod
+    def sort(cls, table, key_idxs):
+        """ sort the rows of `table` in ascending order of the columns `key_idxs`
+        :param table: Table to sort
+        :param key_idxs: positions of the sort columns, the first one is the most significant
+        :return: list of sorted, read-only memory-mapped columns (text columns that are
+            python objects come back as fixed-width unicode)
+        """
+        directory = tempfile.mkdtemp(prefix="minidb-sort-", dir=cls.directory)
+        try:
+            row_bytes = cls.row_bytes(table.col_dtypes.values())
+            runs = cls.__runs(table, key_idxs, row_bytes, directory)
+            # a block of MIN_BLOCK rows of every merged run fits in the budget
+            fan_in = min(cls.MAX_FAN_IN, max(2, cls.memory // (2 * row_bytes * cls.MIN_BLOCK)))
+            while len(runs) > 1:
+                runs = [cls.__merge(runs[i:i + fan_in], key_idxs, row_bytes, directory)
+                        for i in range(0, len(runs), fan_in)]
+            return runs[0].map()
+        finally:
+            # the mapped columns stay readable after their file is removed
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @staticmethod
+    def __create(dtypes, num_rows, directory):
+        """ :return: new Run in `directory`
+        """
+        fd, path = tempfile.mkstemp(dir=directory)
+        os.close(fd)
+        return Run(path, dtypes, num_rows)
+
+    @classmethod
+    def __runs(cls, table, key_idxs, row_bytes, directory):
+        """ sort `table` a slice of rows at a time and spill every sorted slice
+        :return: list of Runs in the order of the rows, their files are closed
+        """
+        # a slice is held twice (read and sorted) with its positions and sort order
+        run_rows = max(1, cls.memory // (2 * row_bytes + 16))
+        runs = []
+        for start in range(0, table.num_rows, run_rows):
+            part = table.take(table.name, np.arange(start, min(start + run_rows, table.num_rows)))
+            columns = [col if col.dtype != object else col.astype(str) for col in part.columns]
+            order = np.lexsort([columns[idx] for idx in reversed(key_idxs)])
+            run = cls.__create([col.dtype for col in columns], part.num_rows, directory)
+            for idx, col in enumerate(columns):
+                run.write(idx, 0, col[order])
+            run.file.close()
+            runs.append(run)
+        return runs
+
+    @staticmethod
+    def __bound(keys, value, side):
+        """ :param keys: sort columns of sorted rows
+        :param value: one value per sort column
+        :param side: left for the number of leading rows lower than `value`,
+            right for the number of rows not greater than `value`
+        :return: int
+        """
+        low, high = 0, len(keys[0])
+        for col, v in zip(keys, value):
+            if low == high:
+                break
+            part = col[low:high]
+            low, high = low + np.searchsorted(part, v, "left"), low + np.searchsorted(part, v, "right")
+        return low if side == "left" else high
+
+    @classmethod
+    def __merge(cls, runs, key_idxs, row_bytes, directory):
+        """ merge sorted runs into one, the files of the merged runs are removed
+        :param runs: list of Runs in the order of their rows
+        :return: Run, its file is closed
+        """
+        if len(runs) == 1:
+            return runs[0]
+        for run in runs:
+            run.file = open(run.path, "rb")
+        block = max(1, cls.memory // (2 * len(runs) * row_bytes))
+        dtypes = [np.result_type(*[run.dtypes[idx] for run in runs]) for idx in range(len(runs[0].dtypes))]
+        out = cls.__create(dtypes, sum(run.num_rows for run in runs), directory)
+        # rows of every run read but not written yet, and the number of rows read
+        buffers = [[np.empty(0, dtype=dtype) for dtype in run.dtypes] for run in runs]
+        read = [0] * len(runs)
+        written = 0
+        while written < out.num_rows:
+            for r, run in enumerate(runs):
+                if len(buffers[r][0]) < block and read[r] < run.num_rows:
+                    end = min(run.num_rows, read[r] + block - len(buffers[r][0]))
+                    buffers[r] = [np.concatenate([b, n]) for b, n in zip(buffers[r], run.read(read[r], end))]
+                    read[r] = end
+            # rows of a run with unread rows can only be written up to the last buffered one.
+            # The lowest of these rows (of the first run on ties) is the frontier: earlier
+            # runs write their rows up to and including it, later runs the rows before it
+            live = [r for r, run in enumerate(runs) if read[r] < run.num_rows]
+            frontier, owner = None, None
+            if len(live) > 0:
+                lasts = [np.array([buffers[r][idx][-1] for r in live]) for idx in key_idxs]
+                owner = live[np.lexsort(lasts[::-1])[0]]
+                frontier = [buffers[owner][idx][-1] for idx in key_idxs]
+            pieces = []
+            for r, buffer in enumerate(buffers):
+                cut = len(buffer[0])
+                if frontier is not None and r != owner:
+                    cut = cls.__bound([buffer[idx] for idx in key_idxs], frontier, "right" if r < owner else "left")
+                pieces.append([col[:cut] for col in buffer])
+                buffers[r] = [col[cut:] for col in buffer]
+            columns = [np.concatenate([piece[idx] for piece in pieces]) for idx in range(len(dtypes))]
+            # lexsort is stable: ties stay in the order of the runs
+            order = np.lexsort([columns[idx] for idx in reversed(key_idxs)])
+            for idx, col in enumerate(columns):
+                out.write(idx, written, col[order])
+            written += len(order)
+        for run in runs:
+            run.remove()
+        out.file.close()
+        return out
@@ -0,0 +1,72 @@
+import numpy as np
+
+
+class GroupBy:
+    """group-by engine over typed columns.
+    The key columns are factorized into one dense integer group id per row, rows are
+    ordered by group id once and every aggregate is computed with a single ufunc
+    reduction over the contiguous runs of each group
+    """
+
+    FUNCTIONS = ("sum", "avg", "count", "min", "max")
+
+    def __init__(self, key_columns, num_rows):
+        """
+        :param key_columns: list of 1-D np arrays to group by (empty for one global group)
+        :param num_rows: number of rows of the grouped table
+        """
+        self.num_rows = num_rows
+        if len(key_columns) == 0 or num_rows == 0:
+            self.group_ids = np.zeros(num_rows, dtype=np.int64)
+        else:
+            self.group_ids = self.factorize(key_columns)
+        self.order = np.argsort(self.group_ids, kind="stable")
+        sorted_ids = self.group_ids[self.order]
+        # position (in `order`) of the first row of every group
+        self.starts = np.flatnonzero(np.concatenate(([True], sorted_ids[1:] != sorted_ids[:-1])))
+        if num_rows == 0:
+            self.starts = np.empty(0, dtype=np.int64)
+        self.num_groups = len(self.starts)
+        # value of every key column for each group
+        self.keys = [col[self.order[self.starts]] for col in key_columns]
+
+    @staticmethod
+    def factorize(key_columns):
+        """map every distinct combination of key values to a dense integer id.
+        Ids follow the sort order of the keys (first column most significant)
+        :return: group id per row
+        """
+        group_ids = np.zeros(len(key_columns[0]), dtype=np.int64)
+        for col in key_columns:
+            values, codes = np.unique(col, return_inverse=True)
+            group_ids = group_ids * len(values) + codes.reshape(-1)
+            # keep the combined id dense so it cannot overflow
+            _, group_ids = np.unique(group_ids, return_inverse=True)
+            group_ids = group_ids.reshape(-1)
+        return group_ids
+
+    def aggregate(self, function, values=None):
+        """compute `function` over `values` for every group
+        :param function: one of sum, avg, count, min, max
+        :param values: 1-D np array with one value per row (not needed for count)
+        :return: 1-D np array with one value per group
+        """
+        if function == "count":
+            return np.bincount(self.group_ids, minlength=self.num_groups).astype(np.int64)
+        if function in ("sum", "avg") and values.dtype.kind not in "iufb":
+            raise ValueError("Invalid command. Cannot compute %s of a text column" % function)
+        if self.num_groups == 0:
+            return np.empty(0, dtype=values.dtype if function != "avg" else np.float64)
+        sorted_values = values[self.order]
+        if function == "sum":
+            return np.add.reduceat(sorted_values, self.starts)
+        if function == "avg":
+            counts = np.bincount(self.group_ids, minlength=self.num_groups)
+            return np.round(np.add.reduceat(sorted_values.astype(np.float64), self.starts) / counts, 4)
+        if values.dtype.kind in "iuf":
+            ufunc = np.minimum if function == "min" else np.maximum
+            return ufunc.reduceat(sorted_values, self.starts)
+        # text columns: order every group by value and pick its first/last entry
+        order = np.lexsort((values, self.group_ids))
+        ends = np.concatenate((self.starts[1:], [self.num_rows])) - 1
+        return values[order[self.starts if function == "min" else ends]]
@@ -1,68 +1,384 @@
-from BTrees.OOBTree import OOBTree
+import math
+import sys
+import time
+import numpy as np
+from BTrees.LLBTree import LLBTree
+from BTrees.OLBTree import OLBTree
+
+
+class HashTable:
+    """open addressing hash table mapping the distinct values of a numeric column to
+    their slot. Slots live in one flat int array (linear probing, load factor <= 0.5)
+    :param keys: 1-D np array of distinct int64 or float64 values, slot s holds keys[s]
+    """
+
+    MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+    def __init__(self, keys):
+        self.keys = keys + 0 if keys.dtype.kind in "iu" else keys + 0.0  # -0.0 -> 0.0
+        self.__allocate(len(self.keys))
+
+    def __allocate(self, num_keys):
+        """ (re)create the slot array with room for `num_keys` keys and place every key
+        """
+        self.bits = max(3, int(np.ceil(np.log2(max(2 * num_keys, 1)))))
+        slot_dtype = np.int32 if num_keys < 2**31 else np.int64
+        self.table = np.full(1 << self.bits, -1, dtype=slot_dtype)
+        self.__place(np.arange(len(self.keys)))
+
+    def __place(self, pending):
+        """ insert keys[pending] in rounds, each round places at most one key per free position
+        """
+        mask = (1 << self.bits) - 1
+        positions = np.zeros(len(self.keys), dtype=np.int64)
+        positions[pending] = self.__positions(self.keys[pending])
+        placed = np.zeros(len(self.keys), dtype=bool)
+        while len(pending) > 0:
+            pos = positions[pending]
+            free = self.table[pos] == -1
+            free_pos, first = np.unique(pos[free], return_index=True)
+            winners = pending[free][first]
+            self.table[free_pos] = winners
+            placed[winners] = True
+            pending = pending[~placed[pending]]
+            positions[pending] = (positions[pending] + 1) & mask
+
+    def add(self, keys):
+        """ insert new distinct keys, they get the next free slots
+        :param keys: 1-D np array of keys not yet in the table
+        """
+        first_slot = len(self.keys)
+        self.keys = np.concatenate((self.keys, keys + 0 if keys.dtype.kind in "iu" else keys + 0.0))
+        if 2 * len(self.keys) > len(self.table):
+            self.__allocate(len(self.keys))
+        else:
+            self.__place(np.arange(first_slot, len(self.keys)))
+
+    @classmethod
+    def restore(cls, keys, table):
+        """ hash table from the keys and the slot array of a stored one (read-only arrays
+        are fine as long as the table is copied before keys are added)
+        """
+        hash_table = cls.__new__(cls)
+        hash_table.keys = keys
+        hash_table.bits = int(len(table)).bit_length() - 1
+        hash_table.table = table
+        return hash_table
+
+    def copy(self):
+        """ independent copy (the keys array is never modified in place and is shared)
+        """
+        table = HashTable.__new__(HashTable)
+        table.keys = self.keys
+        table.bits = self.bits
+        table.table = self.table.copy()
+        return table
+
+    def __positions(self, keys):
+        """ home position of every key (multiplicative hashing of the key bits)
+        """
+        bits = keys.astype(self.keys.dtype).view(np.uint64)
+        return ((bits * self.MULTIPLIER) >> np.uint64(64 - self.bits)).astype(np.int64)
+
+    def get(self, key, default=None):
+        mask = (1 << self.bits) - 1
+        pos = int(self.__positions(np.array([key]))[0])
+        while True:
+            slot = self.table[pos]
+            if slot == -1:
+                return default
+            if self.keys[slot] == key:
+                return int(slot)
+            pos = (pos + 1) & mask
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def items(self):
+        return zip(self.keys.tolist(), range(len(self.keys)))
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
 
 
 class Index:
+    """single column index.
+    Postings are kept in CSR form: `keys` holds the distinct values of the column in
+    sorted order, the row positions of the rows with value keys[s] are
+    rowids[offsets[s]:offsets[s+1]] (ascending), slots are stable: keys of appended
+    rows get new slots at the end and `key_order` lists the slots in key order.
+    `index` maps each key to its slot s:
+    a HashTable (dict for text columns) for Hash indexes, a typed BTree for Btree
+    indexes (LLBTree for integer columns so that keys are ordered numerically,
+    OLBTree otherwise). Indexes read from an index file (see IndexFile) load a stored
+    key map on first use
+    """
 
-    def __init__(self, table, col_idx, idx_type, transform_criteria=None):
+    def __init__(self, table, col_idx, idx_type):
         self.index = None
         self.type = idx_type
         self.table = table
-        self.transform_criteria = transform_criteria
-        # table.indexes[col_idx]=idx_type
+        self.col_idx = col_idx
+        start_time = time.perf_counter()
+        values = table.get_column(col_idx)
+        self.is_int = values.dtype.kind in "iu"
+        self.build_csr(values)
+        self.index = self.build_map(idx_type, self.keys)
+        self.build_time = time.perf_counter() - start_time
+        # True while the key map is shared with a snapshot (copy-on-write)
+        self.shared = False
+
+    @classmethod
+    def restore(cls, table, col_idx, idx_type, arrays, load_map):
+        """ index from postings and a key map that were stored with the table.
+        The arrays may be read-only (memory-mapped), they are never modified in place and
+        the key map is copied before the first append
+        :param table: the indexed table
+        :param col_idx: position of the indexed column
+        :param idx_type: Hash or Btree
+        :param arrays: dict with the keys, offsets, rowids and key_order arrays
+        :param load_map: function returning the key -> slot map
+        :return: Index
+        """
+        index = cls.__new__(cls)
+        index.type = idx_type
+        index.table = table
+        index.col_idx = col_idx
+        index.is_int = table.col_dtypes[col_idx].kind in "iu"
+        index.keys, index.offsets = arrays["keys"], arrays["offsets"]
+        index.rowids, index.key_order = arrays["rowids"], arrays["key_order"]
+        index.index = None
+        index.__load_map = load_map
+        index.build_time = 0.0
+        index.shared = True
+        return index
+
+    @property
+    def index(self):
+        """ key -> slot map, a stored map is loaded when first used
+        """
+        if self.__map is None and self.__load_map is not None:
+            self.__map = self.__load_map()
+            self.__load_map = None
+        return self.__map
 
+    @index.setter
+    def index(self, value):
+        self.__map = value
+        self.__load_map = None
+
+    @staticmethod
+    def build_map(idx_type, keys, slots=None):
+        """ bulk load the key -> slot map from the sorted distinct keys
+        :param idx_type: Hash or Btree
+        :param keys: 1-D np array of sorted distinct keys
+        :param slots: slot of every key, None if slot s holds keys[s]
+        :return: key -> slot map
+        """
+        if idx_type == "Hash" and keys.dtype.kind in "iuf" and slots is None:
+            return HashTable(keys)
+        pairs = zip(keys.tolist(), range(len(keys)) if slots is None else slots.tolist())
         if idx_type == "Hash":
-            self.create_hash_index(col_idx)
-        elif idx_type == "Hash_Transform":
-            self.create_transform_hash_index(col_idx)
+            return dict(pairs)
+        tree = LLBTree() if keys.dtype.kind in "iu" else OLBTree()
+        # keys are sorted, so the tree is filled from left to right in one call
+        tree.update(list(pairs))
+        return tree
+
+    @property
+    def nbytes(self):
+        """ approximate memory used by the index (postings and key map)
+        """
+        size = self.keys.nbytes + self.offsets.nbytes + self.rowids.nbytes
+        if isinstance(self.index, HashTable):
+            return size + self.index.nbytes
+        if isinstance(self.index, dict):
+            return size + sys.getsizeof(self.index) + sum(sys.getsizeof(k) for k in self.index)
+        # BTree buckets hold one 8 byte key (or object pointer) and one 8 byte value per entry
+        return size + 16 * len(self.index)
+
+    @staticmethod
+    def csr(values, first_rowid=0):
+        """ group the row positions of `values` by value
+        :param values: 1-D np array (indexed column)
+        :param first_rowid: row position of values[0]
+        :return: sorted distinct keys, offsets, row positions grouped by key
+        """
+        # row positions fit in 32 bits for all but huge tables
+        rowid_dtype = np.int32 if first_rowid + len(values) < 2**31 else np.int64
+        order = np.argsort(values, kind="stable")
+        sorted_values = values[order]
+        starts = np.flatnonzero(np.concatenate(([True], sorted_values[1:] != sorted_values[:-1])))
+        if len(values) == 0:
+            starts = np.empty(0, dtype=np.int64)
+        offsets = np.append(starts, len(values)).astype(np.int64)
+        return sorted_values[starts], offsets, order.astype(rowid_dtype) + rowid_dtype(first_rowid)
+
+    def build_csr(self, values):
+        """ build the postings of the index from the whole column
+        :param values: 1-D np array (indexed column)
+        :return: None
+        """
+        self.keys, self.offsets, self.rowids = self.csr(values)
+        self.key_order = np.arange(len(self.keys))
+
+    def snapshot(self, table):
+        """ copy-on-write copy of the index for a copy of the indexed table.
+        Postings arrays are only ever replaced, never modified in place, so they are
+        shared; the key map is copied by whichever side is appended to first
+        :param table: the table copy owning the snapshot
+        :return: Index
+        """
+        copy = Index.__new__(Index)
+        copy.__dict__.update(self.__dict__)
+        copy.table = table
+        copy.shared = self.shared = True
+        return copy
+
+    def __detach(self):
+        """ take a private copy of the key map before modifying it
+        """
+        if isinstance(self.index, HashTable):
+            self.index = self.index.copy()
         else:
-            self.index = OOBTree()
-            for i, row in enumerate(self.table.rows):
-                k = row[col_idx]
-                if k in self.index:
-                    self.index[k].append((i, col_idx))
-                else:
-                    self.index[k] = [(i, col_idx)]
-
-    def create_hash_index(self, col_idx):
-        self.index = {}
-        if self.table.is_col_numeric(col_idx):
-            for i, row in enumerate(self.table.rows):
-                k = float(row[col_idx])
-                if k in self.index.keys():
-                    self.index[k].append((i, col_idx))
-                else:
-                    self.index[k] = [(i, col_idx)]
-    
-        else:  # indexed column is not numberic ; keys should be strings
-            for i, row in enumerate(self.table.rows):
-                k = row[col_idx]
-                if k in self.index.keys():
-                    self.index[k].append((i, col_idx))
-                else:
-                    self.index[k] = [(i, col_idx)]
-
-    def create_transform_hash_index(self, col_idx):
-        # assuming transformed coclumns are numeric
-        self.index = {}
-        arithop = self.transform_criteria[0]
-        constant = self.transform_criteria[1]
-        for i, row in enumerate(self.table.rows):
-            key = row[col_idx]
-            transformed_key = arithop(float(key), float(constant))
-            if transformed_key in self.index.keys():
-                self.index[transformed_key].append((i, col_idx))
-            else:
-                self.index[transformed_key] = [(i, col_idx)]
+            self.index = type(self.index)(self.index)
+        self.shared = False
 
-    def get_pos(self, key):
-        if key in self.index.keys():
-            return self.index[key]
+    def __add_to_map(self, keys, slots):
+        if isinstance(self.index, HashTable):
+            self.index.add(keys)  # new keys always get the next free slots
         else:
+            self.index.update(list(zip(keys.tolist(), slots.tolist())))
+
+    def append(self, values, first_rowid):
+        """ merge the postings of newly appended rows into the index.
+        Existing postings are moved, not rebuilt: only the appended rows are sorted
+        :param values: 1-D np array, indexed column of the appended rows
+        :param first_rowid: row position of the first appended row
+        :return: None
+        """
+        if len(values) == 0:
+            return
+        if self.shared:
+            self.__detach()
+        batch_keys, batch_offsets, batch_rowids = self.csr(values, first_rowid)
+
+        # slot of every key of the batch, keys not seen before get new slots
+        num_slots = len(self.keys)
+        sorted_keys = self.keys[self.key_order]
+        pos = np.searchsorted(sorted_keys, batch_keys)
+        found = pos < num_slots
+        found[found] = sorted_keys[pos[found]] == batch_keys[found]
+        new = ~found
+        slots = np.empty(len(batch_keys), dtype=np.int64)
+        slots[found] = self.key_order[pos[found]]
+        slots[new] = num_slots + np.arange(np.count_nonzero(new))
+        self.key_order = np.insert(self.key_order, pos[new], slots[new])
+        self.keys = np.concatenate((self.keys, batch_keys[new]))
+        self.__add_to_map(batch_keys[new], slots[new])
+
+        # merge the postings: every slot grows by the number of appended rows with its key
+        old_counts = np.zeros(len(self.keys), dtype=np.int64)
+        old_counts[:num_slots] = np.diff(self.offsets)
+        batch_counts = np.diff(batch_offsets)
+        counts = old_counts.copy()
+        counts[slots] += batch_counts
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        rowid_dtype = np.int32 if offsets[-1] < 2**31 else np.int64
+        rowids = np.empty(offsets[-1], dtype=rowid_dtype)
+        # old postings move to the start of their (shifted) slot
+        dest = np.arange(len(self.rowids)) + np.repeat(offsets[:num_slots] - self.offsets[:-1],
+                                                       old_counts[:num_slots])
+        rowids[dest] = self.rowids
+        # appended rows have larger positions, they go right after the old postings
+        dest = np.arange(len(batch_rowids)) + np.repeat(offsets[slots] + old_counts[slots] - batch_offsets[:-1],
+                                                        batch_counts)
+        rowids[dest] = batch_rowids
+        self.offsets = offsets
+        self.rowids = rowids
+
+    def __normalize_key(self, key):
+        """ convert a lookup key to the type of the indexed column
+        :return: converted key, None if no row can have this value
+        """
+        numeric = self.keys.dtype.kind in "iuf"
+        if numeric and isinstance(key, str):
             return None
+        if self.is_int:
+            if not float(key).is_integer():
+                return None
+            return int(key)
+        if numeric:
+            return float(key)
+        return key
 
-    def print(self, f=None):
-        for k, v in self.index.items():
-            print("%-10s -> %s" % (k, v), file=f)
+    def __normalize_bound(self, bound, exclude, lower):
+        """ convert a range bound to the type of the indexed column.
+        Non integral bounds on integer columns are rounded inwards
+        :return: bound, exclude flag
+        """
+        if bound is None or not self.is_int:
+            return bound, exclude
+        if float(bound).is_integer():
+            return int(bound), exclude
+        return (math.ceil(bound) if lower else math.floor(bound)), False
 
+    def __postings(self, slots):
+        """ row positions of all rows in the given slots
+        :param slots: 1-D np array of slots
+        :return: sorted np array of row positions
+        """
+        starts = self.offsets[slots]
+        counts = self.offsets[slots + 1] - starts
+        shift = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        rowids = self.rowids[np.arange(int(counts.sum())) + shift]
+        rowids.sort()
+        return rowids
 
+    def get_pos(self, key):
+        """ positions of the rows whose indexed value equals `key`
+        :return: np array of row positions or None if the key is not present
+        """
+        key = self.__normalize_key(key)
+        if key is None:
+            return None
+        try:
+            slot = self.index.get(key)
+        except TypeError:   # key not comparable with the indexed values
+            return None
+        if slot is None:
+            return None
+        return self.rowids[self.offsets[slot]:self.offsets[slot + 1]]
+
+    def lookup(self, key):
+        """ positions of the rows whose indexed value equals `key`
+        :param key: value to look up
+        :return: sorted np array of row positions
+        """
+        rowids = self.get_pos(key)
+        if rowids is None:
+            return np.empty(0, dtype=self.rowids.dtype)
+        return rowids
 
+    def range_lookup(self, low=None, high=None, exclude_low=False, exclude_high=False):
+        """ positions of the rows whose indexed value lies between `low` and `high`.
+        Only supported by Btree indexes
+        :return: sorted np array of row positions, None if the index cannot answer range queries
+        """
+        if self.type != "Btree":
+            return None
+        low, exclude_low = self.__normalize_bound(low, exclude_low, True)
+        high, exclude_high = self.__normalize_bound(high, exclude_high, False)
+        try:
+            slots = np.fromiter(self.index.values(low, high, exclude_low, exclude_high), dtype=np.int64)
+        except TypeError:   # bounds not comparable with the indexed values
+            return None
+        return self.__postings(slots)
+
+    def print(self, f=None):
+        for k, slot in self.index.items():
+            print("%-10s -> %s" % (k, self.rowids[self.offsets[slot]:self.offsets[slot + 1]].tolist()), file=f)
@@ -1,10 +1,33 @@
 from minidb.table import Table
 import operator
+from minidb.explain import Profiler
+from minidb.parallel import Parallel
 from minidb.utils import Utils as utils
 import numpy as np
 
 
+def join_partition(arrays, p, num_keys):
+	"""equi-join the rows of hash partition `p` of both tables (runs in a worker)
+	:param arrays: order1/order2 (row positions grouped by partition), bounds1/bounds2
+		(first position of every partition) and the key columns key1_k/key2_k
+	:param p: partition number
+	:param num_keys: number of equality conditions
+	:return: positions of the matching rows in t1, positions of the matching rows in t2
+	"""
+	rows1 = arrays["order1"][arrays["bounds1"][p]:arrays["bounds1"][p + 1]]
+	rows2 = arrays["order2"][arrays["bounds2"][p]:arrays["bounds2"][p + 1]]
+	if len(rows1) == 0 or len(rows2) == 0:
+		return Join.empty()
+	values = [(arrays["key1_%d" % k][rows1], arrays["key2_%d" % k][rows2]) for k in range(num_keys)]
+	pos1, pos2 = Join.equi_pairs(*Join.composite_keys(values))
+	return rows1[pos1], rows2[pos2]
+
+
 class Join:
+	"""computes the pairs of matching rows of two tables.
+	Every join algorithm returns two aligned arrays of row positions (one into each table),
+	the caller gathers the output columns from them in one step
+	"""
 	def __init__(self, t1, t2, criteria):
 		self.t1_name = t1.name
 		self.t2_name = t2.name
@@ -13,185 +36,421 @@ class Join:
 		self.criteria = criteria
 
 		self.tables = {t1.name: self.t1, t2.name: self.t2}
-		self.table_rows = {t1.name: [], t2.name: []}
+		# chosen by do_join: algorithm name and the table whose keys are sorted or hashed
+		self.algorithm = None
+		self.build_side = None
 
-		self.out_rows = []
+	# inputs with at most this many pairs of rows are joined by comparing every pair
+	NESTED_LOOP_PAIRS = 1 << 14
 
-	def do_join(self):
-		# decide which join to use
-		# use merge join if there is one condition, the condition is equality, and there are no duplicates
-		if len(self.criteria.eq_conditions) == 1 and len(self.criteria.conditions) == 1: #add arithops and (self.criteria.arithops[0][0] is None)
-			self.out_rows = self.indexjoin_single(self.criteria.conditions[0])
-		elif len(self.criteria.eq_conditions) == 0:
-			self.out_rows = self.nestedloopjoin()
-		else:
-			self.out_rows = self.indexjoin_multiple(self.criteria.conditions[0])
-		return self.out_rows
-
-	def nestedloopjoin(self):
-		new_rows = []
-
-		for row1 in self.t1.rows:
-			for row2 in self.t2.rows:
-				if self.check_conditions(row1, row2):
-					new_row = np.concatenate([row1, row2])
-					new_rows.append(new_row)
-				else:
-					continue
-		return new_rows
-
-	def check_conditions(self, row1, row2):
-		if self.criteria.arithops[0][0] is None and self.criteria.arithops[0][1] is None:
-			for i in range(0, self.criteria.num_conditions):
-				table_a_name, col_a, table_b_name, col_b = self.criteria.conditions[i]
-				idx_a = self.tables[table_a_name].col_names[col_a]
-				idx_b = self.tables[table_b_name].col_names[col_b]
-				if table_a_name == self.t1_name:
-					val_a = row1[idx_a]
-					val_b = row2[idx_b]
-				else:
-					val_a = row2[idx_a]
-					val_b = row1[idx_b]
-				if not self.check_condition(i, val_a, val_b):
+	def valid(self):
+		"""check that every condition compares columns of the two joined tables
+		:return: True / False (a message is printed)
+		"""
+		for condition in self.criteria.conditions:
+			for side in range(2):
+				table_name, column = condition[2 * side], condition[2 * side + 1]
+				if table_name not in self.tables:
+					print("Invalid command. Table %s is not joined" % table_name)
+					return False
+				if column not in self.tables[table_name].col_names:
+					print("Invalid command. Column %s not present in table %s" % (column, table_name))
 					return False
-				else:
-					continue
-			return True
-		else:
-			# print("handle arithop TODO")
-			return
-
-	def check_condition(self, i, val1, val2):
-		comparator = utils.OPERATORS[self.criteria.comparators[i]]
-		if utils.NUMERIC[comparator]:
-			if not comparator(float(val1), float(val2)):
-				return False
-		else:
-			if not comparator(val1, val2):
-				return False
 		return True
 
-	def indexjoin_single(self, condition):
-		if self.criteria.arithops[0][0] is None and self.criteria.arithops[0][1] is None:
-			table1_name, col1, table2_name, col2 = condition
-			t1 = self.tables[table1_name]
-			idx1 = t1.col_names[col1]   # get index of column in table
-
-			t2 = self.tables[table2_name]
-			if col2 not in t2.indexes:
-				t2.hash_index(col2)
-			t2_idx = t2.indexes[col2]
-
-			new_rows = []
-			for i, row1 in enumerate(t1.rows):
-				val1 = row1[idx1]
-				try:
-					val1 = float(val1)
-				except:
-					val1 = val1
-				pos = t2_idx.get_pos(val1)
-				if pos is None:
-					continue
-				else:
-					for p in pos:
-						new_row = np.concatenate([row1, t2.rows[p[0]]])
-						new_rows.append(new_row)
-			return new_rows
-		else:
-			return self.indexjoin_single_arithop(condition)
-
-	def indexjoin_single_arithop(self, condition):
-		del_index = False
-		table1_name, col1, table2_name, col2 = condition
-		t1 = self.tables[table1_name]
-		idx1 = t1.col_names[col1]
-
-		t2 = self.tables[table2_name]
-		if self.criteria.arithops[0][1] is not None:
-			# create new index on transformed keys
-			del_index = True #delete transformed index after we are done using it
-			t2.apply_hash_transformation(col2, self.criteria.constants[0][1], self.criteria.arithops[0][1])
-			t2_idx = t2.indexes[col2+"_tr"]
-		elif col2 not in t2.indexes:
-			t2.hash_index(col2)
-			t2_idx = t2.indexes[col2]
-		else:
-			t2_idx = t2.indexes[col2]
-		
-		new_rows = []
-		for i, row1 in enumerate(t1.rows):
-			val1 = row1[idx1]
-			if self.criteria.arithops[0][0] is not None:
-				arithop = self.criteria.arithops[0][0]
-				val1 = utils.OPERATORS[arithop](float(val1), float(self.criteria.constants[0][0]))
-			else:
-				try:
-					val1 = float(val1)
-				except:
-					val1 = val1
+	def choose(self):
+		"""decide which join to use from the sizes and column statistics of the tables
+		:return: algorithm (nested loop, band, partitioned hash, merge or hash), name of the
+			build side (the table that is sorted, hashed or searched) or None
+		"""
+		n1, n2 = self.t1.num_rows, self.t2.num_rows
+		if n1 * n2 <= self.NESTED_LOOP_PAIRS:
+			return "nested loop", None
+		if len(self.criteria.eq_conditions) == 0:
+			return "band", self.t2_name
+		if Parallel.partitioned_join(n1 + n2):
+			return "partitioned hash", self.t2_name
+		if len(self.criteria.eq_conditions) == 1:
+			stats1, stats2 = self.key_stats(0)
+			if stats2 is not None and stats2.sorted:
+				return "merge", self.t2_name
+			if stats1 is not None and stats1.sorted:
+				return "merge", self.t1_name
+		return "hash", self.t1_name if n1 < n2 else self.t2_name
 
-			# print(val1)
-			pos = t2_idx.get_pos(val1)
+	def do_join(self):
+		"""decide which join to use and run it
+		:return: positions of the matching rows in t1, positions of the matching rows in t2
+		"""
+		self.algorithm, self.build_side = self.choose()
+		if self.algorithm == "nested loop":
+			return self.broadcastjoin()
+		if self.algorithm == "band":
+			return self.bandjoin()
+		return self.hashjoin()
 
-			if pos is None:																
-				continue
-			else:
-				for p in pos:
-					new_row = np.concatenate([row1, t2.rows[p[0]]])
-					new_rows.append(new_row)
-		if del_index:
-			del t2.indexes[col2+"_tr"]
-		return new_rows
-
-	def indexjoin_multiple(self, condition):
-		table1_name, col1, table2_name, col2 = condition
-		self.table_rows[table1_name] = []
-		self.table_rows[table2_name] = []
-		t1 = self.tables[table1_name]
-		idx1 = t1.col_names[col1]   # get index of column in table
-
-		t2 = self.tables[table2_name]
-		if col2 not in t2.indexes:
-			t2.hash_index(col2)
-		t2_idx = t2.indexes[col2]
-
-		new_rows = []
-
-		for i, row1 in enumerate(t1.rows):
-			val1 = row1[idx1]
-			try:
-				val1 = float(val1)
-			except:
-				val1 = val1
-			pos = t2_idx.get_pos(val1)
-
-			if pos is None:
+	def explain(self):
+		"""describe the plan of the join without running it
+		:return: dict with the algorithm, the build and probe sides and the estimated number of rows,
+			empty if the conditions are not valid
+		"""
+		if not self.valid():
+			return {}
+		algorithm, build_side = self.choose()
+		probe_side = None
+		if build_side is not None:
+			probe_side = self.t2_name if build_side == self.t1_name else self.t1_name
+		return {"algorithm": algorithm, "build": build_side, "probe": probe_side,
+				"estimated_rows": self.estimate_rows()}
+
+	def estimate_rows(self):
+		"""estimated number of matching pairs: every equality condition keeps 1 / (distinct count of
+		the key) of the pairs, every other condition except != keeps a third of them
+		"""
+		rows = float(self.t1.num_rows) * self.t2.num_rows
+		for i in range(self.criteria.num_conditions):
+			if i < len(self.criteria.eq_conditions):
+				distinct = [stats.distinct for stats in self.key_stats(i) if stats is not None]
+				rows /= max(distinct + [1]) if distinct else max(self.t1.num_rows, self.t2.num_rows, 1)
+			elif self.criteria.comparators[i] != "!=":
+				rows /= 3
+		return int(round(rows))
+
+	def result(self, out_table_name):
+		"""run the join and build the output table from the matching row positions.
+		Output columns are prefixed with the name of their table and are only gathered when read
+		:param out_table_name: name of the resulting table
+		:return: Table, None if the conditions are not valid
+		"""
+		if not self.valid():
+			return None
+		t1_cols = [self.t1_name + "_" + x for x in self.t1.col_names]
+		t2_cols = [self.t2_name + "_" + x for x in self.t2.col_names]
+		table = Table(out_table_name, t1_cols + t2_cols)
+		with Profiler.operator("pairs", rows_in=self.t1.num_rows + self.t2.num_rows,
+							   describe=self.explain) as op:
+			pos1, pos2 = self.do_join()
+			op["rows_out"] = len(pos1)
+		table.set_sources(self.t1.sources(pos1) + self.t2.sources(pos2))
+		return table
+
+	def operand(self, i, side):
+		"""evaluate one side of condition `i` as a column expression,
+		e.g. A.saleid*2 or 36-A.saleid
+		:param side: 0 for the left hand side of the comparator, 1 for the right hand side
+		:return: 1-D np array with one value per row of the side's table
+		"""
+		condition = self.criteria.conditions[i]
+		table = self.tables[condition[2 * side]]
+		values = table.get_column(table.col_names[condition[2 * side + 1]])
+		arithop = self.criteria.arithops[i][side]
+		if arithop is None:
+			return values
+		arithop = utils.OPERATORS[arithop]
+		constant = float(self.criteria.constants[i][side])
+		if self.criteria.constant_first[i][side]:
+			return arithop(constant, values.astype(np.float64))
+		return arithop(values.astype(np.float64), constant)
+
+	def get_sides(self, i):
+		"""get the values compared by condition `i`, oriented so that the first array
+		comes from t1 and the second from t2
+		:param i: position of the condition in the criteria
+		:return: t1 values, t2 values, comparator
+		"""
+		comparator = self.criteria.comparators[i]
+		val_a = self.operand(i, 0)
+		val_b = self.operand(i, 1)
+		if self.criteria.conditions[i][0] == self.t1_name:
+			return val_a, val_b, comparator
+		return val_b, val_a, utils.REVERSE_COMPARATOR[comparator]
+
+	@staticmethod
+	def comparable(val1, val2):
+		"""cast two key columns to a common type so they can be compared
+		:return: both columns, or None if values of the two columns can never be equal
+		"""
+		numeric1 = utils.is_numeric_dtype(val1.dtype)
+		numeric2 = utils.is_numeric_dtype(val2.dtype)
+		if numeric1 != numeric2:
+			return None
+		if numeric1 and val1.dtype != val2.dtype:
+			return val1.astype(np.float64), val2.astype(np.float64)
+		return val1, val2
+
+	@staticmethod
+	def factorize(val1, val2):
+		"""map the values of two key columns to integer codes from one shared dictionary
+		:return: codes of val1, codes of val2, number of distinct values
+		"""
+		uniques, codes = np.unique(np.concatenate([val1, val2]), return_inverse=True)
+		codes = codes.reshape(-1)
+		return codes[:len(val1)], codes[len(val1):], len(uniques)
+
+	@staticmethod
+	def expand_ranges(starts, ends, order):
+		"""expand, for every row i of t1, the range [starts[i], ends[i]) of sorted t2 positions
+		into explicit pairs
+		:param order: permutation that sorts t2
+		:return: positions into t1, positions into t2 (ordered by i, then by sort position)
+		"""
+		counts = np.maximum(ends - starts, 0)
+		pos1 = np.repeat(np.arange(len(starts)), counts)
+		# offset of each output pair inside its range
+		shift = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+		pos2 = order[np.arange(len(pos1)) + shift]
+		return pos1, pos2
+
+	@staticmethod
+	def equi_pairs(keys1, keys2, presorted=False):
+		"""find all pairs (i, j) with keys1[i] == keys2[j].
+		keys2 is sorted once, every key of keys1 is probed with a binary search and the
+		matching ranges are expanded in bulk
+		:param presorted: True if keys2 is already sorted
+		:return: positions into keys1, positions into keys2 (ordered by i, then j)
+		"""
+		order = np.arange(len(keys2)) if presorted else np.argsort(keys2, kind="stable")
+		sorted_keys = keys2 if presorted else keys2[order]
+		lo = np.searchsorted(sorted_keys, keys1, "left")
+		hi = np.searchsorted(sorted_keys, keys1, "right")
+		return Join.expand_ranges(lo, hi, order)
+
+	@staticmethod
+	def band_ranges(val1, sorted_val2, comparator):
+		"""for every value of t1, the ranges of positions in the sorted t2 values that
+		satisfy `val1 comparator val2`
+		:return: list of (starts, ends) arrays, two ranges for != and one otherwise
+		"""
+		m = len(sorted_val2)
+		first = np.zeros(len(val1), dtype=np.int64)
+		last = np.full(len(val1), m, dtype=np.int64)
+		if comparator == "<":
+			return [(np.searchsorted(sorted_val2, val1, "right"), last)]
+		if comparator == "≤":
+			return [(np.searchsorted(sorted_val2, val1, "left"), last)]
+		if comparator == ">":
+			return [(first, np.searchsorted(sorted_val2, val1, "left"))]
+		if comparator == "≥":
+			return [(first, np.searchsorted(sorted_val2, val1, "right"))]
+		# != : everything before and after the run of equal values
+		return [(first, np.searchsorted(sorted_val2, val1, "left")),
+				(np.searchsorted(sorted_val2, val1, "right"), last)]
+
+	def bandjoin(self):
+		"""join on inequality conditions only. t2 is sorted on the column of the most
+		selective condition and the matching ranges are found with binary searches;
+		a second condition on the same t2 column narrows the same ranges, any other
+		condition is checked on the resulting pairs.
+		Text is not ordered against numbers: such a condition matches no pair, or every pair for !=
+		:return: positions of the matching rows in t1, positions of the matching rows in t2
+		"""
+		sides = []
+		for i in range(self.criteria.num_conditions):
+			val1, val2, comparator = self.get_sides(i)
+			values = self.comparable(val1, val2)
+			if values is None:
+				if comparator != "!=":
+					return self.empty()
 				continue
+			sides.append((values[0], values[1], comparator, self.t2_column(i)))
+		if len(sides) == 0:
+			n1, n2 = self.t1.num_rows, self.t2.num_rows
+			return np.repeat(np.arange(n1, dtype=np.int64), n2), np.tile(np.arange(n2, dtype=np.int64), n1)
+
+		# pick the condition producing the fewest candidate pairs
+		best = None
+		for i, (val1, val2, comparator, column) in enumerate(sides):
+			order = np.argsort(val2, kind="stable")
+			ranges = self.band_ranges(val1, val2[order], comparator)
+			size = sum(int(np.maximum(e - s, 0).sum()) for s, e in ranges)
+			if best is None or size < best[0]:
+				best = (size, i, order, ranges)
+		_, driver, order, ranges = best
+
+		remaining = [i for i in range(len(sides)) if i != driver]
+		if len(ranges) == 1:
+			for i in list(remaining):
+				val1, val2, comparator, column = sides[i]
+				if column == sides[driver][3] and comparator != "!=":
+					# band condition on the same t2 column: intersect the ranges
+					starts, ends = self.band_ranges(val1, val2[order], comparator)[0]
+					ranges = [(np.maximum(ranges[0][0], starts), np.minimum(ranges[0][1], ends))]
+					remaining.remove(i)
+
+		pairs = [self.expand_ranges(starts, ends, order) for starts, ends in ranges]
+		pos1 = np.concatenate([p[0] for p in pairs])
+		pos2 = np.concatenate([p[1] for p in pairs])
+		for i in remaining:
+			val1, val2, comparator, _ = sides[i]
+			keep = utils.OPERATORS[comparator](val1[pos1], val2[pos2])
+			pos1 = pos1[keep]
+			pos2 = pos2[keep]
+		# same order as the nested loop join
+		order = np.lexsort((pos2, pos1))
+		return pos1[order], pos2[order]
+
+	def t2_column(self, i):
+		"""expression on t2 used by condition `i`
+		"""
+		side = 0 if self.criteria.conditions[i][0] == self.t2_name else 1
+		return (self.criteria.conditions[i][2 * side + 1], self.criteria.arithops[i][side],
+				self.criteria.constants[i][side], self.criteria.constant_first[i][side])
+
+	@staticmethod
+	def composite_keys(values):
+		"""combine the key columns of all equality conditions into one integer key per row,
+		a single key column is used as it is
+		:param values: list of (t1 values, t2 values) pairs of comparable key columns
+		:return: keys of t1, keys of t2
+		"""
+		if len(values) == 1:
+			return values[0]
+		keys1 = np.zeros(len(values[0][0]), dtype=np.int64)
+		keys2 = np.zeros(len(values[0][1]), dtype=np.int64)
+		for i, (val1, val2) in enumerate(values):
+			codes1, codes2, n = Join.factorize(val1, val2)
+			keys1 = keys1 * n + codes1
+			keys2 = keys2 * n + codes2
+			if i + 1 < len(values):
+				# keep the composite key dense so it does not overflow
+				keys1, keys2, _ = Join.factorize(keys1, keys2)
+		return keys1, keys2
+
+	@staticmethod
+	def hash_partitions(values, num_partitions):
+		"""assign every row to a partition by hashing its key, rows with equal keys
+		get the same partition
+		:param values: list of (t1 values, t2 values) pairs of comparable key columns
+		:param num_partitions: power of two
+		:return: partition of every t1 row, partition of every t2 row
+		"""
+		hashes = [np.zeros(len(values[0][0]), dtype=np.uint64), np.zeros(len(values[0][1]), dtype=np.uint64)]
+		for val1, val2 in values:
+			if utils.is_numeric_dtype(val1.dtype):
+				# hash the bits of the values (+ 0 turns -0.0 into 0.0)
+				bits = [np.ascontiguousarray(val + 0).view(np.uint64) for val in (val1, val2)]
 			else:
-				for p in pos:
-					if self.check_remaining_conditions(row1, p):
-						new_row = np.concatenate([row1, t2.rows[p[0]]])
-						new_rows.append(new_row)
-		return new_rows
-
-	def check_remaining_conditions(self, row1, p):
-		i = 1
-		while i < self.criteria.num_conditions:
-			table1, col1, table2, col2 = self.criteria.conditions[i]
-			idx1 = self.t1.col_names[col1]
-			val1 = row1[idx1]
-			idx2 = self.t2.col_names[col2]
-			val2 = self.t2.rows[p[0]][idx2]
-
-			comparator = utils.OPERATORS[self.criteria.comparators[i]]
-			if utils.NUMERIC[comparator]:
-				if not comparator(float(val1), float(val2)):
-					return False
+				codes1, codes2, _ = Join.factorize(val1, val2)
+				bits = [codes1.astype(np.uint64), codes2.astype(np.uint64)]
+			for side in (0, 1):
+				hashes[side] = (hashes[side] ^ bits[side]) * np.uint64(0x9E3779B97F4A7C15)
+		shift = np.uint64(64 - int(np.log2(num_partitions)))
+		return [(h >> shift).astype(np.int64) if num_partitions > 1 else np.zeros(len(h), dtype=np.int64)
+				for h in hashes]
+
+	def partitioned_pairs(self, values):
+		"""equi-join by hash partitioning both tables and joining the partition pairs in
+		parallel workers. The result is identical to `equi_pairs` of the composite keys
+		:param values: list of (t1 values, t2 values) pairs of comparable key columns
+		:return: positions of the matching rows in t1, positions of the matching rows in t2
+		"""
+		num_partitions = 1 << int(np.ceil(np.log2(2 * Parallel.workers)))
+		arrays = {}
+		for side, part in zip((1, 2), self.hash_partitions(values, num_partitions)):
+			# row positions grouped by partition, ascending inside each partition
+			arrays["order%d" % side] = np.argsort(part, kind="stable")
+			arrays["bounds%d" % side] = np.concatenate(([0], np.cumsum(np.bincount(part, minlength=num_partitions))))
+		for k, (val1, val2) in enumerate(values):
+			arrays["key1_%d" % k] = val1
+			arrays["key2_%d" % k] = val2
+		results = Parallel.map(join_partition, arrays, [(p, len(values)) for p in range(num_partitions)])
+		pos1 = np.concatenate([r[0] for r in results])
+		pos2 = np.concatenate([r[1] for r in results])
+		# all pairs of a t1 row come from one partition, ordered by t2 position
+		order = np.argsort(pos1, kind="stable")
+		return pos1[order], pos2[order]
+
+	def hashjoin(self):
+		"""equi-join on every equality condition at once (composite key of the factorized
+		columns), the remaining conditions are checked on the matching pairs.
+		Large joins are hash partitioned and run in parallel (see Parallel.partitioned_join)
+		:return: positions of the matching rows in t1, positions of the matching rows in t2
+		"""
+		with Profiler.operator("keys", rows_in=self.t1.num_rows + self.t2.num_rows):
+			values = []
+			for i in range(len(self.criteria.eq_conditions)):
+				val1, val2, _ = self.get_sides(i)
+				pair = self.comparable(val1, val2)
+				if pair is None:
+					return self.empty()
+				values.append(pair)
+
+		with Profiler.operator(self.algorithm, rows_in=self.t1.num_rows + self.t2.num_rows) as op:
+			if self.algorithm == "partitioned hash":
+				pos1, pos2 = self.partitioned_pairs(values)
 			else:
-				if not comparator(val1,val2):
-					return False
-			i += 1
-		return True
+				pos1, pos2 = self.sorted_pairs(values)
+			op["rows_out"] = len(pos1)
+		if len(self.criteria.eq_conditions) == self.criteria.num_conditions:
+			return pos1, pos2
+		with Profiler.operator("filter", rows_in=len(pos1)) as op:
+			pos1, pos2 = self.check_remaining_conditions(pos1, pos2, len(self.criteria.eq_conditions))
+			op["rows_out"] = len(pos1)
+		return pos1, pos2
 
+	def key_stats(self, i):
+		"""statistics of the t1 and t2 columns compared by equality condition `i`
+		:return: (t1 ColumnStats or None, t2 ColumnStats or None), None for a side with arithmetic
+		"""
+		condition = self.criteria.conditions[i]
+		stats = {}
+		for side in (0, 1):
+			if self.criteria.arithops[i][side] is None:
+				table = self.tables[condition[2 * side]]
+				stats[condition[2 * side]] = table.stats(table.col_names[condition[2 * side + 1]])
+		return stats.get(self.t1_name), stats.get(self.t2_name)
 
+	def sorted_pairs(self, values):
+		"""equi-join in this process on the build side chosen by `choose`. For a merge join the
+		build side's key column is already sorted and is searched without sorting anything,
+		for a hash join the composite keys of the build side are sorted and probed by the keys
+		of the other table
+		:param values: list of (t1 values, t2 values) pairs of comparable key columns
+		:return: positions of the matching rows in t1, positions of the matching rows in t2
+		"""
+		keys1, keys2 = self.composite_keys(values)
+		presorted = self.algorithm == "merge"
+		if self.build_side == self.t2_name:
+			return self.equi_pairs(keys1, keys2, presorted)
+		pos2, pos1 = self.equi_pairs(keys2, keys1, presorted)
+		# pairs come ordered by t2 row, restore the order by t1 row
+		order = np.argsort(pos1, kind="stable")
+		return pos1[order], pos2[order]
 
+	def check_remaining_conditions(self, pos1, pos2, first):
+		"""filter candidate pairs by conditions `first`, `first+1`, ...
+		:return: positions of the matching rows in t1, positions of the matching rows in t2
+		"""
+		for i in range(first, self.criteria.num_conditions):
+			val1, val2, comparator = self.get_sides(i)
+			values = self.comparable(val1, val2)
+			if values is None:
+				if comparator != "!=":
+					return self.empty()
+				continue
+			val1, val2 = values
+			keep = utils.OPERATORS[comparator](val1[pos1], val2[pos2])
+			pos1 = pos1[keep]
+			pos2 = pos2[keep]
+		return pos1, pos2
+
+	@staticmethod
+	def empty():
+		return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+	def broadcastjoin(self):
+		"""nested loop join comparing every pair of rows at once, used for small tables
+		where sorting or hashing costs more than it saves.
+		Text never equals a number and is not ordered against one (no pair matches)
+		:return: positions of the matching rows in t1, positions of the matching rows in t2
+		"""
+		matches = np.ones((self.t1.num_rows, self.t2.num_rows), dtype=bool)
+		for i in range(self.criteria.num_conditions):
+			val1, val2, comparator = self.get_sides(i)
+			values = self.comparable(val1, val2)
+			if values is None:
+				matches &= comparator == "!="
+				continue
+			matches &= utils.OPERATORS[comparator](values[0][:, None], values[1][None, :])
+		pos1, pos2 = np.nonzero(matches)
+		return pos1.astype(np.int64), pos2.astype(np.int64)
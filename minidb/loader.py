@@ -0,0 +1,141 @@
+import warnings
+import numpy as np
+from minidb.utils import Utils as utils
+
+
+class Loader:
+    """bulk loader for vertical bar delimited files.
+    The file is parsed in large chunks straight into typed column buffers,
+    column types are inferred once from a sample of the first rows
+    """
+
+    # column types in widening order
+    INT, FLOAT, STRING = 0, 1, 2
+    DTYPES = {INT: np.int64, FLOAT: np.float64, STRING: object}
+
+    def __init__(self, file, sample_size=1000, chunk_bytes=1 << 24, col_types=None):
+        """
+        :param file: path of the file
+        :param sample_size: number of rows the column types are inferred from
+        :param chunk_bytes: approximate size of the text parsed at once
+        :param col_types: column types to start from (INT, FLOAT or STRING), None to infer them
+        """
+        self.file = file
+        self.sample_size = sample_size
+        self.chunk_bytes = chunk_bytes
+        self.col_names = None
+        self.col_types = None if col_types is None else list(col_types)
+
+    @staticmethod
+    def __loadtxt(lines, dtype):
+        with warnings.catch_warnings():
+            # blank lines are skipped, numpy warns about it
+            warnings.simplefilter("ignore", UserWarning)
+            return np.loadtxt(lines, delimiter="|", dtype=dtype, comments=None, ndmin=1)
+
+    def __infer_types(self, lines):
+        """ infer the type of every column from raw text lines
+        :param lines: list of raw lines
+        :return: list of column types (INT, FLOAT or STRING)
+        """
+        raw = self.__loadtxt(lines, str).reshape(-1, len(self.col_names))
+        types = []
+        for idx in range(len(self.col_names)):
+            kind = utils.infer_column(raw[:, idx]).dtype.kind
+            types.append(self.INT if kind in "iu" else self.FLOAT if kind == "f" else self.STRING)
+        return types
+
+    def __parse_chunk(self, lines):
+        """ parse raw lines into one array per column using the current column types.
+        Columns are widened (int -> float -> string) when the chunk does not fit them
+        :param lines: list of raw lines
+        :return: list of 1-D np arrays
+        """
+        dtype = np.dtype([("f%d" % i, self.DTYPES[t]) for i, t in enumerate(self.col_types)])
+        try:
+            parsed = self.__loadtxt(lines, dtype)
+        except ValueError:
+            chunk_types = self.__infer_types(lines)
+            self.col_types = [max(a, b) for a, b in zip(self.col_types, chunk_types)]
+            return self.__parse_chunk(lines)
+        return [parsed["f%d" % i] for i in range(len(self.col_types))]
+
+    def __finish_column(self, parts, col_type):
+        """ concatenate the chunks of one column and convert them to the final column type
+        :param parts: list of per-chunk arrays
+        :param col_type: final type of the column
+        :return: typed 1-D np array
+        """
+        if col_type == self.STRING:
+            parts = [np.char.strip(p.astype(str)) for p in parts]
+            return np.concatenate(parts) if len(parts) > 0 else np.empty(0, dtype=str)
+        dtype = self.DTYPES[col_type]
+        if len(parts) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.concatenate([p.astype(dtype, copy=False) for p in parts])
+
+    def __read_chunks(self):
+        """ parse the file chunk by chunk. Column types are inferred from a sample of the
+        first rows (unless they were given) and widened when a chunk does not fit them
+        :return: generator of lists of arrays, one list per chunk, parsed with the
+            column types at the time (self.col_types)
+        """
+        with open(self.file, "r") as f:
+            header = f.readline()
+            if header == "":
+                return
+            self.col_names = [s.strip() for s in header.split("|")]
+
+            sample = []
+            while len(sample) < self.sample_size:
+                line = f.readline()
+                if line == "":
+                    break
+                sample.append(line)
+            if self.col_types is None:
+                self.col_types = self.__infer_types(sample) if len(sample) > 0 else [self.STRING] * len(self.col_names)
+            if len(sample) > 0:
+                yield self.__parse_chunk(sample)
+
+            while True:
+                lines = f.readlines(self.chunk_bytes)
+                if len(lines) == 0:
+                    break
+                yield self.__parse_chunk(lines)
+
+    def chunks(self):
+        """ read the file one chunk (about chunk_bytes of text) at a time.
+        Chunks are converted to the column types known when they are read: if a later chunk
+        widens a type, self.col_types changes and earlier chunks have the narrower type
+        :return: generator of lists of typed column arrays, one list per chunk
+        """
+        for parsed in self.__read_chunks():
+            yield [self.__finish_column([col], col_type) for col, col_type in zip(parsed, self.col_types)]
+
+    def load(self):
+        """ read the whole file
+        :return: list of column names, list of typed column arrays (None, None for an empty file)
+        """
+        chunks = []
+        # column types each chunk was parsed with
+        chunk_types = []
+        for parsed in self.__read_chunks():
+            chunks.append(parsed)
+            chunk_types.append(list(self.col_types))
+        if self.col_names is None:
+            return None, None
+        if any(final == self.STRING and col_type != final
+               for types in chunk_types for col_type, final in zip(types, self.col_types)):
+            # a column became text after chunks were parsed as numbers, which lost their
+            # text ("007" -> 7): the parsed chunks are freed and the file is read again with
+            # the final types
+            del chunks
+            return Loader(self.file, self.sample_size, self.chunk_bytes, self.col_types).load()
+
+        columns = []
+        for idx, col_type in enumerate(self.col_types):
+            parts = [chunk[idx] for chunk in chunks]
+            columns.append(self.__finish_column(parts, col_type))
+            for chunk in chunks:
+                chunk[idx] = None   # release the chunk buffers as soon as possible
+        return self.col_names, columns
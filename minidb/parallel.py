@@ -0,0 +1,226 @@
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from minidb.groupby import GroupBy
+from minidb.predicate import Rows, column_idxs
+
+
+class Partition:
+    """the rows [start, stop) of a table as seen by a worker.
+    Columns are sliced (not copied) when read
+    """
+
+    def __init__(self, columns, start, stop):
+        """
+        :param columns: column position -> whole 1-D np array
+        :param start: first row of the partition
+        :param stop: end of the partition (exclusive)
+        """
+        self.columns = columns
+        self.start = start
+        self.stop = stop
+        self.num_rows = stop - start
+
+    def get_column(self, idx):
+        return self.columns[idx][self.start:self.stop]
+
+
+def scan(columns, start, stop, predicate):
+    """ evaluate a bound predicate on the rows [start, stop)
+    :return: sorted row positions (in the whole table) of the selected rows
+    """
+    partition = Partition(columns, start, stop)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        selection = predicate.evaluate(Rows(partition))
+    rowids = np.flatnonzero(selection) if selection.dtype == bool else selection
+    return rowids + partition.start
+
+
+def partial_aggregate(columns, start, stop, key_idxs, aggregates):
+    """ aggregate the rows [start, stop). avg is split into a sum and a count so that
+    partial results can be merged
+    :param key_idxs: positions of the group by columns
+    :param aggregates: list of (function, column position) pairs
+    :return: group keys, list of partial results (one per aggregate)
+    """
+    partition = Partition(columns, start, stop)
+    groups = GroupBy([partition.get_column(idx) for idx in key_idxs], partition.num_rows)
+    partials = []
+    for function, idx in aggregates:
+        values = None if function == "count" else partition.get_column(idx)
+        if function == "avg":
+            partials.append((groups.aggregate("sum", values.astype(np.float64)), groups.aggregate("count")))
+        else:
+            partials.append(groups.aggregate(function, values))
+    return groups.keys, partials
+
+
+def run_shared(task, specs, *args):
+    """ entry point of process workers: attach the shared arrays and run task(arrays, *args)
+    :param specs: key -> (shared memory name, dtype, length)
+    """
+    blocks = []
+    arrays = {}
+    try:
+        for key, (name, dtype, length) in specs.items():
+            block = shared_memory.SharedMemory(name=name)
+            blocks.append(block)
+            arrays[key] = np.ndarray((length,), dtype=dtype, buffer=block.buf)
+        return task(arrays, *args)
+    finally:
+        # views on the blocks have to be gone before they can be closed
+        arrays.clear()
+        for block in blocks:
+            block.close()
+
+
+def merge_partials(results, num_keys, aggregates):
+    """ merge the partial aggregates of several row ranges (see partial_aggregate).
+    The result is again a partial aggregate, so it can be merged with more ranges
+    :param results: list of (group keys, partials) pairs
+    :param num_keys: number of group by columns
+    :param aggregates: list of (function, column position) pairs
+    :return: group keys, list of partial results (one per aggregate)
+    """
+    keys = [np.concatenate([result[0][k] for result in results]) for k in range(num_keys)]
+    first = [result[1][0] for result in results]
+    num_groups = sum(len(p[0]) if isinstance(p, tuple) else len(p) for p in first)
+    groups = GroupBy(keys, num_groups)
+    merged = []
+    for i, (function, idx) in enumerate(aggregates):
+        if function == "avg":
+            sums = groups.aggregate("sum", np.concatenate([result[1][i][0] for result in results]))
+            counts = groups.aggregate("sum", np.concatenate([result[1][i][1] for result in results]))
+            merged.append((sums, counts))
+        else:
+            partials = np.concatenate([result[1][i] for result in results])
+            merged.append(groups.aggregate("sum" if function == "count" else function, partials))
+    return groups.keys, merged
+
+
+def finish_partials(partials, aggregates):
+    """ :return: list of aggregate columns from merged partial results (averages are divided out)
+    """
+    return [np.round(p[0] / p[1], 4) if function == "avg" else p for p, (function, _) in zip(partials, aggregates)]
+
+
+class SharedColumns:
+    """shared memory copies of column arrays for process workers.
+    Columns are never modified in place, so every array is copied once and the
+    copy is released together with the array
+    """
+
+    blocks = {}
+
+    @classmethod
+    def share(cls, array):
+        """ :return: (shared memory name, dtype, length) of the copy of `array`
+        """
+        key = id(array)
+        if key not in cls.blocks:
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            cls.blocks[key] = (block, (block.name, array.dtype.str, len(array)))
+            weakref.finalize(array, cls.release, key)
+        return cls.blocks[key][1]
+
+    @classmethod
+    def release(cls, key):
+        block, _ = cls.blocks.pop(key)
+        block.close()
+        block.unlink()
+
+
+class Parallel:
+    """runs scans and partial aggregates over row partitions of a table on a pool
+    of threads (NumPy releases the GIL in its kernels) or processes (columns are
+    passed through shared memory), then merges the partial results.
+    The configuration applies to the whole process
+    """
+
+    workers = 1
+    pool = "thread"
+    # smaller tables are not worth splitting
+    min_rows = 1 << 17
+    # equi-join algorithm: auto (partitioned above min_rows when workers > 1), hash or partitioned
+    join = "auto"
+    executor = None
+
+    @classmethod
+    def configure(cls, workers=None, pool=None, min_rows=None, join=None):
+        """ change the number of workers, the pool type (thread or process), the size
+        threshold or the equi-join algorithm
+        :return: None
+        """
+        if cls.executor is not None:
+            cls.executor.shutdown()
+            cls.executor = None
+        cls.workers = cls.workers if workers is None else workers
+        cls.pool = cls.pool if pool is None else pool
+        cls.min_rows = cls.min_rows if min_rows is None else min_rows
+        cls.join = cls.join if join is None else join
+
+    @classmethod
+    def enabled(cls, num_rows):
+        return cls.workers > 1 and num_rows >= max(cls.min_rows, 1)
+
+    @classmethod
+    def partitioned_join(cls, num_rows):
+        """ :return: True if an equi-join over `num_rows` input rows should be partitioned
+        """
+        if cls.join == "auto":
+            return cls.enabled(num_rows)
+        return cls.join == "partitioned"
+
+    @classmethod
+    def __executor(cls):
+        if cls.executor is None:
+            pool = ThreadPoolExecutor if cls.pool == "thread" else ProcessPoolExecutor
+            cls.executor = pool(max_workers=cls.workers)
+        return cls.executor
+
+    @classmethod
+    def map(cls, task, arrays, tasks):
+        """ run task(arrays, *args) for every args in `tasks` on the pool.
+        Process workers get `arrays` through shared memory
+        :param arrays: dict of 1-D np arrays read by the task
+        :param tasks: list of argument tuples, one per task
+        :return: list of results, in the order of `tasks`
+        """
+        executor = cls.__executor()
+        if cls.pool == "thread":
+            futures = [executor.submit(task, arrays, *args) for args in tasks]
+        else:
+            specs = {key: SharedColumns.share(array) for key, array in arrays.items()}
+            futures = [executor.submit(run_shared, task, specs, *args) for args in tasks]
+        return [future.result() for future in futures]
+
+    @classmethod
+    def run(cls, task, table, col_idxs, *args):
+        """ run task(columns, start, stop, *args) on `workers` row partitions of `table`
+        :param col_idxs: positions of the columns the task reads
+        :return: list of results, in row order
+        """
+        bounds = np.linspace(0, table.num_rows, min(cls.workers, table.num_rows) + 1).astype(np.int64)
+        columns = {idx: table.get_column(idx) for idx in col_idxs}
+        return cls.map(task, columns, [(int(a), int(b)) + args for a, b in zip(bounds[:-1], bounds[1:])])
+
+    @classmethod
+    def select(cls, table, predicate):
+        """ evaluate a bound predicate on every partition of `table`
+        :return: sorted row positions of the selected rows
+        """
+        return np.concatenate(cls.run(scan, table, column_idxs(predicate), predicate))
+
+    @classmethod
+    def aggregate(cls, table, key_idxs, aggregates):
+        """ group and aggregate every partition, then merge the partial groups
+        :param key_idxs: positions of the group by columns (empty for one global group)
+        :param aggregates: list of (function, column position) pairs
+        :return: list of aggregate columns, list of key columns
+        """
+        col_idxs = set(key_idxs) | {idx for function, idx in aggregates if function != "count"}
+        results = cls.run(partial_aggregate, table, col_idxs, key_idxs, aggregates)
+        keys, partials = merge_partials(results, len(key_idxs), aggregates)
+        return finish_partials(partials, aggregates), keys
@@ -0,0 +1,227 @@
+import numpy as np
+from minidb.explain import Profiler
+from minidb.extsort import ExternalSort
+from minidb.join import Join
+from minidb.predicate import Rows
+from minidb.table import Table
+
+
+class View:
+    """rows of a base table that have not been copied yet: optional row positions
+    into the base table and the (base) indexes of the visible columns.
+    Columns are only gathered when a result is materialized
+    """
+
+    def __init__(self, table, positions=None, columns=None):
+        """
+        :param table: base Table
+        :param positions: row positions into `table`, None for all rows in order
+        :param columns: names of the visible columns, None for all columns
+        """
+        self.table = table
+        self.name = table.name
+        self.positions = positions
+        names = list(table.col_names) if columns is None else columns
+        self.col_names = {name: table.col_names[name] for name in names}
+
+    @property
+    def num_rows(self):
+        return self.table.num_rows if self.positions is None else len(self.positions)
+
+    def is_col_numeric(self, idx):
+        return self.table.is_col_numeric(idx)
+
+    def column(self, name):
+        col = self.table.get_column(self.col_names[name])
+        return col if self.positions is None else col[self.positions]
+
+    def rows(self):
+        """ rows for evaluating a predicate, indexes can only be used on the whole base table
+        """
+        return Rows(self.table, self.positions, self.table.index_lookup if self.positions is None else None,
+                    self.table.selectivity)
+
+    def materialize(self, name, columns=None):
+        """ table of the visible columns (or only `columns`). Columns are gathered when
+        they are read, nothing is copied when the view covers all rows of the base table in order
+        :return: Table
+        """
+        columns = list(self.col_names) if columns is None else columns
+        table = self.table.take(name, self.positions, columns)
+        if self.positions is None and [self.col_names[col] for col in columns] == list(range(self.table.num_columns)):
+            table.indexes = {col: index.snapshot(table) for col, index in self.table.indexes.items()}
+        return table
+
+
+class Node:
+    """one deferred statement `name := op(inputs, ...)` of a lazy script
+    """
+
+    def __init__(self, name, op, inputs, columns, criteria):
+        """
+        :param name: name the result is assigned to
+        :param op: command (select, project, sort, ...)
+        :param inputs: list of input Nodes or Tables, resolved when the statement is recorded
+        :param columns: parsed column arguments of the command
+        :param criteria: parsed criteria (or extra argument) of the command
+        """
+        self.name = name
+        self.op = op
+        self.inputs = inputs
+        self.columns = columns
+        self.criteria = criteria
+        self.consumers = 0
+        self.view = None   # result, kept once evaluated
+        for node in inputs:
+            if isinstance(node, Node):
+                node.consumers += 1
+
+
+class Plan:
+    """evaluates a DAG of deferred statements.
+    select, project and sort are fused: they only narrow or reorder the row positions
+    and columns of a view, so a chain of them runs without intermediate tables.
+    Aggregates gather just the columns they read from the view, every other operator
+    materializes its inputs and runs as usual
+    """
+
+    FUSED = ("select", "project", "sort")
+    AGGREGATES = ("avg", "sum", "count", "aggregate", "sumgroup", "avggroup", "countgroup")
+    OPERATORS = FUSED + AGGREGATES + ("movavg", "movsum", "concat", "join")
+
+    def evaluate(self, node):
+        """ evaluate `node` and its inputs (results of nodes read more than once are kept)
+        :return: View of the result
+        """
+        if isinstance(node, Table):
+            return View(node)
+        if node.view is not None:
+            return node.view
+        with Profiler.operator(node.op, node.name, describe=lambda: {"fused": node.op in self.FUSED}) as op:
+            view = self.__evaluate(node, op)
+            op["rows_out"] = None if view is None else view.num_rows
+        if view is None:
+            return None
+        if node.consumers > 1:
+            node.view = view
+        return view
+
+    def force(self, node):
+        """ evaluate `node` and materialize its result
+        :return: Table or None if the statement failed
+        """
+        view = self.evaluate(node)
+        if view is None:
+            return None
+        table = view.materialize(node.name)
+        node.view = View(table)
+        node.inputs = []
+        return table
+
+    def __input(self, node, i, name=None):
+        """ materialized input `i` of `node`
+        """
+        view = self.evaluate(node.inputs[i])
+        return None if view is None else view.materialize(name or view.name)
+
+    def __evaluate(self, node, record):
+        """ :param record: operator dict of the profiler, takes the number of input rows
+        """
+        op = node.op
+        if op in self.FUSED:
+            view = self.evaluate(node.inputs[0])
+            if view is None:
+                return None
+            record["rows_in"] = view.num_rows
+            if op == "select":
+                return self.__select(view, node.criteria)
+            if op == "project":
+                return self.__project(view, [s.strip() for s in node.columns])
+            return self.__sort(view, node.columns)
+
+        if op == "count":
+            view = self.evaluate(node.inputs[0])
+            if view is None:
+                return None
+            record["rows_in"] = view.num_rows
+            result = Table(node.name, ["count"])
+            result.set_columns([np.array([view.num_rows], dtype=np.int64)])
+        elif op in self.AGGREGATES:
+            view = self.evaluate(node.inputs[0])
+            columns = None if view is None else self.__aggregate_columns(node, view)
+            if columns is None:
+                return None
+            record["rows_in"] = view.num_rows
+            table = view.materialize(view.name, columns)
+            if op in ("avg", "sum"):
+                result = getattr(table, op)(node.name, node.columns[0])
+            elif op == "aggregate":
+                result = table.aggregate(node.name, node.columns, node.criteria)
+            else:
+                result = getattr(table, op)(node.name, node.columns[0], node.columns[1:])
+        elif op in ("movavg", "movsum"):
+            table = self.__input(node, 0)
+            record["rows_in"] = None if table is None else table.num_rows
+            result = None if table is None else getattr(table, op)(node.name, node.columns, int(node.criteria))
+        elif op == "concat":
+            t1, t2 = self.__input(node, 0), self.__input(node, 1)
+            result = None if t1 is None or t2 is None else t1.concat(node.name, t2)
+            record["rows_in"] = None if result is None else t1.num_rows + t2.num_rows
+        else:  # join, the criteria refers to the inputs by their names
+            names = [t.name for t in node.inputs]
+            t1, t2 = self.__input(node, 0, names[0]), self.__input(node, 1, names[1])
+            result = None if t1 is None or t2 is None else Join(t1, t2, node.criteria).result(node.name)
+            record["rows_in"] = None if result is None else t1.num_rows + t2.num_rows
+        return None if result is None else View(result)
+
+    @staticmethod
+    def __aggregate_columns(node, view):
+        """ columns of `view` read by an aggregate node, None if one is missing
+        """
+        if node.op == "aggregate":
+            columns = [c for f, c in node.columns if f != "count"] + node.criteria
+        elif node.op in ("avg", "sum"):
+            columns = node.columns[:1]
+        else:
+            columns = node.columns[1:] + ([] if node.op == "countgroup" else node.columns[:1])
+        columns = list(dict.fromkeys(columns))
+        for col in columns:
+            if col not in view.col_names:
+                print("Invalid command. Column %s not present in table" % col)
+                return None
+        return columns
+
+    @staticmethod
+    def __select(view, criteria):
+        try:
+            predicate = criteria.predicate.bind(view)
+            with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+                selection = predicate.evaluate(view.rows())
+        except ValueError as e:
+            print(e)
+            return None
+        rowids = np.flatnonzero(selection) if selection.dtype == bool else selection
+        positions = rowids if view.positions is None else view.positions[rowids]
+        return View(view.table, positions, list(view.col_names))
+
+    @staticmethod
+    def __project(view, columns):
+        for col in columns:
+            if col not in view.col_names:
+                print("Invalid command. Column not present in table")
+                return None
+        return View(view.table, view.positions, columns)
+
+    @staticmethod
+    def __sort(view, columns):
+        for col in columns:
+            if col not in view.col_names:
+                print("Invalid command. Column not present in table")
+                return None
+        dtypes = [view.table.col_dtypes[idx] for idx in view.col_names.values()]
+        if ExternalSort.enabled(view.num_rows, dtypes):
+            # the visible rows are sorted into a table of their own within the memory budget
+            return View(view.materialize(view.name).sort(view.name, columns))
+        order = np.lexsort([view.column(col) for col in reversed(columns)])
+        positions = order if view.positions is None else view.positions[order]
+        return View(view.table, positions, list(view.col_names))
@@ -0,0 +1,524 @@
+import re
+import numpy as np
+from minidb.utils import Utils as utils
+
+
+class Predicate:
+    """parser for select criteria.
+    Turns the criteria text into an AST with the usual precedence
+    (or < and < comparison < + - < * / < unary - < ^), nested parentheses and
+    arithmetic on both sides of a comparison:
+
+        or_expr    := and_expr ("or" and_expr)*
+        and_expr   := condition ("and" condition)*
+        condition  := "(" or_expr ")" | arith comparator arith
+        arith      := term (("+" | "-") term)*
+        term       := unary (("*" | "/") unary)*
+        unary      := "-" unary | power
+        power      := primary ("^" unary)?
+        primary    := number | 'text' | name | "(" arith ")"
+
+    Whitespace is removed from commands before they reach the parser, so `and`/`or`
+    are also recognized when glued to the following name (qty=5orqty=7).
+    Text constants directly followed by and/or must be quoted or parenthesized, criteria
+    where a name reads as a constant glued to and/or and a column are rejected
+    """
+
+    TOKEN = re.compile(r"(?P<number>\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+)|(?P<text>'[^']*'|\"[^\"]*\")"
+                       r"|(?P<name>[A-Za-z_][A-Za-z0-9_]*)|(?P<op>!=|<=|>=|[≤≥=<>()*/+\-^])")
+    COMPARATORS = ("=", "!=", "<", ">", "≤", "≥")
+    ALIASES = {"<=": "≤", ">=": "≥"}
+
+    def __init__(self, text):
+        """
+        :param text: criteria text, e.g. (qty*2>R) and (pricerange=cheap or itemid=7)
+        :raise ValueError: if the criteria cannot be parsed
+        """
+        self.text = text
+        self.tokens = self.tokenize(text)
+        self.pos = 0
+        self.root = self.__or_expr()
+        if self.pos != len(self.tokens):
+            previous = self.tokens[self.pos - 1] if self.pos > 0 else (None, None)
+            if previous[0] == "name" and ("or" in previous[1][1:] or "and" in previous[1][1:]):
+                raise ValueError("Invalid criteria %s: unexpected %s after %s, quote text constants followed by "
+                                 "and/or or put the conditions in parentheses" % (text, self.tokens[self.pos][1],
+                                                                                 previous[1]))
+            raise ValueError("Invalid criteria %s: unexpected %s" % (text, self.tokens[self.pos][1]))
+
+    @classmethod
+    def tokenize(cls, text):
+        """ split the criteria text into (kind, text) tokens
+        :return: list of tokens, kind is one of number, text, name, op, logic
+        """
+        tokens = []
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            if text[pos].isspace():
+                pos += 1
+                continue
+            match = cls.TOKEN.match(text, pos)
+            if match is None:
+                raise ValueError("Invalid criteria %s: unexpected %s" % (text, text[pos]))
+            kind, value = match.lastgroup, match.group()
+            pos = match.end()
+            # after an operand only an operator can follow: split "orqty" into "or", "qty"
+            after_operand = len(tokens) > 0 and (tokens[-1][0] in ("number", "text", "name")
+                                                 or tokens[-1][1] == ")")
+            if kind == "name" and after_operand:
+                for keyword in ("and", "or"):
+                    if value.startswith(keyword):
+                        tokens.append(("logic", keyword))
+                        value = value[len(keyword):]
+                        break
+                if value == "":
+                    continue
+            elif kind == "name" and value in ("and", "or"):
+                kind = "logic"
+            if kind == "op":
+                value = cls.ALIASES.get(value, value)
+            tokens.append((kind, value))
+        return tokens
+
+    def __peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def __next(self):
+        token = self.__peek()
+        if token[0] is None:
+            raise ValueError("Invalid criteria %s: unexpected end" % self.text)
+        self.pos += 1
+        return token
+
+    def __expect(self, value):
+        token = self.__next()
+        if token[1] != value:
+            raise ValueError("Invalid criteria %s: expected %s, got %s" % (self.text, value, token[1]))
+
+    def __or_expr(self):
+        children = [self.__and_expr()]
+        while self.__peek() == ("logic", "or"):
+            self.pos += 1
+            children.append(self.__and_expr())
+        return children[0] if len(children) == 1 else Logic("or", children)
+
+    def __and_expr(self):
+        children = [self.__condition()]
+        while self.__peek() == ("logic", "and"):
+            self.pos += 1
+            children.append(self.__condition())
+        return children[0] if len(children) == 1 else Logic("and", children)
+
+    def __condition(self):
+        if self.__peek()[1] == "(":
+            # either a parenthesized condition or the start of an arithmetic operand
+            start = self.pos
+            try:
+                self.pos += 1
+                node = self.__or_expr()
+                self.__expect(")")
+                if self.__peek()[1] not in self.COMPARATORS + ("+", "-", "*", "/", "^"):
+                    return node
+            except ValueError:
+                pass
+            self.pos = start
+        left = self.__arith()
+        kind, comparator = self.__next()
+        if comparator not in self.COMPARATORS:
+            raise ValueError("Invalid criteria %s: expected a comparator, got %s" % (self.text, comparator))
+        return Compare(comparator, left, self.__arith())
+
+    def __arith(self):
+        node = self.__term()
+        while self.__peek()[1] in ("+", "-"):
+            node = Arith(self.__next()[1], node, self.__term())
+        return node
+
+    def __term(self):
+        node = self.__unary()
+        while self.__peek()[1] in ("*", "/"):
+            node = Arith(self.__next()[1], node, self.__unary())
+        return node
+
+    def __unary(self):
+        if self.__peek()[1] == "-":
+            self.pos += 1
+            return Arith("-", Constant(0.0), self.__unary())
+        return self.__power()
+
+    def __power(self):
+        node = self.__primary()
+        if self.__peek()[1] == "^":
+            self.pos += 1
+            node = Arith("^", node, self.__unary())
+        return node
+
+    def __primary(self):
+        kind, value = self.__next()
+        if kind == "number":
+            return Constant(float(value), value)
+        if kind == "text":
+            return Constant(value[1:-1])
+        if kind == "name":
+            return Name(value)
+        if value == "(":
+            node = self.__arith()
+            self.__expect(")")
+            return node
+        raise ValueError("Invalid criteria %s: unexpected %s" % (self.text, value))
+
+    def bind(self, table):
+        """ resolve names against the columns of `table` and fold constant sub-expressions
+        :param table: Table the criteria is evaluated on
+        :return: root node of the bound AST
+        :raise ValueError: if a column is missing or an expression mixes text and numbers
+        """
+        return self.root.bind(table)
+
+
+class Rows:
+    """the rows a predicate is evaluated on: every row of a table, or a subset of its
+    row positions. Columns of a subset are gathered once and cached
+    """
+
+    def __init__(self, table, positions=None, index_lookup=None, selectivity=None):
+        """
+        :param table: Table being filtered
+        :param positions: sorted row positions of the subset, None for all rows
+        :param index_lookup: function(column, comparator, value) answering a condition
+            from an index (sorted row positions or None), only used on all rows
+        :param selectivity: function(column, comparator, value) estimating the fraction of
+            rows satisfying a condition, used to order the conditions of a conjunction
+        """
+        self.table = table
+        self.positions = positions
+        self.index_lookup = index_lookup if positions is None else None
+        self.selectivity = selectivity
+        self.cache = {}
+
+    def __len__(self):
+        return self.table.num_rows if self.positions is None else len(self.positions)
+
+    def column(self, idx):
+        if self.positions is None:
+            return self.table.get_column(idx)
+        if idx not in self.cache:
+            self.cache[idx] = self.table.get_column(idx)[self.positions]
+        return self.cache[idx]
+
+    def subset(self, ids):
+        """ rows ids (relative to these rows)
+        """
+        return Rows(self.table, ids if self.positions is None else self.positions[ids], selectivity=self.selectivity)
+
+
+# A selection is either a boolean mask over the evaluated rows or a sorted array of
+# positions relative to them. Index lookups and selective conjunctions produce positions
+
+def as_mask(selection, num_rows):
+    if selection.dtype == bool:
+        return selection
+    mask = np.zeros(num_rows, dtype=bool)
+    mask[selection] = True
+    return mask
+
+
+def combine(logic_operator, a, b):
+    """ combine two selections. Masks are fresh temporaries and are combined in place
+    :return: combined selection
+    """
+    a_ids = a.dtype != bool
+    b_ids = b.dtype != bool
+    if logic_operator == "and":
+        if a_ids and b_ids:
+            return np.intersect1d(a, b, assume_unique=True)
+        if a_ids:
+            return a[b[a]]
+        if b_ids:
+            return b[a[b]]
+        a &= b
+        return a
+    if a_ids and b_ids:
+        return np.union1d(a, b)
+    if a_ids or b_ids:
+        ids, mask = (a, b) if a_ids else (b, a)
+        mask[ids] = True
+        return mask
+    a |= b
+    return a
+
+
+class Name:
+    """unresolved name: a column of the table, otherwise a bare text constant"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def bind(self, table):
+        """ :raise ValueError: if the name is not a column but reads as a text constant glued to
+            and/or and a column (cheaporitemid), the conditions would silently not match
+        """
+        if self.name in table.col_names:
+            return Column(self.name, table.col_names[self.name], table.is_col_numeric(table.col_names[self.name]))
+        for keyword in ("or", "and"):
+            pos = self.name.find(keyword, 1)
+            while pos != -1:
+                rest = self.name[pos + len(keyword):]
+                if any(rest.startswith(col) for col in table.col_names):
+                    raise ValueError("Invalid criteria: %s is not a column of %s, quote a text constant followed by "
+                                     "%s ('%s') or put the conditions in parentheses"
+                                     % (self.name, table.name, keyword, self.name[:pos]))
+                pos = self.name.find(keyword, pos + 1)
+        return Constant(self.name, unresolved=True)
+
+
+class Column:
+
+    def __init__(self, name, idx, numeric):
+        self.name = name
+        self.idx = idx
+        self.numeric = numeric
+
+    def values(self, rows):
+        """ :return: values, True if the returned array is a temporary that may be overwritten
+        """
+        return rows.column(self.idx), False
+
+    def __str__(self):
+        return self.name
+
+
+class Constant:
+
+    def __init__(self, value, text=None, unresolved=False):
+        """
+        :param value: float, or str for text constants
+        :param text: source text of a numeric constant (used against text columns)
+        :param unresolved: True for a bare name that is not a column of the table
+        """
+        self.value = value
+        self.text = text if text is not None else str(value)
+        self.numeric = not isinstance(value, str)
+        self.unresolved = unresolved
+
+    def bind(self, table):
+        return self
+
+    def values(self, rows):
+        return self.value, False
+
+    def __str__(self):
+        return self.text
+
+
+class Arith:
+    """arithmetic over numeric operands, computed in float64"""
+
+    UFUNCS = {"+": np.add, "-": np.subtract, "*": np.multiply, "/": np.true_divide, "^": np.power}
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.numeric = True
+
+    def bind(self, table):
+        left, right = self.left.bind(table), self.right.bind(table)
+        for side in (left, right):
+            if getattr(side, "unresolved", False):
+                raise ValueError("column %s is not present in table %s" % (side.value, table.name))
+            if not side.numeric:
+                raise ValueError("Invalid criteria: arithmetic on text %s" % side.text if isinstance(side, Constant)
+                                 else "Invalid criteria: arithmetic on text column %s" % side.name)
+        if isinstance(left, Constant) and isinstance(right, Constant):
+            with np.errstate(all="ignore"):
+                return Constant(float(self.UFUNCS[self.op](np.float64(left.value), np.float64(right.value))))
+        return Arith(self.op, left, right)
+
+    def values(self, rows):
+        left, left_tmp = self.left.values(rows)
+        right, right_tmp = self.right.values(rows)
+        # write into a temporary operand instead of allocating a new array
+        out = left if left_tmp else right if right_tmp else None
+        return self.UFUNCS[self.op](left, right, out=out, dtype=np.float64), True
+
+    def __str__(self):
+        return "(%s%s%s)" % (self.left, self.op, self.right)
+
+
+class Compare:
+
+    def __init__(self, comparator, left, right):
+        self.comparator = comparator
+        self.left = left
+        self.right = right
+
+    def bind(self, table):
+        left, right = self.left.bind(table), self.right.bind(table)
+        if isinstance(left, Constant) and isinstance(right, Constant):
+            for side in (left, right):
+                if side.unresolved:
+                    raise ValueError("column %s is not present in table %s" % (side.value, table.name))
+            return BoolConstant(self.evaluate_values(self.comparator, left, right, left.value, right.value))
+        # keep the column on the left so that the condition can be answered by an index
+        if isinstance(right, Column) and isinstance(left, Constant):
+            return Compare(utils.REVERSE_COMPARATOR[self.comparator], right, left)
+        return Compare(self.comparator, left, right)
+
+    @staticmethod
+    def evaluate_values(comparator, left, right, left_values, right_values):
+        """ compare two operands. Text is compared with text and numbers with numbers,
+        text columns are compared with the source text of numeric constants
+        """
+        if left.numeric != right.numeric:
+            if isinstance(right, Constant) and right.text is not None and not left.numeric:
+                right_values = right.text
+            elif isinstance(left, Constant) and left.text is not None and not right.numeric:
+                left_values = left.text
+            elif comparator in ("=", "!="):
+                # a number never equals a text value
+                return np.full(np.broadcast(left_values, right_values).shape, comparator == "!=")
+            else:
+                raise ValueError("Invalid criteria: cannot compare text and numbers with %s" % comparator)
+        return utils.OPERATORS[comparator](left_values, right_values)
+
+    def constant(self):
+        """ :return: the value compared with the column when the condition compares a column
+            with a constant of the same type (the form answered by indexes), otherwise None
+        """
+        if not isinstance(self.left, Column) or not isinstance(self.right, Constant):
+            return None
+        if self.left.numeric and not self.right.numeric:
+            return None
+        return self.right.value if self.left.numeric else self.right.text
+
+    def lookup(self, rows):
+        """ answer the condition from an index when it compares a column with a constant
+        :return: sorted row positions or None
+        """
+        value = None if rows.index_lookup is None else self.constant()
+        if value is None:
+            return None
+        return rows.index_lookup(self.left.name, self.comparator, value)
+
+    def selectivity(self, rows):
+        """ :return: estimated fraction of rows satisfying the condition, 1 if unknown
+        """
+        value = None if rows.selectivity is None else self.constant()
+        if value is None:
+            return 1.0
+        return rows.selectivity(self.left.name, self.comparator, value)
+
+    def evaluate(self, rows):
+        selection = self.lookup(rows)
+        if selection is not None:
+            return selection
+        left, _ = self.left.values(rows)
+        right, _ = self.right.values(rows)
+        result = self.evaluate_values(self.comparator, self.left, self.right, left, right)
+        if np.ndim(result) == 0:
+            return np.full(len(rows), bool(result))
+        return result
+
+    def __str__(self):
+        return "%s%s%s" % (self.left, self.comparator, self.right)
+
+
+class BoolConstant:
+    """condition without columns, folded at bind time"""
+
+    def __init__(self, value):
+        self.value = bool(value)
+
+    def evaluate(self, rows):
+        return np.full(len(rows), self.value)
+
+    def __str__(self):
+        return str(self.value)
+
+
+class Logic:
+
+    # a conjunction switches to row positions once fewer than 1/SPARSE of the rows are left
+    SPARSE = 8
+
+    def __init__(self, op, children):
+        self.op = op
+        self.children = children
+
+    def bind(self, table):
+        return Logic(self.op, [child.bind(table) for child in self.children])
+
+    def __str__(self):
+        return self.op.join("(%s)" % child for child in self.children)
+
+    def evaluate(self, rows):
+        if self.op == "or":
+            selection = self.children[0].evaluate(rows)
+            for child in self.children[1:]:
+                selection = combine("or", selection, child.evaluate(rows))
+            return selection
+
+        # conditions answered by an index go first, every other condition is only
+        # evaluated on the rows that are still selected, the most selective ones first
+        selection = None
+        pending = []
+        for child in self.children:
+            ids = child.lookup(rows) if isinstance(child, Compare) else None
+            if ids is None:
+                pending.append(child)
+            else:
+                selection = ids if selection is None else combine("and", selection, ids)
+        if rows.selectivity is not None and len(pending) > 1:
+            pending.sort(key=lambda child: child.selectivity(rows) if isinstance(child, Compare) else 1.0)
+        for child in pending:
+            if selection is None:
+                selection = child.evaluate(rows)
+            elif selection.dtype == bool:
+                selection = combine("and", selection, child.evaluate(rows))
+            else:
+                if len(selection) == 0:
+                    break
+                selection = selection[as_mask(child.evaluate(rows.subset(selection)), len(selection))]
+            if selection.dtype == bool and np.count_nonzero(selection) * self.SPARSE < len(selection):
+                selection = np.flatnonzero(selection)
+        return selection
+
+
+def conditions(node):
+    """ comparisons of a bound predicate, in the order they appear
+    :return: list of Compare nodes
+    """
+    if isinstance(node, Logic):
+        return [condition for child in node.children for condition in conditions(child)]
+    return [node] if isinstance(node, Compare) else []
+
+
+def estimate(node, rows):
+    """ estimated fraction of the rows satisfying a bound predicate, conditions are assumed
+    to be independent
+    :param rows: Rows with a selectivity function
+    :return: float between 0 and 1
+    """
+    if isinstance(node, BoolConstant):
+        return float(node.value)
+    if isinstance(node, Compare):
+        return node.selectivity(rows)
+    fractions = [estimate(child, rows) for child in node.children]
+    if node.op == "and":
+        return float(np.prod(fractions))
+    return 1.0 - float(np.prod([1.0 - fraction for fraction in fractions]))
+
+
+def column_idxs(node):
+    """ positions of the columns a bound predicate reads
+    :return: set of column positions
+    """
+    if isinstance(node, Column):
+        return {node.idx}
+    if isinstance(node, Logic):
+        return set().union(*[column_idxs(child) for child in node.children])
+    if isinstance(node, (Arith, Compare)):
+        return column_idxs(node.left) | column_idxs(node.right)
+    return set()
@@ -0,0 +1,144 @@
+import numpy as np
+
+
+class ColumnStats:
+    """statistics of one column used by the planner: row count, distinct count,
+    min / max, whether the column is sorted and an equi-depth histogram.
+    Distinct count, histogram and the min / max of text columns are estimated from a
+    sample of large columns; `bounds` holds the values at the BINS + 1 quantiles of the column
+    """
+
+    BINS = 32
+    SAMPLE_SIZE = 1 << 16
+
+    def __init__(self, values):
+        """
+        :param values: 1-D np array (the column)
+        """
+        self.num_rows = len(values)
+        self.numeric = values.dtype.kind in "iuf"
+        self.sorted = bool(np.all(values[1:] >= values[:-1])) if self.num_rows > 1 else True
+        if self.num_rows == 0:
+            self.distinct = 0
+            self.min = self.max = None
+            self.bounds = values[:0]
+            return
+        sample = values
+        if self.num_rows > self.SAMPLE_SIZE:
+            rng = np.random.default_rng(self.num_rows)
+            sample = values[rng.choice(self.num_rows, self.SAMPLE_SIZE, replace=False)]
+        uniques, counts = np.unique(sample, return_counts=True)
+        self.distinct = self.__estimate_distinct(len(sample), uniques, counts)
+        if self.sorted:
+            self.min, self.max = values[0], values[-1]
+        elif self.numeric:
+            self.min, self.max = values.min(), values.max()
+        else:
+            self.min, self.max = uniques[0], uniques[-1]
+        sample = np.sort(sample)
+        self.bounds = sample[np.linspace(0, len(sample) - 1, self.BINS + 1).round().astype(np.int64)]
+
+    def to_dict(self):
+        """ :return: JSON serializable dict of the statistics, see from_dict
+        """
+        def plain(value):
+            return value.item() if isinstance(value, np.generic) else value
+        return {"num_rows": self.num_rows, "numeric": self.numeric, "sorted": self.sorted,
+                "distinct": self.distinct, "min": plain(self.min), "max": plain(self.max),
+                "bounds": self.bounds.tolist()}
+
+    @classmethod
+    def from_dict(cls, d, dtype):
+        """ restore statistics saved with to_dict without reading the column
+        :param d: dict returned by to_dict
+        :param dtype: dtype of the column
+        :return: ColumnStats
+        """
+        stats = cls.__new__(cls)
+        stats.num_rows, stats.numeric, stats.sorted = d["num_rows"], d["numeric"], d["sorted"]
+        stats.distinct, stats.min, stats.max = d["distinct"], d["min"], d["max"]
+        stats.bounds = np.array(d["bounds"], dtype=dtype if stats.numeric else str)
+        return stats
+
+    def __estimate_distinct(self, sample_size, uniques, counts):
+        """ scale the number of distinct values of the sample up to the whole column
+        (GEE estimator: values seen once stand for sqrt(num_rows / sample size) values)
+        """
+        if sample_size == self.num_rows:
+            return len(uniques)
+        singles = int(np.count_nonzero(counts == 1))
+        if singles == sample_size:
+            # no value was seen twice: the column is most likely a key
+            return self.num_rows
+        estimate = np.sqrt(self.num_rows / sample_size) * singles + (len(uniques) - singles)
+        return int(min(max(estimate, len(uniques)), self.num_rows))
+
+    def merge(self, other):
+        """ statistics of this column followed by the rows described by `other` (used when
+        rows of the same type are appended). Counts and the sorted flag stay exact,
+        distinct count and histogram are estimated
+        :return: ColumnStats
+        """
+        if other.num_rows == 0:
+            return self
+        if self.num_rows == 0:
+            return other
+        merged = ColumnStats.__new__(ColumnStats)
+        merged.num_rows = self.num_rows + other.num_rows
+        merged.numeric = self.numeric
+        merged.min = min(self.min, other.min)
+        merged.max = max(self.max, other.max)
+        merged.sorted = self.sorted and other.sorted and self.max <= other.min
+        # distinct values of the appended rows only add up where their ranges do not overlap
+        overlap = 1.0
+        if merged.numeric and merged.max > merged.min:
+            low, high = max(self.min, other.min), min(self.max, other.max)
+            overlap = max(high - low, 0) / (merged.max - merged.min)
+        merged.distinct = int(min(max(self.distinct, other.distinct) + (1 - overlap) * min(self.distinct, other.distinct),
+                                  merged.num_rows))
+        # weighted quantiles of the two histograms
+        bounds = np.concatenate((self.bounds, other.bounds))
+        weights = np.concatenate((np.full(len(self.bounds), self.num_rows / len(self.bounds)),
+                                  np.full(len(other.bounds), other.num_rows / len(other.bounds))))
+        order = np.argsort(bounds, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        targets = np.linspace(cumulative[0], cumulative[-1], self.BINS + 1)
+        merged.bounds = bounds[order][np.minimum(np.searchsorted(cumulative, targets), len(bounds) - 1)]
+        return merged
+
+    def fraction_below(self, value, inclusive):
+        """ estimated fraction of rows with a value < `value` (<= if inclusive)
+        """
+        if self.num_rows == 0:
+            return 0.0
+        if self.numeric:
+            if value < self.min or (value == self.min and not inclusive):
+                return 0.0
+            if value > self.max or (value == self.max and inclusive):
+                return 1.0
+            fraction = float(np.interp(value, self.bounds, np.linspace(0, 1, len(self.bounds))))
+        else:
+            fraction = np.searchsorted(self.bounds, value, "right" if inclusive else "left") / len(self.bounds)
+        # values equal to `value` count once per distinct value
+        equal = 1.0 / max(self.distinct, 1)
+        return min(max(fraction + (equal / 2 if inclusive else -equal / 2), 0.0), 1.0)
+
+    def selectivity(self, comparator, value):
+        """ estimated fraction of rows satisfying `column comparator value`
+        :param comparator: one of =, !=, <, >, ≤, ≥
+        :param value: constant of the type of the column
+        :return: float between 0 and 1
+        """
+        if self.num_rows == 0:
+            return 0.0
+        if comparator in ("=", "!="):
+            outside = self.numeric and (value < self.min or value > self.max)
+            equal = 0.0 if outside else 1.0 / max(self.distinct, 1)
+            return equal if comparator == "=" else 1.0 - equal
+        if comparator == "<":
+            return self.fraction_below(value, False)
+        if comparator == "≤":
+            return self.fraction_below(value, True)
+        if comparator == ">":
+            return 1.0 - self.fraction_below(value, True)
+        return 1.0 - self.fraction_below(value, False)
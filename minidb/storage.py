@@ -0,0 +1,198 @@
+import json
+import os
+import struct
+import uuid
+import numpy as np
+from minidb.index import HashTable, Index
+from minidb.stats import ColumnStats
+from minidb.table import Table
+
+
+class ArrayFile:
+    """file holding named 1-D arrays.
+    Layout: MAGIC, the length of the header (little-endian uint64), the JSON header
+    (the dtype, offset and size of every array and what the subclass adds), then one blob
+    per array starting at a multiple of ALIGNMENT. Offsets are relative to the first blob.
+    Files are read by memory mapping: nothing but the header is read until an array is used
+    """
+
+    MAGIC = None
+    VERSION = 2
+    ALIGNMENT = 64
+
+    @classmethod
+    def __align(cls, n):
+        return -(-n // cls.ALIGNMENT) * cls.ALIGNMENT
+
+    @classmethod
+    def write(cls, path, header, arrays):
+        """ write `arrays` and `header` to `path`. The file is written next to `path` and
+        renamed, so a failed write leaves an existing file intact
+        :param path: path of the file
+        :param header: JSON serializable dict
+        :param arrays: list of (name, 1-D np array) pairs
+        :return: None
+        """
+        arrays = [(name, np.ascontiguousarray(array)) for name, array in arrays]
+        header = dict(header, version=cls.VERSION, arrays=[])
+        offset = 0
+        for name, array in arrays:
+            header["arrays"].append({"name": name, "dtype": array.dtype.str, "length": len(array),
+                                     "offset": offset, "nbytes": array.nbytes})
+            offset = cls.__align(offset + array.nbytes)
+        encoded = json.dumps(header).encode()
+        start = cls.__align(len(cls.MAGIC) + 8 + len(encoded))
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(cls.MAGIC)
+            f.write(struct.pack("<Q", len(encoded)))
+            f.write(encoded)
+            for spec, (_, array) in zip(header["arrays"], arrays):
+                f.seek(start + spec["offset"])
+                f.write(array.data if array.nbytes > 0 else b"")
+            # pad the file to the end of the last blob
+            f.truncate(start + offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def read_header(cls, path):
+        """ :return: header dict of the file, offset of the first blob
+        """
+        with open(path, "rb") as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError("%s is not a minidb %s" % (path, cls.__name__))
+            (length,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(length).decode())
+        if header["version"] != cls.VERSION:
+            raise ValueError("Unsupported %s version %s" % (cls.__name__, header["version"]))
+        return header, cls.__align(len(cls.MAGIC) + 8 + length)
+
+    @classmethod
+    def read(cls, path):
+        """ :return: header dict, dict name -> read-only memory-mapped array
+        """
+        header, start = cls.read_header(path)
+        arrays = {}
+        for spec in header["arrays"]:
+            dtype = np.dtype(spec["dtype"])
+            if spec["nbytes"] == 0:
+                arrays[spec["name"]] = np.zeros(spec["length"], dtype=dtype)
+            else:
+                arrays[spec["name"]] = np.memmap(path, dtype=dtype, mode="r", offset=start + spec["offset"],
+                                                 shape=(spec["length"],))
+        return header, arrays
+
+
+class IndexFile(ArrayFile):
+    """postings and key map of one index (see Index). The CSR arrays and the slots of
+    numeric hash tables are memory-mapped. A Btree (or the dict of a text hash index) is
+    stored as its entries in key order, the keys and key_order arrays, and is bulk loaded
+    on the first lookup without sorting or regrouping the column. The header holds the
+    stamp of the table file the index was built for, an index whose stamp does not match
+    is not used
+    """
+
+    MAGIC = b"MINIDBI\x01"
+
+    @classmethod
+    def save(cls, index, path, stamp):
+        """ :param index: Index to save
+        :param path: path of the file
+        :param stamp: stamp of the table file of the indexed table
+        :return: None
+        """
+        arrays = [("keys", index.keys), ("offsets", index.offsets), ("rowids", index.rowids),
+                  ("key_order", index.key_order)]
+        if index.type == "Hash" and index.keys.dtype.kind in "iuf":
+            arrays.append(("slots", index.index.table))
+        header = {"type": index.type, "column": index.col_idx, "stamp": stamp, "num_rows": index.table.num_rows}
+        cls.write(path, header, arrays)
+
+    @classmethod
+    def open(cls, table, col_idx, idx_type, path, stamp):
+        """ :return: Index on column `col_idx` of `table`, None if the file is missing or
+            was not written for this version of the table
+        """
+        try:
+            header, arrays = cls.read(path)
+        except (OSError, ValueError):
+            return None
+        if (header["stamp"], header["num_rows"], header["type"], header["column"]) != \
+                (stamp, table.num_rows, idx_type, col_idx):
+            return None
+        if "slots" in arrays:
+            keys, slots = arrays["keys"], arrays["slots"]
+            return Index.restore(table, col_idx, idx_type, arrays, lambda: HashTable.restore(keys, slots))
+        # the tree is stored as its entries in key order and bulk loaded from left to right
+        keys, key_order = arrays["keys"], arrays["key_order"]
+        return Index.restore(table, col_idx, idx_type, arrays,
+                             lambda: Index.build_map(idx_type, keys[key_order], key_order))
+
+
+class TableFile(ArrayFile):
+    """binary columnar file of one table: one array per column, the header holds the
+    schema, the column statistics, the indexes and a stamp that is new on every save.
+    Indexes are saved next to the table file (see IndexFile)
+    """
+
+    MAGIC = b"MINIDB\x00\x01"
+
+    @staticmethod
+    def index_path(path, column):
+        return "%s.%s.idx" % (path, column)
+
+    @classmethod
+    def save(cls, table, path):
+        """ write `table` and its indexes to `path`
+        :param table: Table to save
+        :param path: path of the file
+        :return: None
+        """
+        table.analyze()
+        names = list(table.col_names)
+        # text columns are fixed-width unicode, other python objects are stored as text
+        arrays = [(name, col if col.dtype != object else col.astype(str)) for name, col in zip(names, table.columns)]
+        stamp = uuid.uuid4().hex
+        header = {"num_rows": table.num_rows, "stamp": stamp,
+                  "columns": [{"name": name, "stats": table.stats(idx).to_dict()} for idx, name in enumerate(names)],
+                  "indexes": [[column, index.type] for column, index in table.indexes.items()]}
+        cls.write(path, header, arrays)
+        for column, index in table.indexes.items():
+            IndexFile.save(index, cls.index_path(path, column), stamp)
+
+    @classmethod
+    def save_index(cls, table, column, path):
+        """ write the index on `column` of `table` next to the table file `path`
+        (the table must not have changed since it was saved there)
+        :return: None
+        """
+        header, _ = cls.read_header(path)
+        IndexFile.save(table.indexes[column], cls.index_path(path, column), header["stamp"])
+
+    @classmethod
+    def open(cls, table_name, path, indexes=None):
+        """ open a file written by save, the columns are memory-mapped read only.
+        Stored indexes are opened as well, an index that is missing or out of date is rebuilt
+        :param table_name: name of the table
+        :param path: path of the file
+        :param indexes: list of (column, type) pairs of the indexes, None for the ones saved with the table
+        :return: Table
+        """
+        header, arrays = cls.read(path)
+        names = [spec["name"] for spec in header["columns"]]
+        table = Table(table_name, names)
+        table.set_columns([arrays[name] for name in names])
+        table.statistics = {idx: ColumnStats.from_dict(spec["stats"], table.col_dtypes[idx])
+                            for idx, spec in enumerate(header["columns"])}
+        for column, idx_type in (header["indexes"] if indexes is None else indexes):
+            index = IndexFile.open(table, table.col_names[column], idx_type, cls.index_path(path, column),
+                                   header["stamp"])
+            if index is not None:
+                table.indexes[column] = index
+            else:
+                print("Index on %s.%s is missing or out of date, rebuilding it" % (table_name, column))
+                (table.btree_index if idx_type == "Btree" else table.hash_index)(column)
+        return table
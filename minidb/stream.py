@@ -0,0 +1,273 @@
+import numpy as np
+from minidb.argparser import ArgParser
+from minidb.loader import Loader
+from minidb.parallel import finish_partials, merge_partials, partial_aggregate
+from minidb.table import Table
+
+
+class TypesChanged(Exception):
+    """a chunk did not fit the column types inferred so far, they were widened and the
+    scan has to start over"""
+
+
+class StreamTable:
+    """table backed by a vertical bar delimited file that is never held in memory as a whole.
+    select and project return a new StreamTable with one more stage in its pipeline, nothing
+    is read. Aggregates (count, sum, avg, the group-bys and aggregate) and printing read the
+    file one chunk at a time, run the stages on every chunk and merge partial aggregates, so
+    memory is bounded by the chunk size and the number of groups. Column types are inferred
+    from the first rows like the bulk loader does; a scan that meets a value that does not fit
+    starts over with the widened types, so results equal those of the in-memory table.
+    Other operators read the whole pipeline into an in-memory table first (see materialize)
+    """
+
+    # operators that are evaluated chunk by chunk
+    OPERATORS = ("select", "project", "count", "sum", "avg", "aggregate", "sumgroup", "avggroup", "countgroup")
+    # approximate size of the text of one chunk
+    CHUNK_BYTES = 1 << 24
+
+    def __init__(self, name, file, stages=(), source=None):
+        """
+        :param name: name of the table
+        :param file: path of the vertical bar delimited file
+        :param stages: list of ("select", Criteria) / ("project", column names) run on every chunk
+        :param source: state shared by the tables reading the same file
+        """
+        self.name = name
+        self.file = file
+        self.stages = list(stages)
+        # column types of the file (see Loader) and whether a complete scan confirmed them
+        self.source = source if source is not None else {"col_types": None, "final": False}
+        # only known once the table was counted
+        self.num_rows = None
+        self.indexes = {}
+        self.head = None
+
+    @property
+    def col_names(self):
+        return self.__head().col_names
+
+    @property
+    def num_columns(self):
+        return self.__head().num_columns
+
+    def chunks(self):
+        """ read the file and run the stages, one chunk at a time
+        :return: generator of Tables
+        :raise TypesChanged: if a chunk widened the type of a column
+        """
+        loader = Loader(self.file, chunk_bytes=self.CHUNK_BYTES, col_types=self.source["col_types"])
+        for columns in loader.chunks():
+            if self.source["col_types"] is None:
+                self.source["col_types"] = list(loader.col_types)
+            elif loader.col_types != self.source["col_types"]:
+                self.source["col_types"] = list(loader.col_types)
+                self.source["final"] = False
+                raise TypesChanged()
+            table = Table(self.name, loader.col_names)
+            table.set_columns(columns)
+            yield self.__apply(table)
+        self.source["final"] = True
+
+    def __apply(self, table, select=True):
+        """ run the stages on one chunk (only the projections if not `select`)
+        :return: Table
+        """
+        for cmd, arg in self.stages:
+            if cmd == "project":
+                table = table.projection(self.name, arg)
+            elif select:
+                table = table.select(self.name, arg)
+        return table
+
+    def scan(self, consume):
+        """ :param consume: function reading a generator of chunks (see chunks)
+        :return: result of consume, run again from the first chunk when column types change
+        """
+        while True:
+            try:
+                return consume(self.chunks())
+            except TypesChanged:
+                continue
+
+    def __head(self):
+        """ first chunk of the pipeline (empty if the file has no rows), it gives the schema
+        :return: Table
+        """
+        if self.head is None:
+            self.head = self.scan(lambda chunks: next(chunks, None))
+            if self.head is None:
+                with open(self.file) as f:
+                    names = [s.strip() for s in f.readline().split("|")]
+                # there are no column types to check the selections against, and no rows
+                self.head = self.__apply(Table(self.name, names), select=False)
+        return self.head
+
+    def __stage(self, out_table_name, cmd, arg):
+        return StreamTable(out_table_name, self.file, self.stages + [(cmd, arg)], self.source)
+
+    def select(self, out_table_name, criteria):
+        """ rows satisfying `criteria`, read when the result is used
+        :return: StreamTable or None if the criteria cannot be evaluated on this table
+        """
+        if self.__head().select(out_table_name, criteria) is None:
+            return None
+        return self.__stage(out_table_name, "select", criteria)
+
+    def projection(self, name, columns):
+        """ the given columns, read when the result is used
+        :return: StreamTable or None if a column is not present
+        """
+        if self.__head().projection(name, columns) is None:
+            return None
+        return self.__stage(name, "project", columns)
+
+    def materialize(self):
+        """ read the whole pipeline into memory
+        :return: Table
+        """
+        def consume(chunks):
+            return [chunk for chunk in chunks]
+
+        parts = self.scan(consume)
+        if len(parts) == 0:
+            return self.__head()
+        table = Table(self.name, parts[0].col_names)
+        table.set_columns([np.concatenate([part.get_column(idx) for part in parts])
+                           for idx in range(table.num_columns)])
+        self.num_rows = table.num_rows
+        return table
+
+    def count(self, out_table_name):
+        self.num_rows = self.scan(lambda chunks: sum(chunk.num_rows for chunk in chunks))
+        result_table = Table(out_table_name, ["count"])
+        result_table.set_columns([np.array([self.num_rows], dtype=np.int64)])
+        return result_table
+
+    def __total(self, column, function):
+        """ :param function: what the sum is used for, for the message
+        :return: sum of `column`, number of rows (None, None if the column is not present or not numeric)
+        """
+        if column not in self.col_names:
+            print("Invalid command. Column %s not present in table" % column)
+            return None, None
+        idx = self.col_names[column]
+        if not self.__head().is_col_numeric(idx):
+            print("Invalid command. Cannot compute %s of text column %s" % (function, column))
+            return None, None
+
+        def consume(chunks):
+            total, count = 0, 0
+            for chunk in chunks:
+                total = total + np.sum(chunk.get_column(idx))
+                count += chunk.num_rows
+            return total, count
+
+        return self.scan(consume)
+
+    def avg(self, out_table_name, column):
+        total, count = self.__total(column, "avg")
+        if total is None:
+            return None
+        result_table = Table(out_table_name, ["avg_" + column])
+        result_table.set_columns([np.array([np.round(total / count, 4) if count > 0 else np.nan])])
+        return result_table
+
+    def sum(self, out_table_name, column):
+        total, _ = self.__total(column, "sum")
+        if total is None:
+            return None
+        result_table = Table(out_table_name, ["sum_" + column])
+        result_table.set_columns([np.array([total])])
+        return result_table
+
+    def aggregate(self, out_table_name, aggregates, groupby_columns):
+        """ see Table.aggregate. Every chunk is aggregated on its own and merged into the
+        partial aggregates of the chunks before it
+        :return: resulting table or None if a column is not present
+        """
+        head = self.__head()
+        for col in groupby_columns + [c for f, c in aggregates if f != "count"]:
+            if col not in head.col_names:
+                print("Invalid command. Column %s not present in table" % col)
+                return None
+        for function, column in aggregates:
+            if function in ("sum", "avg") and not head.is_col_numeric(head.col_names[column]):
+                print("Invalid command. Cannot compute %s of text column %s" % (function, column))
+                return None
+        key_idxs = [head.col_names[col] for col in groupby_columns]
+        positions = [(f, None if f == "count" else head.col_names[c]) for f, c in aggregates]
+        col_idxs = set(key_idxs) | {idx for f, idx in positions if f != "count"}
+
+        def partial(chunk):
+            columns = {idx: chunk.get_column(idx) for idx in col_idxs}
+            return partial_aggregate(columns, 0, chunk.num_rows, key_idxs, positions)
+
+        def consume(chunks):
+            merged = None
+            for chunk in chunks:
+                result = partial(chunk)
+                merged = result if merged is None else merge_partials([merged, result], len(key_idxs), positions)
+            return merged
+
+        merged = self.scan(consume)
+        keys, partials = merged if merged is not None else partial(head)
+        names = [f if c == "*" else f + "_" + c for f, c in aggregates]
+        result_table = Table(out_table_name, names + groupby_columns)
+        result_table.set_columns(finish_partials(partials, positions) + keys)
+        return result_table
+
+    def avggroup(self, out_table_name, avg_column, groupby_columns):
+        return self.aggregate(out_table_name, [("avg", avg_column)], groupby_columns)
+
+    def sumgroup(self, out_table_name, sum_column, groupby_columns):
+        return self.aggregate(out_table_name, [("sum", sum_column)], groupby_columns)
+
+    def countgroup(self, out_table_name, count_column, groupby_columns):
+        return self.aggregate(out_table_name, [("count", count_column)], groupby_columns)
+
+    def print(self, f=None, num_rows=None, header=True):
+        """ print the rows chunk by chunk (see Table.print). The file is scanned once first
+        if no scan has confirmed the column types yet, so no row is printed with a narrower type
+        """
+        if not self.source["final"]:
+            self.count(self.name)
+
+        def consume(chunks):
+            remaining = num_rows
+            first = True
+            total = 0
+            for chunk in chunks:
+                if remaining is not None and remaining <= 0:
+                    return None
+                chunk.print(f, remaining, header and first)
+                first = False
+                total += chunk.num_rows
+                if remaining is not None:
+                    remaining -= chunk.num_rows
+            if first and header:
+                self.__head().print_columns(f)
+            return total
+
+        total = self.scan(consume)
+        if total is not None:
+            self.num_rows = total
+
+    def describe(self):
+        """ :return: JSON serializable description of the pipeline, see restore
+        """
+        return {"stream": self.file, "stages": [[cmd, arg.criteria_str if cmd == "select" else arg]
+                                                for cmd, arg in self.stages]}
+
+    @classmethod
+    def restore(cls, name, description):
+        """ :param description: dict returned by describe
+        :return: StreamTable
+        """
+        stages = []
+        for cmd, arg in description["stages"]:
+            if cmd == "select":
+                # the criteria text still ends with the closing parenthesis of the statement
+                arg = ArgParser("select", "(%s,%s" % (name, arg)).get_args()[2]
+            stages.append((cmd, arg))
+        return cls(name, description["stream"], stages)
@@ -1,6 +1,12 @@
 import operator
 import numpy as np
+from minidb.groupby import GroupBy
 from minidb.index import Index
+from minidb.parallel import Parallel
+from minidb.explain import Profiler
+from minidb.extsort import ExternalSort
+from minidb.predicate import Rows, conditions, estimate
+from minidb.stats import ColumnStats
 from minidb.utils import Utils as utils
 
 
@@ -8,48 +14,116 @@ from minidb.utils import Utils as utils
 class Table:
 
     def __init__(self, name, columns):
+        columns = list(columns)
         self.name = name
         self.num_columns = len(columns)
         self.num_rows = 0
         self.indexes = {}
         self.header = np.array([columns])
-        self.rows = np.empty([0, self.num_columns])
+        # one typed 1-D array per column (int64, float64 or fixed-width unicode), or a
+        # pending gather (source array, row positions) that is only done when the column is read
+        self.columns = [np.empty(0, dtype=str) for _ in columns]
         self.col_names = {}
         self.col_dtypes = {}
+        # column position -> ColumnStats, computed when first needed. The dict is replaced
+        # (not cleared) when the data changes, so copies of the table can share it
+        self.statistics = {}
         for idx, col in enumerate(columns):
             self.col_names[col] = idx
 
-    def is_col_numeric(self,idx):
-        if self.__is_col_int(idx) or self.__is_col_float(idx):
-            return True
-        else:
-            return False
+    @property
+    def columns(self):
+        """typed arrays of all columns, pending columns are gathered.
+        Operators that only need some columns should use get_column
+        :return: list of 1-D np arrays
+        """
+        return [self.get_column(idx) for idx in range(len(self.__columns))]
 
-    def __is_col_int(self, idx):
-        try:
-            int(self.rows[0][idx])
-            return True
-        except ValueError:
-            return False
+    @columns.setter
+    def columns(self, columns):
+        self.__columns = list(columns)
 
-    def __is_col_float(self, idx):
-        try:
-            float(self.rows[0][idx])
-            return True
-        except ValueError:
-            return False
-
-    def __get_col_with_dtype(self, idx):
-        if self.__is_col_int(idx):
-            to_return = self.rows[:, idx].astype(int)
-            return to_return
-        elif self.__is_col_float(idx):
-            return self.rows[:, idx].astype(float)
-        else:  # return as string
-            return self.rows[:, idx]
+    @property
+    def rows(self):
+        """row-major copy of the table data. Materialized on every access,
+        operators should work on `columns` instead
+        :return: 2-D np array of python objects
+        """
+        rows = np.empty((self.num_rows, self.num_columns), dtype=object)
+        for idx, col in enumerate(self.columns):
+            rows[:, idx] = col
+        return rows
+
+    def is_col_numeric(self, idx):
+        return utils.is_numeric_dtype(self.__dtype(idx))
+
+    def __dtype(self, idx):
+        col = self.__columns[idx]
+        return col[0].dtype if isinstance(col, tuple) else col.dtype
+
+    def get_column(self, idx):
+        """ get the typed array holding column `idx`, a pending column is gathered (once)
+        :param idx: position of the column in the table
+        :return: 1-D np array
+        """
+        col = self.__columns[idx]
+        if isinstance(col, tuple):
+            source, positions = col
+            col = source[positions]
+            self.__columns[idx] = col
+        return col
+
+    def sources(self, positions=None, idxs=None):
+        """ describe columns `idxs` restricted to the rows at `positions` without gathering them.
+        Positions are composed with the positions of pending columns (once per distinct array)
+        :param positions: row positions into this table, None for all rows
+        :param idxs: positions of the columns, None for all columns
+        :return: list of (source array, row positions into it or None) pairs
+        """
+        composed = {}
+        result = []
+        for idx in (range(self.num_columns) if idxs is None else idxs):
+            col = self.__columns[idx]
+            source, base = col if isinstance(col, tuple) else (col, None)
+            if positions is not None and base is not None:
+                if id(base) not in composed:
+                    composed[id(base)] = base[positions]
+                base = composed[id(base)]
+            elif positions is not None:
+                base = positions
+            result.append((source, base))
+        return result
+
+    def set_sources(self, sources):
+        """set columns from (source array, row positions) pairs, see `sources`.
+        The rows are gathered when a column is first read
+        :return: None
+        """
+        self.__columns = [source if positions is None else (source, positions) for source, positions in sources]
+        if len(sources) > 0:
+            source, positions = sources[0]
+            self.num_rows = len(source) if positions is None else len(positions)
+        else:
+            self.num_rows = 0
+        self.set_dtypes()
+        self.statistics = {}
+
+    def take(self, out_table_name, positions=None, columns=None):
+        """new table with the rows at `positions` (in that order) and the given columns.
+        Columns are shared or gathered lazily, so reading a few columns of the result
+        only copies those
+        :param out_table_name: name of the resulting table
+        :param positions: row positions, None for all rows
+        :param columns: names of the columns, None for all columns
+        :return: Table
+        """
+        names = list(self.col_names) if columns is None else columns
+        table = Table(out_table_name, names)
+        table.set_sources(self.sources(positions, [self.col_names[col] for col in names]))
+        return table
 
     def __get_length(self):
-        return len(self.rows)
+        return self.num_rows
 
     def __auto_increment(self):
         self.num_rows += 1
@@ -61,69 +135,146 @@ class Table:
         else:
             return None
 
+    def __numeric_column_idx(self, column, function):
+        """ :param function: what is computed over the column, for the message
+        :return: position of `column`, None if it is not present or not numeric
+        """
+        idx = self.__get_column_idx(column)
+        if idx is None:
+            print("Invalid command. Column %s not present in table" % column)
+            return None
+        if not self.is_col_numeric(idx):
+            print("Invalid command. Cannot compute %s of text column %s" % (function, column))
+            return None
+        return idx
+
     def __get_max_col_width(self):
-        col_width = 1;
-        for col_idx, dtype in self.col_dtypes.items():
-            if dtype:
-                w = len(max(self.rows[:, col_idx], key=len))
+        col_width = 1
+        for col in self.columns:
+            if len(col) > 0:
+                w = int(np.char.str_len(col.astype(str)).max())
                 if col_width < w:
                     col_width = w
         return col_width+2
 
     def copy(self, out_table_name):
-        """create a "deep" copy of the input table
+        """create a copy of the input table. Column arrays are never modified in place
+        and are shared, indexes are copied on write
         :return: copied table
         """
         out_table = Table(out_table_name, self.col_names.keys())
-        out_table.rows = self.rows
-        out_table.num_rows = self.num_rows
-        out_table.indexes = self.indexes
+        out_table.set_sources(self.sources())
+        # copy-on-write snapshots: later appends to either table do not affect the other
+        out_table.indexes = {col: index.snapshot(out_table) for col, index in self.indexes.items()}
         out_table.header = self.header
         out_table.col_names = self.col_names
-        out_table.col_dtypes = self.col_dtypes
+        out_table.col_dtypes = dict(self.col_dtypes)
+        out_table.statistics = self.statistics
         out_table.num_columns = self.num_columns
         return out_table
 
+    def set_columns(self, columns):
+        """set typed column arrays, length of table, and data types for columns
+        :param columns: list of 1-D np arrays, one per column
+        :return: None
+        """
+        self.columns = [np.asarray(col) for col in columns]
+        self.num_rows = len(self.columns[0]) if len(self.columns) > 0 else 0
+        self.set_dtypes()
+        self.statistics = {}
+
+    def stats(self, idx):
+        """ statistics of column `idx`, computed on first use
+        :return: ColumnStats
+        """
+        if idx not in self.statistics:
+            self.statistics[idx] = ColumnStats(self.get_column(idx))
+        return self.statistics[idx]
+
+    def analyze(self):
+        """ compute the statistics of every column (done when a table is loaded)
+        :return: None
+        """
+        for idx in range(self.num_columns):
+            self.stats(idx)
+
     def set_data(self, rows):
         """set rows, length of table, and data types for columns
-        :param rows: np array of table data
+        :param rows: row-major table data
         :return: None
         """
-        self.rows = np.array(rows)
-        self.num_rows = len(rows)
-        if self.num_rows > 0:
-            self.set_dtypes
+        if len(rows) == 0:
+            self.num_rows = 0
+            return
+        rows = np.array(rows, dtype=object)
+        self.set_columns([utils.infer_column(rows[:, idx]) for idx in range(self.num_columns)])
 
     def set_dtypes(self):
-        for col in list(self.col_names.keys()):
-            idx = self.__get_column_idx(col)
-            if self.__is_col_int(idx):
-                self.col_dtypes[idx] = 1
-            elif self.__is_col_float(idx):
-                # set to 0 so condition can be checked as a bool
-                self.col_dtypes[idx] = 0
-            else:
-                self.col_dtypes[idx] = 2
+        for idx in range(len(self.__columns)):
+            self.col_dtypes[idx] = self.__dtype(idx)
 
     def insert_row(self, new_row):
-        self.rows = np.concatenate((self.rows, new_row))
-        self.__auto_increment()
+        new_row = np.array(new_row, dtype=object)
+        self.__append_columns([utils.infer_column(new_row[:, idx]) for idx in range(self.num_columns)])
+
+    def __append_columns(self, columns):
+        """append rows (given as one typed array per column) and update the indexes
+        and statistics. New postings are merged into each index; an index is only rebuilt when
+        the appended values change the type of its column (e.g. int -> float)
+        :param columns: list of 1-D np arrays, one per column
+        :return: None
+        """
+        first_rowid = self.num_rows
+        old_kinds = [self.__dtype(idx).kind for idx in range(self.num_columns)]
+        statistics = self.statistics
+        if first_rowid == 0:
+            self.set_columns(columns)
+        else:
+            self.set_columns([np.concatenate((a, b)) for a, b in zip(self.columns, columns)])
+            # statistics that were collected are merged with those of the new rows of the same
+            # type, the others are computed again when needed
+            self.statistics = {idx: stats.merge(ColumnStats(columns[idx])) for idx, stats in statistics.items()
+                               if old_kinds[idx] == columns[idx].dtype.kind == self.__dtype(idx).kind}
+        for column, index in self.indexes.items():
+            if first_rowid == 0 or old_kinds[index.col_idx] != self.__dtype(index.col_idx).kind:
+                self.indexes[column] = Index(self, index.col_idx, index.type)
+            else:
+                index.append(self.get_column(index.col_idx)[first_rowid:], first_rowid)
+
+    def append(self, other):
+        """append the rows of `other` (with the same schema) to this table in place
+        :param other: table whose rows are appended
+        :return: success True/False
+        """
+        if other.num_columns != self.num_columns:
+            print("Invalid command. Tables %s and %s have different schemas" % (self.name, other.name))
+            return False
+        self.__append_columns(other.columns)
+        return True
 
-    def print(self, f=None, num_rows=None):
+    def __format_rows(self, num_rows, sep, width=None):
+        """render the first `num_rows` rows as lines of text
+        :return: list of strings, one per row
+        """
+        str_cols = [col[:num_rows].astype(str) for col in self.columns]
+        if width is not None:
+            str_cols = [np.char.ljust(col, width) for col in str_cols]
+        return [sep.join(values) for values in zip(*str_cols)]
+
+    def print(self, f=None, num_rows=None, header=True):
         """ print contents of the table
         :param f: file to print to. Prints to stdout if None
         :param num_rows: num of rows to print
+        :param header: print the column names first
         :return: None
         """
-        self.print_columns(f)
+        if header:
+            self.print_columns(f)
         if num_rows is None:
             num_rows = self.num_rows
-        for i in range(0, num_rows):
-            for idx, value in enumerate(self.rows[i]):
-                if idx != 0:
-                    print(" | ", end='', file=f)
-                print(value, end='', file=f)
-            print("", file=f)
+        lines = self.__format_rows(num_rows, " | ")
+        if len(lines) > 0:
+            print("\n".join(lines), file=f)
 
     def print_columns(self, f=None):
         """ print column names (separated by |)
@@ -137,13 +288,11 @@ class Table:
             print(name, end='', file=f)
         print("", file=f)
 
-    def print_formatted(self, f=None, *args,**kwargs):
+    def print_formatted(self, f=None, *args, **kwargs):
         """ print contents of the table
         :param f: file to print to. Prints to stdout if None
         :return: None
         """
-        if self.num_rows > 0:
-            self.set_dtypes()
         col_width = self.__get_max_col_width()
         # print header
         self.print_columns_formatted(col_width, f)
@@ -151,13 +300,10 @@ class Table:
             num_rows = kwargs["num_rows"]
         else:
             num_rows = self.num_rows
-        # print table rows (separated by |)
-        for i in range(0, num_rows):
-            for idx, value in enumerate(self.rows[i]):
-                if idx != 0:
-                    print("", end='', file=f)
-                print(str(value).ljust(col_width), end='', file=f)
-            print("")
+        # print table rows
+        lines = self.__format_rows(num_rows, "", col_width)
+        if len(lines) > 0:
+            print("\n".join(lines), file=f)
 
     def print_columns_formatted(self, col_width, f=None):
         """ print column names (separated by |)
@@ -176,191 +322,267 @@ class Table:
         if len(columns) > self.num_columns:
             return None
 
-        idx = []
-        projected_table = Table(name, columns)
-
-        # create a list of indexes of given columns
         for col in columns:
             if col not in self.col_names:
                 print("Invalid command. Column not present in table")
                 return None
-            idx.append(self.__get_column_idx(col))
 
-        # insert a row, but only include columns with index in `idx`
-        for row in self.rows:
-            new_row = []
-            for i in idx:
-                new_row.append(row[i])
-            projected_table.insert_row(np.array([new_row]))
+        # columns are never modified in place, so the projection shares them with this table
+        return self.take(name, None, columns)
 
-        return projected_table
+    def concat(self, out_table_name, other):
+        """ rows of this table followed by the rows of `other` (with the same schema)
+        :param out_table_name: name of the resulting table
+        :param other: table to append
+        :return: resulting table or None if the schemas do not match
+        """
+        result_table = self.copy(out_table_name)
+        if not result_table.append(other):
+            return None
+        return result_table
 
     def sort(self, result_table_name, columns):
-        """sort table in ascending order on given column(s)
+        """sort table in ascending order on given column(s). Tables larger than the
+        memory budget are sorted externally (see ExternalSort)
         :param result_table_name: name of table to output
         :param columns: ordered list of columns to sort on
         :return: None if column does not exist or sorted result table
         """
-        result_table = Table(result_table_name, self.col_names)
-        if (self.num_rows)>0:
-            idx = []
-            for col in columns:
-                if col not in self.col_names:
-                    print("Invalid command. Column not present in table")
-                    return None
-                else:
-                    i = self.__get_column_idx(col)
-                    idx.insert(0, self.__get_col_with_dtype(i))
-            
-            order = np.lexsort(idx)
-            sorted_rows = self.rows[order]
-            result_table.rows = sorted_rows
-            result_table.num_rows = len(sorted_rows)
-        else:
-            result_table.num_rows=0
-        return result_table
-
-    def select(self, criteria):
-    # perform select. select subset of rows and return resulting table
-        for i in range(0, criteria.num_conditions):
-            idx = self.__get_column_idx(criteria.conditions[i][0])
-            if idx is None:
-                print("column %s is not present in table %s" % (criteria.conditions[i][0], self.name))
-                return False
-
-            # get comparator (>, =, !=, etc.)
-            comparator = utils.OPERATORS[criteria.comparators[i]]
-            # get value on right side of comparator
-            val = criteria.conditions[i][1]
-
-            if criteria.arithops[i] is None:
-                if utils.NUMERIC[comparator]:
-                    c_new = comparator(self.rows[:, idx].astype(float), int(val))
-                else:
-                    c_new = comparator(self.rows[:, idx], val)
+        keys = []
+        for col in columns:
+            if col not in self.col_names:
+                print("Invalid command. Column not present in table")
+                return None
             else:
-                arithop = utils.OPERATORS[criteria.arithops[i]]
-                arithm = arithop(self.rows[:, idx].astype(float), float(criteria.conditions[i][2]))
-                c_new = comparator(arithm, float(val))
+                keys.insert(0, self.__get_column_idx(col))
+
+        if ExternalSort.enabled(self.num_rows, self.col_dtypes.values()):
+            # sorted runs are spilled to temporary files and merged within the memory budget
+            table = Table(result_table_name, list(self.col_names))
+            table.set_columns(ExternalSort.sort(self, keys[::-1]))
+            return table
+        keys = [self.get_column(idx) for idx in keys]
+        # rows are reordered through a selection vector, columns are gathered when read
+        order = np.lexsort(keys) if self.num_rows > 0 else None
+        return self.take(result_table_name, order)
+
+    # (low, high, exclude_low, exclude_high) arguments of a Btree range scan, per comparator
+    RANGE_BOUNDS = {
+        "<": lambda v: (None, v, False, True),
+        "≤": lambda v: (None, v, False, False),
+        ">": lambda v: (v, None, True, False),
+        "≥": lambda v: (v, None, False, False)
+    }
+
+    # an index is only used when the estimated fraction of matching rows is at most this
+    INDEX_SELECTIVITY = 0.1
+
+    def selectivity(self, column, comparator, val):
+        """ estimated fraction of the rows satisfying `column` `comparator` `val`
+        :return: float between 0 and 1
+        """
+        return self.stats(self.col_names[column]).selectivity(comparator, val)
 
-            if i - 1 < 0:
-                c = c_new
+    def use_index(self, column, comparator, val):
+        """ True if an index on `column` supports `comparator` and the statistics estimate
+        that few rows satisfy `column` `comparator` `val` (otherwise a scan is cheaper)
+        """
+        if column not in self.indexes:
+            return False
+        if comparator != "=" and (comparator not in self.RANGE_BOUNDS or self.indexes[column].type != "Btree"):
+            return False
+        return self.selectivity(column, comparator, val) <= self.INDEX_SELECTIVITY
+
+    def index_lookup(self, column, comparator, val):
+        """ answer a single `column` `comparator` `val` condition from an index on `column`
+        if `use_index` says so
+        :return: sorted np array of row positions, None if the condition should be scanned
+        """
+        if not self.use_index(column, comparator, val):
+            return None
+        index = self.indexes[column]
+        if comparator == "=":
+            ids = index.lookup(val)
+        else:
+            ids = index.range_lookup(*self.RANGE_BOUNDS[comparator](val))
+        if ids is not None:
+            Profiler.count("index_lookups")
+            Profiler.count("index_hits", len(ids))
+        return ids
+
+    def explain_select(self, criteria):
+        """ describe how `select` evaluates `criteria` without running it
+        :return: dict with the estimated number of rows, whether the scan runs in parallel and the
+            access path (index or scan) and estimated selectivity of every condition
+        """
+        try:
+            predicate = criteria.predicate.bind(self)
+        except ValueError as e:
+            return {"error": str(e)}
+        rows = Rows(self, index_lookup=self.index_lookup, selectivity=self.selectivity)
+        paths = []
+        for condition in conditions(predicate):
+            value = condition.constant()
+            indexed = value is not None and self.use_index(condition.left.name, condition.comparator, value)
+            paths.append({"condition": str(condition), "selectivity": condition.selectivity(rows),
+                          "access": "index (%s)" % self.indexes[condition.left.name].type if indexed else "scan"})
+        parallel = Parallel.enabled(self.num_rows) and len(self.indexes) == 0
+        return {"estimated_rows": int(round(estimate(predicate, rows) * self.num_rows)),
+                "workers": Parallel.workers if parallel else 1, "conditions": paths}
+
+    def select(self, out_table_name, criteria):
+        """select subset of rows satisfying `criteria`.
+        The criteria AST is evaluated in one vectorized pass over the columns.
+        Selective conditions comparing a column with a constant are answered from an index
+        on that column when one exists (Hash or Btree for =, Btree for <, >, ≤, ≥), the
+        others are scanned from the most to the least selective one
+        :param out_table_name: name of the resulting table
+        :param criteria: ArgParser.Criteria object
+        :return: resulting table or None if a column is not present
+        """
+        try:
+            predicate = criteria.predicate.bind(self)
+            if Parallel.enabled(self.num_rows) and len(self.indexes) == 0:
+                # full scan: every worker filters one row partition
+                rowids = Parallel.select(self, predicate)
             else:
-                logic_operator = utils.OPERATORS[criteria.logic_operators[i-1]]
-                c = logic_operator(c_new, c)
-        
-        return self.rows[np.where(c)]
+                with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+                    selection = predicate.evaluate(Rows(self, index_lookup=self.index_lookup,
+                                                        selectivity=self.selectivity))
+                rowids = np.flatnonzero(selection) if selection.dtype == bool else selection
+        except ValueError as e:
+            print(e)
+            return None
+
+        # the result only keeps the selection vector, columns are gathered when read
+        return self.take(out_table_name, rowids)
 
     def avg(self, out_table_name, column):
         # will average have multiple columns?
+        idx = self.__numeric_column_idx(column, "avg")
+        if idx is None:
+            return None
         result_table = Table(out_table_name, ["avg_"+column])
-        idx = self.__get_column_idx(column)
-        avg = np.mean(self.rows[:, idx].astype(float))
-        avg = "{:.4f}".format(avg)
-        result_table.insert_row([[avg]])
+        if Parallel.enabled(self.num_rows):
+            avg = Parallel.aggregate(self, [], [("avg", idx)])[0][0][0]
+        else:
+            avg = np.round(np.mean(self.get_column(idx)), 4)
+        result_table.set_columns([np.array([avg])])
         return result_table
 
     def sum(self, out_table_name, column):
         # will average have multiple columns?
+        idx = self.__numeric_column_idx(column, "sum")
+        if idx is None:
+            return None
         result_table = Table(out_table_name, ["sum_"+column])
-        idx = self.__get_column_idx(column)
-        s = np.sum(self.rows[:, idx].astype(float))
-        s = "{:.4f}".format(s)
-        result_table.insert_row([[s]])
+        if Parallel.enabled(self.num_rows):
+            s = Parallel.aggregate(self, [], [("sum", idx)])[0][0][0]
+        else:
+            s = np.sum(self.get_column(idx))
+        result_table.set_columns([np.array([s])])
         return result_table
 
     def count(self, out_table_name):
         result_table = Table(out_table_name, ["count"])
-        result_table.insert_row([[self.__get_length()]])
+        result_table.set_columns([np.array([self.__get_length()], dtype=np.int64)])
         return result_table
 
     def group(self, columns):
-        projection = self.projection("projection", columns)
-        keys, indices = np.unique(projection.rows, axis=0, return_inverse=True)
-        # print(keys)
-        groups = [[] for i in range(len(keys))]
-        for i, k in enumerate(indices):
-            groups[k].append(self.rows[i])
-        groups = [np.array(x) for x in groups]
-        return keys, groups
+        """group the rows of the table by the values in `columns`
+        :param columns: names of the columns to group by
+        :return: GroupBy object
+        """
+        return GroupBy([self.get_column(self.__get_column_idx(col)) for col in columns], self.num_rows)
+
+    def aggregate(self, out_table_name, aggregates, groupby_columns):
+        """compute several aggregates over the same grouping in one pass
+        corresponds to:
+            SELECT f1(c1), f2(c2), ..., `groupby_columns` FROM table GROUP BY `groupby_columns`
+        :param out_table_name: name of the resulting table
+        :param aggregates: list of (function, column) pairs, function is one of
+            sum, avg, count, min, max. Column is ignored for count (use "*")
+        :param groupby_columns: names of columns to group by (may be empty)
+        :return: resulting table or None if a column is not present
+        """
+        for col in groupby_columns + [c for f, c in aggregates if f != "count"]:
+            if col not in self.col_names:
+                print("Invalid command. Column %s not present in table" % col)
+                return None
+        for function, column in aggregates:
+            if function in ("sum", "avg") and self.__numeric_column_idx(column, function) is None:
+                return None
+        names = [f if c == "*" else f + "_" + c for f, c in aggregates]
+        result_table = Table(out_table_name, names + groupby_columns)
+        if Parallel.enabled(self.num_rows):
+            # partial aggregates per row partition, merged per group
+            results, keys = Parallel.aggregate(self, [self.__get_column_idx(col) for col in groupby_columns],
+                                               [(f, self.__get_column_idx(c)) for f, c in aggregates])
+            result_table.set_columns(results + keys)
+            return result_table
+        groups = self.group(groupby_columns)
+        results = []
+        for function, column in aggregates:
+            values = None if function == "count" else self.get_column(self.__get_column_idx(column))
+            results.append(groups.aggregate(function, values))
+        result_table.set_columns(results + groups.keys)
+        return result_table
 
     def avggroup(self, out_table_name, avg_column, groupby_columns):
-        result_table = Table(out_table_name, ["avg_"+avg_column] + groupby_columns)
-        avg_idx = self.__get_column_idx(avg_column)
-        keys, groups = self.group(groupby_columns)
-        for i in range(0,len(groups)):
-            s = np.mean(groups[i][:, avg_idx].astype(float))
-            new_row = np.insert(keys[i], 0, "{:.4f}".format(s))
-            result_table.insert_row([new_row])
-        return result_table
+        return self.aggregate(out_table_name, [("avg", avg_column)], groupby_columns)
 
     def sumgroup(self, out_table_name, sum_column, groupby_columns):
-        result_table = Table(out_table_name, ["sum_" + sum_column] + groupby_columns)
-        sum_idx = self.__get_column_idx(sum_column)
-        keys, groups = self.group(groupby_columns)
-        for i in range(0, len(groups)):
-            if self.__is_col_int(sum_idx):
-                s = np.sum(groups[i][:, sum_idx].astype(int))
-            else:
-                s = np.sum(groups[i][:, sum_idx].astype(float))
-            new_row = np.insert(keys[i], 0, s)
-            result_table.insert_row([new_row])
-        return result_table
+        return self.aggregate(out_table_name, [("sum", sum_column)], groupby_columns)
 
     def countgroup(self, out_table_name, count_column, groupby_columns):
-        result_table = Table(out_table_name, ["count_" + count_column] + groupby_columns)
-        count_idx = self.__get_column_idx(count_column)
-        keys, groups = self.group(groupby_columns)
-        for i in range(0, len(groups)):
-            s = len(groups[i])
-            new_row = np.insert(keys[i], 0, s)
-            result_table.insert_row([new_row])
-        return result_table
+        return self.aggregate(out_table_name, [("count", count_column)], groupby_columns)
 
     def movavg(self, out_table_name, column, n):
+        idx = self.__numeric_column_idx(column, "movavg")
+        if idx is None:
+            return None
         result_table = Table(out_table_name, list(self.col_names.keys()) + ["mov_avg"])
         weights = np.ones(n)
-        c = self.rows[:, self.__get_column_idx(column)].astype(float)
+        c = self.get_column(idx).astype(float)
         c = np.concatenate((np.zeros(n - 1), c), axis=None)
         o = np.concatenate((np.zeros(n - 1), np.ones(len(c))))
         sum_vec = np.convolve(c, weights, 'valid')
-        div_vec = np.convolve(o, weights, 'valid')
-        avg_vec = [x/y for x, y in zip(sum_vec, div_vec)]
+        div_vec = np.convolve(o, weights, 'valid')[:len(sum_vec)]
+        avg_vec = sum_vec / div_vec
 
-        avg_vec = np.vstack(avg_vec)
-        new_rows = np.hstack((self.rows,avg_vec))
-        result_table.rows = new_rows
-        result_table.num_rows = len(avg_vec)
+        result_table.set_sources(self.sources() + [(avg_vec, None)])
         return result_table
 
     def movsum(self, out_table_name, column, n):
+        idx = self.__numeric_column_idx(column, "movsum")
+        if idx is None:
+            return None
         result_table = Table(out_table_name, list(self.col_names.keys()) + ["mov_sum"])
         weights = np.ones(n)
-        c = self.rows[:, self.__get_column_idx(column)].astype(float)
+        c = self.get_column(idx).astype(float)
         c = np.concatenate((np.zeros(n - 1), c), axis=None)
         sum_vec = np.convolve(c, weights, 'valid')
 
-        sum_vec = np.vstack(sum_vec)
-        new_rows = np.hstack((self.rows,sum_vec))
-        result_table.rows = new_rows
-        result_table.num_rows = len(sum_vec)
+        result_table.set_sources(self.sources() + [(sum_vec, None)])
         return result_table
 
     def btree_index(self, column):
+        if column not in self.col_names:
+            print("Invalid command. Column %s not present in table" % column)
+            return
         index = Index(self, self.__get_column_idx(column), "Btree")
         # index.print()
         self.indexes[column] = index
 
     def hash_index(self, column):
+        if column not in self.col_names:
+            print("Invalid command. Column %s not present in table" % column)
+            return
         index = Index(self, self.__get_column_idx(column), "Hash")
         # index.print()
         self.indexes[column] = index
 
-    def apply_hash_transformation(self, column, constant, arithop_):
-        arithop = utils.OPERATORS[arithop_]
-        transformed_index = Index(self, self.__get_column_idx(column), "Hash_Transform", (arithop,constant))        
-        self.indexes[column + "_tr"] = transformed_index
-
     def index_list(self):
         for key, idx in self.indexes.items():
-            print("%-15s %-15s %-15s" % (self.name, key, idx.type))
+            print("%-15s %-15s %-15s %-15.3f %-15.1f" % (self.name, key, idx.type, idx.build_time * 1000,
+                                                         idx.nbytes / 1024))
@@ -1,5 +1,6 @@
 import re
 import operator
+import numpy as np
 
 # a class for all static helper functions
 class Utils:
@@ -12,11 +13,6 @@ class Utils:
         "/": operator.truediv, "-": operator.sub, "^": operator.pow
     }
 
-    NUMERIC = {
-        operator.lt: True, operator.gt: True, operator.eq: False, operator.ne: False,
-        operator.ge: True, operator.le: True, operator.and_: False, operator.or_: False
-    }
-
     REVERSE_COMPARATOR = {
         "<": ">",
         "=": "=",
@@ -26,29 +22,9 @@ class Utils:
         "≤": "≥"
     }
 
-    # COMPARATOR_VALUES = {
-    # "<":">", "=":"1", "!=":"!=", ">":"<","≥":"≤","≥":"≤"
-    # }
-
     def __init__(self):
         pass
 
-    # @staticmethod
-    # def is_int(x):
-    #     try:
-    #         int(x)
-    #         return True
-    #     except ValueError:
-    #         return False
-
-    # @staticmethod
-    # def is_float(x):
-    #     try:
-    #         float(x)
-    #         return True
-    #     except ValueError:
-    #         return False
-
     @staticmethod
     def is_numeric(x):
         try:
@@ -57,10 +33,51 @@ class Utils:
         except ValueError:
             return False
 
+    @staticmethod
+    def infer_column(values):
+        """convert a column of raw values into a typed array
+        int64 if every value is an integer, float64 if every value is a number,
+        otherwise a fixed-width unicode array
+        :param values: 1-D np array (strings or python objects)
+        :return: typed 1-D np array
+        """
+        values = np.asarray(values)
+        if values.dtype.kind == "O":
+            # let numpy pick the narrowest common type of the python objects
+            values = np.array(values.tolist())
+        if values.dtype.kind in "iub":
+            return values.astype(np.int64)
+        if values.dtype.kind == "f":
+            return values.astype(np.float64)
+        if len(values) == 0:
+            return values.astype(str)
+        for dtype in (np.int64, np.float64):
+            try:
+                return values.astype(dtype)
+            except (ValueError, OverflowError):
+                continue
+        return values.astype(str)
+
+    @staticmethod
+    def is_numeric_dtype(dtype):
+        return dtype.kind in "iuf"
+
     @staticmethod
     def remove_parentheses(params):
         return params.replace(")", "").replace("(", "")
 
+    @staticmethod
+    def parse_explain(txt):
+        """ split the explain / explain analyze prefix off a statement
+        :return: None, "explain" or "analyze", rest of the statement
+        """
+        words = txt.split(None, 2)
+        if len(words) < 2 or words[0] != "explain":
+            return None, txt
+        if words[1] == "analyze" and len(words) == 3:
+            return "analyze", words[2]
+        return "explain", txt.split(None, 1)[1]
+
     @staticmethod
     def parse(txt):
         txt = txt.replace(" ", "")  # remove all whitespaces
@@ -77,5 +94,4 @@ class Utils:
         cmd, _ = txt.split("(", 1)  # extract command
         args = txt.replace(cmd, "")  # remove command from text, only args remain
 
-        # print(table_name, cmd, args)
         return table_name, cmd, args
@@ -44,6 +44,27 @@ def join_assert(count, correct_count):
     assert count == correct_count
 
 
+def nested_loop_pairs(join):
+    """reference join comparing the rows pair by pair in python, the vectorized joins are checked against it.
+    Text never equals a number and is not ordered against one
+    :return: positions of the matching rows in t1, positions of the matching rows in t2
+    """
+    import numpy as np
+    from minidb.utils import Utils
+    sides = []
+    for i in range(join.criteria.num_conditions):
+        val1, val2, comparator = join.get_sides(i)
+        sides.append((val1.tolist(), val2.tolist(), comparator))
+    pos1, pos2 = [], []
+    for i in range(join.t1.num_rows):
+        for j in range(join.t2.num_rows):
+            if all(comparator == "!=" if isinstance(val1[i], str) != isinstance(val2[j], str)
+                   else Utils.OPERATORS[comparator](val1[i], val2[j]) for val1, val2, comparator in sides):
+                pos1.append(i)
+                pos2.append(j)
+    return np.array(pos1, dtype=np.int64), np.array(pos2, dtype=np.int64)
+
+
 def test(get_db):
     db = get_db
     # test taking input from file
@@ -156,3 +177,732 @@ def test_criteria_parsing(get_argparser):
     criteria_assert(parser, "join", "(t1,t2, ( t1.time + 10 > t2.T+10 ) and  (t1.saleid=t2.saleid))",
                     [["t1", "saleid", "t2", "saleid"], ["t1", "time", "t2", "T"]], ["=", ">"],
                     [[None, None], ["+", "+"]], [[None, None], ["10", "10"]], ["and"])
+
+
+def test_typed_columns(get_db):
+    import numpy as np
+    db = get_db
+    db.input_from_file("R", "data/sales1")
+    r = db.tables["R"]
+    assert r.get_column(r.col_names["qty"]).dtype == np.int64, "Numeric column not inferred as int64"
+    assert r.get_column(r.col_names["pricerange"]).dtype.kind == "U", "String column not kept as text"
+    # operators work on the typed columns directly
+    t = r.sort("sorted", ["qty", "saleid"])
+    assert np.all(np.diff(t.get_column(t.col_names["qty"])) >= 0)
+    s = r.sum("s", "qty")
+    assert s.get_column(0)[0] == np.sum(r.get_column(r.col_names["qty"]))
+
+
+def test_bulk_loader(tmp_path):
+    import numpy as np
+    from minidb.loader import Loader
+    # small chunks and sample force a column to be widened from int to float to string
+    path = tmp_path / "widen"
+    path.write_text("a|b|c\n" + "1|x |2\n" * 50 + "1.5|y|2\n" + "z|y|3\n")
+    col_names, columns = Loader(str(path), sample_size=10, chunk_bytes=64).load()
+    assert col_names == ["a", "b", "c"]
+    assert columns[0].dtype.kind == "U" and columns[0][-2] == "1.5" and columns[0][-1] == "z"
+    assert columns[1][0] == "x", "String values not stripped"
+    assert columns[2].dtype == np.int64 and len(columns[2]) == 52
+    # values parsed as numbers before the column became text keep the text of the file
+    path.write_text("a|b\n" + "007|1\n" * 50 + "1.50|2\n" * 50 + "z|3\n")
+    col_names, columns = Loader(str(path), sample_size=10, chunk_bytes=64).load()
+    assert columns[0].tolist() == ["007"] * 50 + ["1.50"] * 50 + ["z"]
+    assert columns[1].dtype == np.int64
+
+
+def test_select_with_index(get_db, get_argparser):
+    db = get_db
+    argparser = get_argparser
+    db.input_from_file("R", "data/sales1")
+    queries = ["(R,qty=5)", "(R,qty<5)", "(R,(qty≥45)and(itemid=7))", "(R,(qty>45)or(pricerange=cheap))",
+               "(R,(itemid≤3)or(qty=5))"]
+    expected = []
+    for q in queries:
+        _, _, criteria = argparser("select", q).get_args()
+        expected.append(db.tables["R"].select("scan", criteria).rows.tolist())
+    db.Btree("R", "qty")
+    db.Hash("R", "itemid")
+    db.Hash("R", "pricerange")
+    for q, rows in zip(queries, expected):
+        _, _, criteria = argparser("select", q).get_args()
+        assert db.tables["R"].select("indexed", criteria).rows.tolist() == rows, "Index lookup differs from scan"
+
+
+def test_join_condition_order(get_db, get_parser, get_argparser):
+    db = get_db
+    db.input_from_file("A", "data/sales1")
+    db.input_from_file("B", "data/sales2")
+    for q in ["T1:=join(A,B,A.customerid=B.C)", "T2:=join(A,B,B.C=A.customerid)"]:
+        table_name, cmd, args = get_parser.parse(q)
+        in_table, columns, criteria = get_argparser(cmd, args).get_args()
+        assert db.join(table_name, in_table, criteria) is True
+    # output columns always follow the order of the tables, not of the condition
+    assert db.tables["T1"].rows.tolist() == db.tables["T2"].rows.tolist()
+    # conditions on unknown columns or tables are rejected before a join algorithm is chosen
+    for q in ["T3:=join(A,B,A.nothere=B.C)", "T3:=join(A,B,(A.qty<B.Q)and(C.qty=B.C))", "T3:=join(A,B,A.qty<B.nothere)"]:
+        table_name, cmd, args = get_parser.parse(q)
+        in_table, columns, criteria = get_argparser(cmd, args).get_args()
+        assert db.join(table_name, in_table, criteria) is False, q
+        assert db.run(table_name, cmd, in_table, columns, criteria) is None, q
+    assert "T3" not in db.tables
+
+
+def test_band_join(get_db, get_parser, get_argparser):
+    from minidb.join import Join
+    import numpy as np
+    db = get_db
+    db.input_from_file("A", "data/sales1")
+    db.input_from_file("B", "data/sales2_medium")
+    queries = ["E:=join(A,B,(B.Q<A.qty))", "E:=join(A,B,(A.qty≤B.Q))", "E:=join(A,B,(A.qty!=B.Q))",
+               "E:=join(A,B,(B.Q<A.qty)and(A.saleid>B.saleid))", "E:=join(A,B,(A.time>B.Q)and(A.qty≤B.Q))",
+               "E:=join(A,B,(A.pricerange<B.P))", "E:=join(A,B,(A.pricerange≥B.Q))",
+               "E:=join(A,B,(A.pricerange!=B.Q)and(A.qty<B.Q))", "E:=join(A,B,(A.pricerange!=B.Q))"]
+    for q in queries:
+        table_name, cmd, args = get_parser.parse(q)
+        in_table, columns, criteria = get_argparser(cmd, args).get_args()
+        join = Join(db.tables["A"], db.tables["B"], criteria)
+        assert join.choose()[0] == "band", q
+        band = join.bandjoin()
+        loop = nested_loop_pairs(join)
+        assert np.array_equal(band[0], loop[0]) and np.array_equal(band[1], loop[1]), q
+
+
+def test_arithmetic_join(get_db, get_parser, get_argparser):
+    from minidb.join import Join
+    import numpy as np
+    db = get_db
+    db.input_from_file("A", "data/sales1_medium")
+    db.input_from_file("B", "data/sales2_medium")
+    queries = ["E:=join(A,B,(36-A.saleid=B.saleid))", "E:=join(A,B,(A.qty*2>B.Q)and(A.saleid=B.saleid))",
+               "E:=join(A,B,(A.qty=B.Q/2))", "E:=join(A,B,(A.qty*2>B.Q+3))"]
+    for q in queries:
+        table_name, cmd, args = get_parser.parse(q)
+        in_table, columns, criteria = get_argparser(cmd, args).get_args()
+        join = Join(db.tables["A"], db.tables["B"], criteria)
+        fast = join.do_join()
+        loop = nested_loop_pairs(join)
+        assert np.array_equal(fast[0], loop[0]) and np.array_equal(fast[1], loop[1]), q
+
+
+def test_aggregate(get_db, get_parser, get_argparser):
+    import numpy as np
+    db = get_db
+    db.input_from_file("R", "data/sales1")
+    table_name, cmd, args = get_parser.parse("R8 := aggregate(R, sum(qty), avg(time), count(*), max(qty) group by pricerange)")
+    in_table, aggregates, groupby_columns = get_argparser(cmd, args).get_args()
+    assert aggregates == [("sum", "qty"), ("avg", "time"), ("count", "*"), ("max", "qty")]
+    assert groupby_columns == ["pricerange"]
+    assert db.aggregate(table_name, in_table[0], aggregates, groupby_columns) is True
+    r, t = db.tables["R"], db.tables["R8"]
+    assert list(t.col_names) == ["sum_qty", "avg_time", "count", "max_qty", "pricerange"]
+    qty = r.get_column(r.col_names["qty"])
+    price = r.get_column(r.col_names["pricerange"])
+    for i, key in enumerate(t.get_column(4)):
+        assert t.get_column(0)[i] == qty[price == key].sum()
+        assert t.get_column(2)[i] == np.count_nonzero(price == key)
+        assert t.get_column(3)[i] == qty[price == key].max()
+    # single aggregate commands go through the same engine
+    s = r.sumgroup("s", "qty", ["pricerange"])
+    assert np.array_equal(s.get_column(0), t.get_column(0))
+
+
+def test_concat(get_db):
+    db = get_db
+    db.input_from_file("A", "data/sales1")
+    db.input_from_file("B", "data/sales1_small")
+    assert db.concat("C", ["A", "B"]) is True
+    a, b, c = db.tables["A"], db.tables["B"], db.tables["C"]
+    assert c.num_rows == a.num_rows + b.num_rows, "Rows lost in concat"
+    assert c.rows[a.num_rows:].tolist() == b.rows.tolist()
+    db.input_from_file("S", "data/sales2_small")
+    db.project("P", "S", ["saleid", "Q"])
+    assert db.concat("D", ["A", "P"]) is False, "Should have rejected different schemas"
+    # columns whose types differ are concatenated as text, their statistics are computed again
+    db.project("Q", "A", ["pricerange", "saleid", "itemid", "customerid", "storeid", "time", "qty"])
+    assert db.concat("E", ["A", "Q"]) is True
+    e = db.tables["E"]
+    assert e.stats(6).num_rows == e.num_rows and e.stats(0).numeric is False
+
+
+def test_index_structures(get_db):
+    import numpy as np
+    from BTrees.LLBTree import LLBTree
+    db = get_db
+    db.input_from_file("S", "data/sales2_medium")
+    s = db.tables["S"]
+    db.Hash("S", "saleid")
+    db.Btree("S", "Q")
+    db.Hash("S", "P")
+    assert isinstance(s.indexes["Q"].index, LLBTree), "Integer column should use an integer keyed BTree"
+    saleid = s.get_column(s.col_names["saleid"])
+    q = s.get_column(s.col_names["Q"])
+    price = s.get_column(s.col_names["P"])
+    for key in np.unique(saleid):
+        assert np.array_equal(s.indexes["saleid"].lookup(key), np.flatnonzero(saleid == key))
+    assert len(s.indexes["saleid"].lookup(-1)) == 0
+    assert np.array_equal(s.indexes["P"].lookup(price[0]), np.flatnonzero(price == price[0]))
+    # ranges follow numeric (not lexicographic) order
+    assert np.array_equal(s.indexes["Q"].range_lookup(9, 10), np.flatnonzero((q >= 9) & (q <= 10)))
+    assert np.array_equal(s.indexes["Q"].range_lookup(2.5, None, True), np.flatnonzero(q > 2.5))
+
+
+def test_incremental_index(get_db):
+    import numpy as np
+    from minidb.index import Index
+    db = get_db
+    db.input_from_file("A", "data/sales1")
+    db.input_from_file("B", "data/sales1_small")
+    db.Hash("A", "itemid")
+    db.Btree("A", "qty")
+    db.Hash("A", "pricerange")
+    db.Btree("B", "qty")
+    before = db.tables["A"].indexes["itemid"].lookup(7).copy()
+
+    # concat result carries indexes covering the rows of both tables
+    assert db.concat("C", ["A", "B"]) is True
+    assert db.append("B", "A") is True
+    for name in ("C", "B"):
+        t = db.tables[name]
+        for column, index in t.indexes.items():
+            fresh = Index(t, index.col_idx, index.type)
+            values = t.get_column(index.col_idx)
+            for key in np.unique(values):
+                assert np.array_equal(index.lookup(key), fresh.lookup(key)), "Stale postings"
+        qty = t.get_column(t.col_names["qty"])
+        assert np.array_equal(t.indexes["qty"].range_lookup(10, 30), np.flatnonzero((qty >= 10) & (qty <= 30)))
+
+    # appending to the copy leaves the original's indexes untouched
+    a = db.tables["A"]
+    assert np.array_equal(a.indexes["itemid"].lookup(7), before)
+    assert np.array_equal(a.indexes["itemid"].lookup(7), np.flatnonzero(a.get_column(a.col_names["itemid"]) == 7))
+
+
+def test_predicate(get_db, get_argparser):
+    db = get_db
+    db.input_from_file("R", "data/sales1")
+    r = db.tables["R"]
+    qty = r.get_column(r.col_names["qty"])
+    itemid = r.get_column(r.col_names["itemid"])
+    pricerange = r.get_column(r.col_names["pricerange"])
+    queries = {
+        "(R,qty<5.5)": qty < 5.5,
+        # and binds tighter than or
+        "(R,qty>5 and itemid<10 or itemid=3)": ((qty > 5) & (itemid < 10)) | (itemid == 3),
+        "(R,(qty*2>itemid+10)and((pricerange=cheap)or(itemid=7)))":
+            (qty * 2 > itemid + 10) & ((pricerange == "cheap") | (itemid == 7)),
+        "(R,(qty+1)*2≥2^4)": (qty + 1) * 2 >= 16,
+        "(R,-qty<-40)": -qty < -40,
+    }
+    for indexed in (False, True):
+        if indexed:
+            db.Btree("R", "qty")
+            db.Hash("R", "itemid")
+        for q, mask in queries.items():
+            _, _, criteria = get_argparser("select", q).get_args()
+            assert r.select("S", criteria).rows.tolist() == r.rows[mask].tolist(), q
+    _, _, criteria = get_argparser("select", "(R,foo=3)").get_args()
+    assert r.select("S", criteria) is None, "Missing column not reported"
+    # a bare text constant glued to and/or is an error, not an empty result
+    with pytest.raises(ValueError, match="quote"):
+        get_argparser("select", "(R,pricerange=cheaporitemid=7)").get_args()
+    _, _, criteria = get_argparser("select", "(R,pricerange=cheaporitemid)").get_args()
+    assert r.select("S", criteria) is None
+    for q, mask in {"(R,pricerange='cheap'oritemid=7)": (pricerange == "cheap") | (itemid == 7),
+                    "(R,pricerange=standard)": pricerange == "standard"}.items():
+        _, _, criteria = get_argparser("select", q).get_args()
+        assert r.select("S", criteria).rows.tolist() == r.rows[mask].tolist(), q
+
+
+def test_lazy_plan(get_db, get_parser, get_argparser):
+    from minidb.database import Database
+    from minidb.plan import Node
+    script = ["R1:=select(R,(time>50)or(qty<30))", "R2:=project(R1,saleid,qty,pricerange)",
+              "R3:=avg(R1,qty)", "R4:=sumgroup(R1,time,qty)", "R5:=sort(R2,qty,saleid)",
+              "R6:=aggregate(R1,count(*),max(qty)groupbypricerange)", "T:=join(R1,S,R1.customerid=S.C)",
+              "C:=count(T)"]
+    lazy = Database()
+    assert lazy.set("lazy", "on") is True
+    lazy.input_from_file("R", "data/sales1")
+    lazy.input_from_file("S", "data/sales2")
+    parsed = {}
+    for q in script:
+        table_name, cmd, args = get_parser.parse(q)
+        parsed[table_name] = get_argparser(cmd, args).get_args()
+        assert lazy.defer(table_name, cmd, *parsed[table_name]) is True
+    assert all(isinstance(lazy.tables[name], Node) for name in parsed), "Statements not deferred"
+
+    eager = get_db
+    eager.input_from_file("R", "data/sales1")
+    eager.input_from_file("S", "data/sales2")
+    eager.select("R1", "R", parsed["R1"][2])
+    eager.project("R2", "R1", parsed["R2"][1])
+    eager.avg("R3", "R1", "qty")
+    eager.sumgroup("R4", "R1", "time", ["qty"])
+    eager.sort("R5", "R2", ["qty", "saleid"])
+    eager.aggregate("R6", "R1", parsed["R6"][1], parsed["R6"][2])
+    eager.join("T", ["R1", "S"], parsed["T"][2])
+    eager.count("C", "T")
+    # R1 is read by several statements, it is computed once and kept
+    for name in ["R5", "R3", "R4", "R6", "C", "R1"]:
+        assert lazy.force(name) is True
+        assert lazy.tables[name].rows.tolist() == eager.tables[name].rows.tolist(), name
+
+    # inputs are snapshots: an append between deferring and forcing does not change the result
+    for q in ["A:=select(R,qty>0)", "N:=count(A)"]:
+        table_name, cmd, args = get_parser.parse(q)
+        assert lazy.defer(table_name, cmd, *get_argparser(cmd, args).get_args()) is True
+    eager.select("A", "R", get_argparser("select", "(R,qty>0)").get_args()[2])
+    eager.count("N", "A")
+    assert lazy.append("R", "R1") is True
+    assert lazy.force("N") is True
+    assert lazy.tables["N"].rows.tolist() == eager.tables["N"].rows.tolist()
+
+def test_late_materialization(get_db, get_argparser):
+    import numpy as np
+    db = get_db
+    db.input_from_file("R", "data/sales1")
+    r = db.tables["R"]
+    _, _, criteria = get_argparser("select", "(R,qty>30)").get_args()
+    s = r.select("S", criteria)
+    # the select result only holds a selection vector over the columns of R
+    assert all(positions is not None for _, positions in s.sources()), "Select copied columns"
+    o = s.sort("O", ["time", "saleid"])
+    p = o.projection("P", ["saleid", "qty"])
+    expected = r.rows[r.get_column(r.col_names["qty"]) > 30]
+    expected = expected[np.lexsort((expected[:, 0].astype(int), expected[:, 4].astype(int)))]
+    assert p.rows.tolist() == expected[:, [0, 5]].tolist()
+    # reading columns of the projection did not gather the other columns of the sort result
+    assert all(positions is not None for _, positions in o.sources()), "Unread columns were gathered"
+    assert o.rows.tolist() == expected.tolist()
+
+
+def test_parallel(get_db, get_argparser):
+    from minidb.parallel import Parallel
+    db = get_db
+    db.input_from_file("R", "data/sales1")
+    r = db.tables["R"]
+    _, _, criteria = get_argparser("select", "(R,(qty*2>itemid+10)and(pricerange=cheap)or(time<20))").get_args()
+    aggregates = [("sum", "qty"), ("avg", "time"), ("count", "*"), ("min", "pricerange"), ("max", "qty")]
+
+    def run():
+        return [r.select("S", criteria).rows.tolist(), r.aggregate("A", aggregates, ["pricerange", "storeid"]).rows.tolist(),
+                r.aggregate("B", aggregates, []).rows.tolist(), r.avg("C", "qty").rows.tolist(),
+                r.sum("D", "qty").rows.tolist()]
+
+    serial = run()
+    min_rows = Parallel.min_rows
+    try:
+        for pool in ("thread", "process"):
+            assert db.set("pool", pool) is True
+            assert db.set("workers", "4") is True
+            Parallel.configure(min_rows=0)
+            assert run() == serial, "Parallel %s results differ" % pool
+    finally:
+        db.set("workers", "1")
+        Parallel.configure(pool="thread", min_rows=min_rows)
+    assert db.set("workers", "0") is False
+
+
+def test_partitioned_join(get_db, get_parser, get_argparser):
+    import numpy as np
+    from minidb.join import Join
+    db = get_db
+    db.input_from_file("A", "data/sales1")
+    db.input_from_file("B", "data/sales2")
+    queries = ["D:=join(A,B,A.saleid=B.saleid)", "D1:=join(A,B,A.saleid*2=B.saleid)",
+               "E:=join(A,B,(A.customerid=B.C)and(A.pricerange=B.P))", "E3:=join(A,B,(A.qty≤B.Q)and(A.customerid=B.C))"]
+    joins = []
+    for q in queries:
+        _, cmd, args = get_parser.parse(q)
+        _, _, criteria = get_argparser(cmd, args).get_args()
+        joins.append(Join(db.tables["A"], db.tables["B"], criteria))
+    expected = [join.do_join() for join in joins]
+    try:
+        for pool in ("thread", "process"):
+            db.set("pool", pool)
+            db.set("workers", "3")
+            assert db.set("join", "partitioned") is True
+            for join, (pos1, pos2) in zip(joins, expected):
+                result = join.do_join()
+                assert np.array_equal(result[0], pos1) and np.array_equal(result[1], pos2), "Partitioned join differs"
+    finally:
+        db.set("workers", "1")
+        db.set("pool", "thread")
+        db.set("join", "auto")
+
+
+def test_statistics(get_db, get_parser, get_argparser):
+    import numpy as np
+    from minidb.join import Join
+    db = get_db
+    db.input_from_file("A", "data/sales1")
+    db.input_from_file("B", "data/sales2")
+    A = db.tables["A"]
+    assert len(A.statistics) == A.num_columns, "Statistics are not collected at load time"
+    qty = A.get_column(A.col_names["qty"])
+    stats = A.stats(A.col_names["qty"])
+    assert (stats.num_rows, stats.distinct, stats.min, stats.max) == (1000, len(np.unique(qty)), qty.min(), qty.max())
+    for comparator, value in (("<", 10), ("≥", 45), ("=", 5), ("!=", 5)):
+        exact = np.count_nonzero(get_parser.OPERATORS[comparator](qty, value)) / len(qty)
+        assert abs(stats.selectivity(comparator, value) - exact) < 0.05, "Selectivity estimate is off"
+
+    # appended rows update the statistics
+    db.concat("C", ["A", "A"])
+    C = db.tables["C"]
+    C.stats(C.col_names["saleid"])
+    C.append(db.tables["A"])
+    assert C.stats(C.col_names["saleid"]).num_rows == 3000 and C.stats(C.col_names["saleid"]).distinct == 1000
+
+    # unselective conditions are scanned even with an index
+    db.Btree("A", "qty")
+    assert A.index_lookup("qty", "<", 5) is not None
+    assert A.index_lookup("qty", ">", 5) is None
+
+    db.tables["S"] = db.tables["B"].sort("S", ["C"])
+    db.tables["a"] = A.take("a", np.arange(10))
+    cases = [("X:=join(A,B,A.customerid=B.C)", "hash", "A"), ("X:=join(A,S,A.customerid=S.C)", "merge", "S"),
+             ("X:=join(S,A,A.customerid=S.C)", "merge", "S"), ("X:=join(a,A,(a.qty<A.qty)and(a.itemid=A.itemid))", "nested loop", None)]
+    for q, algorithm, build_side in cases:
+        _, cmd, args = get_parser.parse(q)
+        in_tables, _, criteria = get_argparser(cmd, args).get_args()
+        join = Join(db.tables[in_tables[0]], db.tables[in_tables[1]], criteria)
+        pos1, pos2 = join.do_join()
+        assert (join.algorithm, join.build_side) == (algorithm, build_side), "Unexpected join plan for %s" % q
+        # reference: probe the factorized keys of t2 without statistics
+        val1, val2, _ = join.get_sides(0)
+        codes1, codes2, _ = Join.factorize(val1, val2)
+        expected = join.check_remaining_conditions(*Join.equi_pairs(codes1, codes2), 1)
+        assert np.array_equal(pos1, expected[0]) and np.array_equal(pos2, expected[1]), "Join result differs"
+
+
+def test_explain(get_db, get_parser, get_argparser):
+    db = get_db
+    db.input_from_file("A", "data/sales1")
+    db.input_from_file("B", "data/sales2")
+    db.Btree("A", "qty")
+    assert get_parser.parse_explain("explain analyze T := join(A, B, A.saleid = B.saleid)") == \
+        ("analyze", "T := join(A, B, A.saleid = B.saleid)")
+    assert get_parser.parse_explain("explain T := count(A)") == ("explain", "T := count(A)")
+    assert get_parser.parse_explain("T := count(A)") == (None, "T := count(A)")
+
+    def explain(txt, analyze=False):
+        table_name, cmd, args = get_parser.parse(txt)
+        in_table, columns, criteria = get_argparser(cmd, args).get_args()
+        return db.explain(table_name, cmd, in_table, columns, criteria, analyze)
+
+    plan = explain("R:=select(A,(qty<3)and(time>50))")
+    select = plan["operators"][0]
+    assert [c["access"] for c in select["details"]["conditions"]] == ["index (Btree)", "scan"]
+    assert select["children"][0]["table"] == "A" and "R" not in db.tables, "explain must not run the statement"
+
+    result = explain("R:=select(A,(qty<3)and(time>50))", analyze=True)["operators"][0]
+    assert result["rows_in"] == 1000 and result["rows_out"] == db.tables["R"].num_rows
+    qty = db.tables["A"].get_column(db.tables["A"].col_names["qty"])
+    assert result["index_lookups"] == 1 and result["index_hits"] == int((qty < 3).sum())
+    assert result["time_ms"] >= 0 and result["bytes"] >= 0
+
+    plan = explain("J:=join(A,B,A.customerid=B.C)")["operators"][0]
+    assert (plan["details"]["algorithm"], plan["details"]["build"], plan["details"]["probe"]) == ("hash", "A", "B")
+    join = explain("J:=join(A,B,(A.customerid=B.C)and(A.qty>B.Q))", analyze=True)["operators"][0]
+    pairs = join["children"][0]
+    assert pairs["details"]["algorithm"] == "hash" and join["rows_out"] == db.tables["J"].num_rows
+    assert [child["operator"] for child in pairs["children"]] == ["keys", "hash", "filter"]
+    assert pairs["children"][-1]["rows_out"] == join["rows_out"]
+
+    # deferred inputs are part of the plan
+    db.set("lazy", "on")
+    db.defer("L", "select", "B", None, get_argparser("select", "(B,Q>40)").get_args()[2])
+    plan = explain("K:=count(L)", analyze=True)["operators"][0]
+    assert plan["children"][0]["operator"] == "select" and plan["children"][0]["rows_out"] == plan["rows_in"]
+
+
+def test_benchmark_suite(tmp_path, capsys):
+    from benchmarks.generate import generate
+    from benchmarks.suite import CASES, run_cases
+    paths = generate(str(tmp_path / "a"), 2000, seed=3, skew=0.5)
+    again = generate(str(tmp_path / "b"), 2000, seed=3, skew=0.5)
+    for path, other in zip(paths, again):
+        with open(path) as f, open(other) as g:
+            assert f.read() == g.read(), "Generated data is not reproducible"
+    results = run_cases(str(tmp_path / "a"), repeat=1)
+    assert [r["name"] for r in results] == [name for name, _ in CASES]
+    rows = {r["name"]: r["rows"] for r in results}
+    assert rows["load_sales1"] == rows["load_sales2"] == 2000
+    assert rows["select_scan"] == rows["select_btree"] and rows["select_scan_itemid"] == rows["select_hash"]
+
+
+def test_sqlite_oracle(tmp_path, capsys):
+    from benchmarks.generate import generate
+    from benchmarks.oracle import CASES, run_cases, same_rows
+    assert same_rows([(1, "a", 2.00004)], [(1, "a", 2.0)]) and not same_rows([(1, "a")], [(1, "b")])
+    assert not same_rows([(1, 2), (2, 1)], [(2, 1), (1, 2)], num_keys=1), "Order of sort keys not checked"
+    generate(str(tmp_path), 1500, seed=1, skew=0.5)
+    results = run_cases(str(tmp_path), repeat=1)
+    assert len(results) == len(CASES)
+    assert [r["name"] for r in results if not r["match"]] == [], "minidb differs from SQLite"
+
+
+def test_save_open(get_db, get_argparser, tmp_path):
+    import numpy as np
+    db = get_db
+    db.input_from_file("A", "data/sales1")
+    db.select("B", "A", get_argparser("select", "(A,qty<10)").get_args()[2])
+    path = str(tmp_path / "b.mdb")
+    assert db.save("B", path) and db.open("C", path)
+    B, C = db.tables["B"], db.tables["C"]
+    assert list(C.col_names) == list(B.col_names) and C.num_rows == B.num_rows
+    assert all(isinstance(col.base, np.memmap) for col in C.columns), "Columns are not memory-mapped"
+    for idx in range(B.num_columns):
+        assert C.col_dtypes[idx] == B.col_dtypes[idx] and np.array_equal(C.get_column(idx), B.get_column(idx))
+    assert len(C.statistics) == C.num_columns and C.stats(0).to_dict() == B.stats(0).to_dict()
+
+    # opened tables are ordinary tables: indexes, appends and queries work on them
+    db.Btree("C", "qty")
+    db.select("D", "C", get_argparser("select", "(C,qty<5)").get_args()[2])
+    assert db.tables["D"].num_rows == int((B.get_column(B.col_names["qty"]) < 5).sum())
+    db.tables["C"].append(B)
+    assert db.tables["C"].num_rows == 2 * B.num_rows
+
+    with open(str(tmp_path / "text"), "w") as f:
+        f.write("not a table")
+    assert not db.open("E", str(tmp_path / "text")) and not db.open("E", str(tmp_path / "missing"))
+
+
+def test_catalog(get_parser, get_argparser, tmp_path):
+    import numpy as np
+    from minidb.database import Database
+    path = str(tmp_path / "db")
+
+    def run(db, txt):
+        table_name, cmd, args = get_parser.parse(txt)
+        in_table, columns, criteria = get_argparser(cmd, args).get_args()
+        if cmd == "inputfromfile":
+            args = "(%s)" % os.path.abspath("data/" + in_table)
+        db.log(table_name, cmd, args)
+        if cmd == "inputfromfile":
+            db.input_from_file(table_name, "data/" + in_table)
+        elif cmd == "append":
+            db.append(in_table[0], in_table[1])
+        elif cmd == "Btree":
+            db.Btree(in_table[0], columns[0])
+        else:
+            db.run(table_name, cmd, in_table, columns, criteria)
+
+    db = Database(path)
+    for txt in ("A:=inputfromfile(sales1)", "B:=select(A,qty<10)", "Btree(B,qty)", "append(B,B)",
+                "C:=sumgroup(B,qty,pricerange)"):
+        run(db, txt)
+    expected = {name: [col.copy() for col in table.columns] for name, table in db.tables.items()}
+
+    # the process stops without a checkpoint: the log is replayed
+    recovered = Database(path)
+    assert len(recovered.catalog.records) == 5 and set(recovered.tables) == set(expected)
+    for name, columns in expected.items():
+        assert all(np.array_equal(a, b) for a, b in zip(recovered.tables[name].columns, columns))
+    assert list(recovered.tables["B"].indexes) == ["qty"]
+
+    # after a checkpoint the tables are opened from their files, a torn record is dropped
+    run(recovered, "D:=project(C,pricerange)")
+    recovered.checkpoint()
+    run(recovered, "E:=count(D)")
+    with open(os.path.join(path, "wal.log"), "a") as f:
+        f.write('{"lsn": 8, "table": "F", "cmd": "co')
+    reopened = Database(path)
+    assert [r["cmd"] for r in reopened.catalog.records] == ["count"] and "F" not in reopened.tables
+    assert isinstance(reopened.tables["A"].get_column(0).base, np.memmap)
+    assert reopened.tables["E"].get_column(0)[0] == expected["C"][0].size
+    assert list(reopened.tables["B"].indexes) == ["qty"]
+    assert np.array_equal(reopened.tables["B"].get_column(0), expected["B"][0])
+    reopened.close()
+    assert Database(path).catalog.records == []
+    assert len([f for f in os.listdir(path) if f.endswith(".mdb")]) == 5
+
+    # rows appended before a crash survive the checkpoint taken after recovering
+    with open(os.path.join(path, "notes.mdb"), "w") as f:
+        f.write("kept")
+    db = Database(path)
+    run(db, "append(A,A)")
+    recovered = Database(path)
+    assert recovered.tables["A"].num_rows == 2000
+    recovered.close()
+    assert Database(path).tables["A"].num_rows == 2000
+    # the replaced file of A is removed, files the catalog did not write are kept
+    assert len([f for f in os.listdir(path) if f.endswith(".mdb")]) == 6
+    assert os.path.exists(os.path.join(path, "notes.mdb"))
+
+    # a logged statement that raises is skipped, the statements after it are replayed
+    db = Database(path)
+    db.log("M", "movavg", "(A,qty,abc)")
+    run(db, "G:=count(A)")
+    recovered = Database(path)
+    assert "M" not in recovered.tables and recovered.tables["G"].get_column(0)[0] == 2000
+
+
+def test_persisted_indexes(get_db, tmp_path):
+    import numpy as np
+    from minidb.database import Database
+    from minidb.storage import IndexFile, TableFile
+    db = get_db
+    db.input_from_file("A", "data/sales1")
+    db.Btree("A", "qty")
+    db.Hash("A", "itemid")
+    db.Hash("A", "pricerange")
+    A = db.tables["A"]
+    path = str(tmp_path / "a.mdb")
+    assert db.save("A", path) and db.open("B", path)
+    B = db.tables["B"]
+    assert {col: index.type for col, index in B.indexes.items()} == {"qty": "Btree", "itemid": "Hash", "pricerange": "Hash"}
+    assert isinstance(B.indexes["qty"].rowids, np.memmap) and B.indexes["qty"].build_time == 0
+    for column, key in (("qty", 5), ("itemid", 7), ("pricerange", "cheap")):
+        assert np.array_equal(B.indexes[column].lookup(key), A.indexes[column].lookup(key))
+    assert np.array_equal(B.indexes["qty"].range_lookup(3, 9), A.indexes["qty"].range_lookup(3, 9))
+    # stored indexes are copied before they change
+    B.append(A)
+    itemid = B.get_column(B.col_names["itemid"])
+    assert np.array_equal(B.indexes["itemid"].lookup(7), np.flatnonzero(itemid == 7))
+
+    # an index file of another version of the table is not used
+    db.save("B", str(tmp_path / "b.mdb"))
+    stamp = TableFile.read_header(str(tmp_path / "b.mdb"))[0]["stamp"]
+    assert IndexFile.open(B, B.col_names["qty"], "Btree", TableFile.index_path(path, "qty"), stamp) is None
+    os.replace(TableFile.index_path(path, "qty"), TableFile.index_path(str(tmp_path / "b.mdb"), "qty"))
+    db.open("C", str(tmp_path / "b.mdb"))
+    assert db.tables["C"].indexes["qty"].build_time > 0, "Stale index was not rebuilt"
+
+    # indexes created after a checkpoint are added next to the unchanged table file
+    catalog = str(tmp_path / "db")
+    db = Database(catalog)
+    db.log("D", "open", "(D,%s)" % path)
+    db.open("D", path)
+    db.checkpoint()
+    db.log(None, "Btree", "(D,time)")
+    db.Btree("D", "time")
+    db.close()
+    files = sorted(os.listdir(catalog))
+    db = Database(catalog)
+    assert sorted(db.tables["D"].indexes) == ["itemid", "pricerange", "qty", "time"]
+    assert all(index.build_time == 0 for index in db.tables["D"].indexes.values())
+    assert sorted(os.listdir(catalog)) == files and len([f for f in files if f.endswith(".idx")]) == 4
+
+
+def test_streaming(get_db, get_parser, get_argparser, tmp_path, monkeypatch):
+    import numpy as np
+    from minidb.database import Database
+    from minidb.stream import StreamTable
+    monkeypatch.setattr(StreamTable, "CHUNK_BYTES", 1000)
+    db = get_db
+    db.input_from_file("A", "data/sales1")
+    streamed = Database()
+    assert streamed.set("stream", "on") and streamed.input_from_file("A", "data/sales1")
+    assert isinstance(streamed.tables["A"], StreamTable) and streamed.tables["A"].num_rows is None
+
+    def run(db, txt):
+        table_name, cmd, args = get_parser.parse(txt)
+        in_table, columns, criteria = get_argparser(cmd, args).get_args()
+        return db.run(table_name, cmd, in_table, columns, criteria)
+
+    for txt in ("B:=select(A,(qty<30) and (pricerange = cheap))", "C:=project(B,saleid,qty,pricerange)",
+                "D:=count(C)", "E:=sum(C,qty)", "F:=avg(A,time)", "G:=sumgroup(A,qty,pricerange)",
+                "H:=avggroup(B,time,storeid,pricerange)", "I:=countgroup(C,qty,pricerange)",
+                "J:=aggregate(A,sum(qty),avg(time),min(qty),max(saleid),count(*) group by pricerange)",
+                "K:=sort(C,qty,saleid)"):
+        expected, result = run(db, txt), run(streamed, txt)
+        if isinstance(result, StreamTable):
+            assert result.num_rows is None, "%s was read before it is used" % txt
+            result = result.materialize()
+        assert list(result.col_names) == list(expected.col_names), txt
+        assert all(np.array_equal(a, b) for a, b in zip(result.columns, expected.columns)), txt
+    assert run(streamed, "X:=select(A,nothere<3)") is None and run(streamed, "X:=project(A,nothere)") is None
+    # the pipeline is evaluated chunk by chunk on output as well
+    db.output_to_file("C", str(tmp_path / "memory.txt"))
+    streamed.output_to_file("C", str(tmp_path / "streamed.txt"))
+    assert (tmp_path / "memory.txt").read_text() == (tmp_path / "streamed.txt").read_text()
+    assert streamed.append("A", "D") is False
+
+    # a value past the sampled rows widens the column type, the scan starts over
+    path = tmp_path / "widen"
+    path.write_text("a|b\n" + "".join("%d|%d\n" % (i, i % 7) for i in range(3000)) + "2.5|x\n")
+    db.input_from_file("W", str(path))
+    streamed.input_from_file("W", str(path))
+    for txt in ("S:=sum(W,a)", "S:=sumgroup(W,a,b)"):
+        expected, result = run(db, txt), run(streamed, txt)
+        assert all(np.array_equal(a, b) for a, b in zip(result.columns, expected.columns)), txt
+    assert streamed.tables["W"].materialize().get_column(0).dtype == np.float64
+
+    # the catalog keeps streamed tables as their file and pipeline, not as a copy
+    catalog = str(tmp_path / "db")
+    streamed = Database(catalog)
+    for txt in ("set(stream,on)", "A:=inputfromfile(%s)" % os.path.abspath("data/sales1"),
+                "B:=select(A,(qty<30) and (pricerange = cheap))", "C:=project(B,saleid,qty)"):
+        table_name, cmd, args = get_parser.parse(txt)
+        streamed.log(table_name, cmd, args)
+        if cmd == "set":
+            streamed.set("stream", "on")
+        elif cmd == "inputfromfile":
+            streamed.input_from_file(table_name, os.path.abspath("data/sales1"))
+        else:
+            run(streamed, txt)
+    # the statements are replayed, then checkpointed
+    replayed = Database(catalog)
+    assert isinstance(replayed.tables["C"], StreamTable) and replayed.settings["stream"]
+    replayed.close()
+    reopened = Database(catalog)
+    assert reopened.settings["stream"] and not any(f.endswith(".mdb") for f in os.listdir(catalog))
+    expected = run(db, "C:=project(B,saleid,qty)")
+    result = reopened.tables["C"].materialize()
+    assert all(np.array_equal(a, b) for a, b in zip(result.columns, expected.columns))
+
+
+def test_external_sort(get_db, get_parser, get_argparser, monkeypatch):
+    import numpy as np
+    from minidb.extsort import ExternalSort
+    monkeypatch.setattr(ExternalSort, "mode", ExternalSort.mode)
+    db = get_db
+
+    def run(txt):
+        table_name, cmd, args = get_parser.parse(txt)
+        in_table, columns, criteria = get_argparser(cmd, args).get_args()
+        return db.run(table_name, cmd, in_table, columns, criteria)
+
+    db.input_from_file("R", "data/sales1")
+    db.input_from_file("S", "data/sales2")
+    run("R1:=select(R,(time > 50) or (qty < 30))")
+    run("T1:=join(R1,S,(R1.qty > S.Q) and (R1.saleid = S.saleid))")
+    statements = ("T2:=sort(T1,R1_time,S_C)", "T3:=sort(R,pricerange,qty)", "T4:=sort(R,saleid)")
+    expected = [run(txt) for txt in statements]
+    assert db.set("sort", "external") and ExternalSort.mode == "external"
+    # a small budget gives many runs, merged in several passes
+    monkeypatch.setattr(ExternalSort, "memory", 4000)
+    monkeypatch.setattr(ExternalSort, "MIN_BLOCK", 16)
+    for txt, table in zip(statements, expected):
+        result = run(txt)
+        assert isinstance(result.get_column(0).base, np.memmap), "%s was sorted in memory" % txt
+        assert list(result.col_names) == list(table.col_names)
+        assert all(np.array_equal(a, b) for a, b in zip(result.columns, table.columns)), txt
+
+    # the sort of a deferred statement is external as well
+    db.set("lazy", "on")
+    for txt in ("L1:=select(R,qty < 30)", "L2:=sort(L1,pricerange,time)"):
+        table_name, cmd, args = get_parser.parse(txt)
+        assert db.defer(table_name, cmd, *get_argparser(cmd, args).get_args()) is True
+    assert db.force("L2") is True
+    db.set("sort", "memory")
+    expected = run("L3:=sort(L1,pricerange,time)")
+    assert db.tables["L2"].rows.tolist() == expected.rows.tolist()
+
+
+def test_invalid_columns(get_db, get_argparser):
+    db = get_db
+    db.input_from_file("R", "data/sales1")
+    # missing and text columns are reported, the statement fails without raising
+    assert db.sum("X", "R", "pricerange") is False and db.avg("X", "R", "nothere") is False
+    assert db.movavg("X", "R", "pricerange", 3) is False and db.movsum("X", "R", "nothere", 3) is False
+    assert db.sumgroup("X", "R", "pricerange", ["qty"]) is False
+    assert db.aggregate("X", "R", [("avg", "pricerange"), ("count", "*")], ["qty"]) is False
+    assert db.aggregate("X", "R", [("min", "pricerange")], ["qty"]) is True
+    assert db.sort("X", "R", ["nothere"]) is False
+    db.Btree("R", "nothere")
+    db.Hash("R", "nothere")
+    db.Btree("nothere", "qty")
+    assert db.tables["R"].indexes == {} and "X" in db.tables